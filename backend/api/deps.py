@@ -57,3 +57,12 @@ async def get_current_user(token:oauth2_bearer_dependency):
     
 
 user_dependency = Annotated[dict, Depends(get_current_user)]
+
+ADMIN_USERNAMES = {u.strip() for u in os.getenv("ADMIN_USERNAMES", "").split(",") if u.strip()}
+
+async def get_admin_user(user: user_dependency):
+    if user['username'] not in ADMIN_USERNAMES:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,detail="Admin privileges required")
+    return user
+
+admin_dependency = Annotated[dict, Depends(get_admin_user)]
@@ -3,14 +3,17 @@ from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 from .routers import auth
 from .database import Base,engine
+from .migrations import upgrade_schema
 
 from .routers import chat
 from .routers import quiz
 from .routers import analytics
+from .routers import admin
 
 app = FastAPI()
 
 Base.metadata.create_all(bind=engine)
+upgrade_schema(engine)
 
 
 
@@ -30,4 +33,5 @@ def health_check():
 app.include_router(chat.router)
 app.include_router(quiz.router)
 app.include_router(auth.router)
-app.include_router(analytics.router)
\ No newline at end of file
+app.include_router(analytics.router)
+app.include_router(admin.router)
\ No newline at end of file
@@ -0,0 +1,120 @@
+"""Schema upgrades that `Base.metadata.create_all` cannot perform on existing tables.
+
+`upgrade_schema` is cheap and idempotent and runs at startup. Workers starting
+together may race on it, so a column or index another worker just added is
+skipped. Data backfills are run explicitly from the backend directory:
+
+    python -m api.migrations
+"""
+from sqlalchemy import inspect, text, update, bindparam, null
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+
+from .database import SessionLocal, engine
+from .models import UserHistory, DKTState, QuizScore, TelemetryLog
+from .services.embedding_storage import pack_embedding
+
+# Embeddings stored before the model was recorded per row came from the Gemini
+# embedding endpoint used by routers/chat.py.
+LEGACY_EMBEDDING_MODEL = "models/text-embedding-004"
+
+
+def _add_missing_columns(bind: Engine, table, column_names):
+    existing = {c["name"] for c in inspect(bind).get_columns(table.name)}
+    for name in column_names:
+        if name in existing:
+            continue
+        column = table.c[name]
+        ddl_type = column.type.compile(dialect=bind.dialect)
+        try:
+            with bind.begin() as conn:
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {name} {ddl_type}"))
+        except DBAPIError:
+            # Another worker starting at the same time may have added it first
+            if name not in {c["name"] for c in inspect(bind).get_columns(table.name)}:
+                raise
+            continue
+        print(f"MIGRATION: added {table.name}.{name}")
+
+
+def _create_missing_indexes(bind: Engine, table):
+    existing = {i["name"] for i in inspect(bind).get_indexes(table.name)}
+    for index in table.indexes:
+        if index.name in existing:
+            continue
+        try:
+            index.create(bind)
+        except DBAPIError:
+            if index.name not in {i["name"] for i in inspect(bind).get_indexes(table.name)}:
+                raise
+            continue
+        print(f"MIGRATION: created index {index.name}")
+
+
+def upgrade_schema(bind: Engine = engine):
+    _add_missing_columns(bind, UserHistory.__table__, ["embedding_blob", "embedding_model", "embedding_dim"])
+    _add_missing_columns(bind, DKTState.__table__, ["hidden_state", "last_quiz_id", "interaction_count", "model_version"])
+    for table in (UserHistory.__table__, QuizScore.__table__, TelemetryLog.__table__):
+        _create_missing_indexes(bind, table)
+
+
+def backfill_binary_embeddings(db: Session, batch_size: int = 500) -> int:
+    """Convert legacy JSON `embedding_vector` values to packed float32 blobs.
+
+    Walks the table by id in batches, writes blob/model/dim and clears the JSON
+    column so the row shrinks. Safe to re-run; returns the number of rows converted.
+    """
+    table = UserHistory.__table__
+    stmt = (
+        update(table)
+        .where(table.c.id == bindparam("row_id"))
+        .values(
+            embedding_blob=bindparam("blob"),
+            embedding_model=bindparam("model"),
+            embedding_dim=bindparam("dim"),
+            embedding_vector=null(),
+        )
+    )
+
+    last_id = 0
+    converted = 0
+    while True:
+        rows = db.query(UserHistory.id, UserHistory.embedding_vector)\
+            .filter(
+                UserHistory.id > last_id,
+                UserHistory.embedding_blob.is_(None),
+                UserHistory.embedding_vector.isnot(None),
+            )\
+            .order_by(UserHistory.id)\
+            .limit(batch_size)\
+            .all()
+        if not rows:
+            break
+
+        params = []
+        for row in rows:
+            blob = pack_embedding(row.embedding_vector)
+            params.append({
+                "row_id": row.id,
+                "blob": blob,
+                "model": LEGACY_EMBEDDING_MODEL if blob else None,
+                "dim": len(row.embedding_vector) if blob else None,
+            })
+            converted += 1 if blob else 0
+
+        db.execute(stmt, params)
+        db.commit()
+        last_id = rows[-1].id
+        print(f"MIGRATION: converted embeddings up to user_history.id={last_id} ({converted} total)")
+
+    return converted
+
+
+if __name__ == "__main__":
+    upgrade_schema()
+    db = SessionLocal()
+    try:
+        backfill_binary_embeddings(db)
+    finally:
+        db.close()
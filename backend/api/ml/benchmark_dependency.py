@@ -0,0 +1,95 @@
+# api/ml/benchmark_dependency.py
+"""Parity check and benchmark: compiled NumPy forest vs xgboost DMatrix / inplace_predict.
+
+    python -m api.ml.benchmark_dependency --rows 1000000
+"""
+import argparse
+import time
+
+import numpy as np
+import xgboost as xgb
+
+from .engine import FEATURE_NAMES, MODEL_PATH
+from .tree_compiler import CompiledForest
+
+
+def _features(n: int, seed: int = 0, missing_rate: float = 0.0) -> np.ndarray:
+    """Synthetic rows spanning the telemetry feature ranges (and every split threshold)."""
+    rng = np.random.default_rng(seed)
+    X = np.column_stack([
+        rng.uniform(0.0, 1.0, n),        # copy_paste_rate
+        rng.uniform(0.0, 5.0, n),        # time_to_query_ratio
+        rng.uniform(0.0, 1.0, n),        # code_gen_reliance
+        rng.integers(0, 30, n),          # tab_switch_count
+    ]).astype(np.float32)
+    if missing_rate:
+        X[rng.random(X.shape) < missing_rate] = np.nan
+    return X
+
+
+def _timed(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def check_parity(booster: xgb.Booster, forest: CompiledForest, X: np.ndarray) -> dict:
+    margin_ref = booster.inplace_predict(X, predict_type="margin")
+    prob_ref = booster.predict(xgb.DMatrix(X, feature_names=FEATURE_NAMES))
+    margin = forest.predict_margin(X)
+    prob = forest.predict(X)
+    return {
+        "rows": len(X),
+        "margin_identical": float(np.mean(margin == margin_ref)),
+        "margin_max_abs_diff": float(np.max(np.abs(margin - margin_ref))),
+        "prob_identical": float(np.mean(prob == prob_ref)),
+        "prob_max_abs_diff": float(np.max(np.abs(prob - prob_ref))),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the compiled dependency model against xgboost.")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="Largest batch size benchmarked")
+    parser.add_argument("--single-calls", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    booster = xgb.Booster()
+    booster.load_model(MODEL_PATH)
+    started = time.perf_counter()
+    forest = CompiledForest.from_file(MODEL_PATH)
+    print(f"compiled {forest.num_trees} trees (depth {forest.max_depth}, "
+          f"{len(forest.split_feature)} distinct splits) in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    for missing_rate in (0.0, 0.05):
+        print("parity", {"missing_rate": missing_rate, **check_parity(booster, forest, _features(200_000, 1, missing_rate))})
+
+    row = _features(1, seed=2)
+    calls = args.single_calls
+    single = {
+        "DMatrix + predict": lambda: [booster.predict(xgb.DMatrix(row, feature_names=FEATURE_NAMES)) for _ in range(calls)],
+        "inplace_predict": lambda: [booster.inplace_predict(row) for _ in range(calls)],
+        "compiled": lambda: [forest.predict(row) for _ in range(calls)],
+    }
+    print("\nsingle row (us/call)")
+    for name, fn in single.items():
+        print(f"  {name:<18} {_timed(fn, args.repeat) / calls * 1e6:10.1f}")
+
+    print("\nbatch (rows/s)")
+    sizes = [n for n in (1_000, 100_000, 1_000_000) if n <= args.rows] or [args.rows]
+    for n in sizes:
+        X = _features(n, seed=3)
+        batch = {
+            "DMatrix + predict": lambda: booster.predict(xgb.DMatrix(X, feature_names=FEATURE_NAMES)),
+            "inplace_predict": lambda: booster.inplace_predict(X),
+            "compiled": lambda: forest.predict(X),
+        }
+        for name, fn in batch.items():
+            print(f"  {n:>9,} {name:<18} {n / _timed(fn, args.repeat):14,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# api/ml/benchmark_q_table.py
+"""learn() throughput under concurrent writers: shared write-behind store vs the old per-update JSON rewrite.
+
+    python -m api.ml.benchmark_q_table --processes 4 --threads 4 --updates 5000
+
+Each writer process runs its own RLAgent against one shared store. After all
+writers exit, the store's per-entry update counters must add up to the number
+of learn() calls made, i.e. no worker's updates were lost.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+from .rl_agent import ACTIONS, DEPENDENCY_LEVELS, SKILL_BUCKETS, RLAgent
+
+
+def _transitions(n: int, seed: int) -> list:
+    rng = random.Random(seed)
+    return [(rng.choice(SKILL_BUCKETS), rng.choice(DEPENDENCY_LEVELS), rng.choice(ACTIONS), rng.uniform(-1.0, 1.0),
+             rng.choice(SKILL_BUCKETS), rng.choice(DEPENDENCY_LEVELS)) for _ in range(n)]
+
+
+def _writer(store_path: str, snapshot_path: str, threads: int, updates: int, seed: int, results):
+    agent = RLAgent(store_path=store_path, snapshot_path=snapshot_path)
+    work = [_transitions(updates, seed * 1000 + t) for t in range(threads)]
+
+    def run(batch):
+        for transition in batch:
+            agent.learn(*transition)
+
+    started = time.perf_counter()
+    pool = [threading.Thread(target=run, args=(batch,)) for batch in work]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    learn_seconds = time.perf_counter() - started
+    agent.save_q_table()
+    results.put({"learn_seconds": learn_seconds, "total_seconds": time.perf_counter() - started,
+                 **agent.store.get_stats()})
+
+
+def bench_store(processes: int, threads: int, updates: int, workdir: str) -> dict:
+    store_path = os.path.join(workdir, "q_table.db")
+    snapshot_path = os.path.join(workdir, "q_table.json")
+    results = multiprocessing.Queue()
+    started = time.perf_counter()
+    workers = [multiprocessing.Process(target=_writer, args=(store_path, snapshot_path, threads, updates, p, results))
+               for p in range(processes)]
+    for worker in workers:
+        worker.start()
+    stats = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+
+    expected = processes * threads * updates
+    with sqlite3.connect(store_path) as conn:
+        stored = conn.execute("SELECT COALESCE(SUM(updates), 0) FROM q_values").fetchone()[0]
+    with open(snapshot_path) as f:
+        json.load(f)
+    return {
+        "learn_calls": expected,
+        "learn_per_s": expected / max(s["learn_seconds"] for s in stats),
+        "end_to_end_per_s": expected / elapsed,
+        "flushes": sum(s["flushes"] for s in stats),
+        "stored_updates": stored,
+        "lost_updates": expected - stored,
+    }
+
+
+def bench_legacy(updates: int, workdir: str) -> dict:
+    """The previous RLAgent.learn: update the dict, then rewrite the whole JSON file."""
+    path = os.path.join(workdir, "legacy_q_table.json")
+    alpha, gamma = 0.1, 0.9
+    q_table = {}
+
+    def values(state):
+        return q_table.setdefault(state, {a: 0.0 for a in ACTIONS})
+
+    started = time.perf_counter()
+    for bucket, level, action, reward, next_bucket, next_level in _transitions(updates, 0):
+        q = values(f"{bucket}_{level}")
+        max_next_q = max(values(f"{next_bucket}_{next_level}").values())
+        q[action] += alpha * (reward + gamma * max_next_q - q[action])
+        with open(path, "w") as f:
+            json.dump(q_table, f, indent=4)
+    return {"learn_calls": updates, "learn_per_s": updates / (time.perf_counter() - started)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark concurrent RLAgent.learn throughput.")
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=4, help="Writer threads per process")
+    parser.add_argument("--updates", type=int, default=5000, help="learn() calls per thread")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        print("legacy json rewrite (1 writer)", bench_legacy(min(args.updates, 2000), workdir))
+        for processes, threads in ((1, 1), (args.processes, args.threads)):
+            rundir = os.path.join(workdir, f"{processes}x{threads}")
+            os.mkdir(rundir)
+            print(f"shared store ({processes} processes x {threads} threads)",
+                  bench_store(processes, threads, args.updates, rundir))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,127 @@
 # api/ml/engine.py
-import xgboost as xgb
 import numpy as np
 import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, Optional
 
-# Global variable to hold the model in memory
+from .tree_compiler import CompiledForest
+
+MODEL_PATH = os.path.join(os.path.dirname(__file__), "dependency_detection_model.json")
+FEATURE_NAMES = ['copy_paste_rate', 'time_to_query_ratio', 'code_gen_reliance', 'tab_switch_count']
+
+# Batch scoring: rows per work unit and default number of scoring threads
+# (NumPy releases the GIL, so chunks score in parallel).
+DEPENDENCY_CHUNK_ROWS = int(os.getenv("DEPENDENCY_CHUNK_ROWS", "65536"))
+DEPENDENCY_THREADS = int(os.getenv("DEPENDENCY_THREADS", str(os.cpu_count() or 1)))
+
+# Global variables to hold the models in memory
 _booster = None
+_forest = None
 
 def get_model():
-    """Singleton pattern to load model only once."""
+    """Singleton pattern to load the xgboost Booster only once (reference / fallback scoring)."""
     global _booster
     if _booster is None:
-        model_path = os.path.join(os.path.dirname(__file__), "dependency_detection_model.json")
+        import xgboost as xgb
         _booster = xgb.Booster()
-        _booster.load_model(model_path)
+        _booster.load_model(MODEL_PATH)
     return _booster
 
-def predict_dependency_probability(features: list) -> float:
+def get_forest():
+    """The model compiled to NumPy arrays; None if it uses features the compiler does not support."""
+    global _forest
+    if _forest is None:
+        try:
+            _forest = CompiledForest.from_file(MODEL_PATH)
+        except ValueError as e:
+            print(f"WARNING: Dependency model not compiled ({e}); using xgboost")
+            _forest = False
+    return _forest or None
+
+def _as_feature_matrix(features) -> np.ndarray:
+    X = np.asarray(features, dtype=np.float32)
+    if X.size == 0:
+        return X.reshape(0, len(FEATURE_NAMES))
+    if X.ndim == 1:
+        X = X[None, :]
+    if X.ndim != 2 or X.shape[1] != len(FEATURE_NAMES):
+        raise ValueError(f"Expected rows of {len(FEATURE_NAMES)} features ({', '.join(FEATURE_NAMES)}), got shape {X.shape}")
+    return X
+
+def _score(X: np.ndarray) -> np.ndarray:
+    forest = get_forest()
+    if forest is not None:
+        return forest.predict(X)
+    return get_model().inplace_predict(X).astype(np.float32)
+
+def _row_chunks(chunks: Iterable, chunk_rows: int) -> Iterator[tuple]:
+    """(index of the input chunk, row block) pairs, splitting oversized input chunks."""
+    for index, chunk in enumerate(chunks):
+        X = _as_feature_matrix(chunk)
+        for start in range(0, max(len(X), 1), chunk_rows):
+            yield index, X[start:start + chunk_rows]
 
-    bst = get_model()
-    
-    input_data = np.array([features])
-    dmatrix = xgb.DMatrix(input_data, feature_names=['copy_paste_rate', 'time_to_query_ratio', 'code_gen_reliance', 'tab_switch_count'])
-    
-    dependency_prob = bst.predict(dmatrix)[0]
-    return float(dependency_prob)
+def stream_dependency_probabilities(chunks: Iterable, n_threads: Optional[int] = None,
+                                    chunk_rows: int = DEPENDENCY_CHUNK_ROWS) -> Iterator[np.ndarray]:
+    """Streaming mode: yields one probability array per input chunk, in input order.
 
-    
\ No newline at end of file
+    Chunks are pulled lazily and at most 2 * n_threads row blocks are in flight,
+    so feature sets larger than memory can be scored from a generator.
+    """
+    n_threads = max(1, n_threads or DEPENDENCY_THREADS)
+    blocks = _row_chunks(chunks, chunk_rows)
+    current, parts = None, []
+
+    def emit(index, probs):
+        nonlocal current, parts
+        finished = None
+        if current is not None and index != current:
+            finished = np.concatenate(parts)
+            parts = []
+        current = index
+        parts.append(probs)
+        return finished
+
+    if n_threads == 1:
+        for index, X in blocks:
+            finished = emit(index, _score(X))
+            if finished is not None:
+                yield finished
+    else:
+        with ThreadPoolExecutor(max_workers=n_threads, thread_name_prefix="dependency-score") as executor:
+            pending = deque()
+            for index, X in blocks:
+                pending.append((index, executor.submit(_score, X)))
+                while len(pending) >= 2 * n_threads or (pending and pending[0][1].done()):
+                    done_index, future = pending.popleft()
+                    finished = emit(done_index, future.result())
+                    if finished is not None:
+                        yield finished
+            while pending:
+                done_index, future = pending.popleft()
+                finished = emit(done_index, future.result())
+                if finished is not None:
+                    yield finished
+    if parts:
+        yield np.concatenate(parts)
+
+def predict_dependency_batch(features, n_threads: Optional[int] = None,
+                             chunk_rows: int = DEPENDENCY_CHUNK_ROWS) -> np.ndarray:
+    """Dependency probabilities for many rows in one call.
+
+    `features` is a (rows, 4) array / list of rows in FEATURE_NAMES order, or an
+    iterator of such chunks (concatenated in order; see
+    `stream_dependency_probabilities` to consume results chunk by chunk).
+    """
+    if isinstance(features, (np.ndarray, list, tuple)):
+        X = _as_feature_matrix(features)
+        if len(X) <= chunk_rows:
+            return _score(X)
+        features = [X]
+    parts = list(stream_dependency_probabilities(features, n_threads, chunk_rows))
+    return np.concatenate(parts) if parts else np.empty(0, dtype=np.float32)
+
+def predict_dependency_probability(features: list) -> float:
+    """Single-row convenience wrapper around `predict_dependency_batch`."""
+    return float(predict_dependency_batch([features])[0])
@@ -0,0 +1,80 @@
+# api/ml/export_dkt.py
+"""Export trained DKT weights to the NumPy serving artifact and check parity.
+
+Serving (adaptive_engine, dkt_batch) runs the LSTM in NumPy from an .npz, so
+only training and this export need torch.
+
+    python -m api.ml.export_dkt --weights api/ml/dkt-20250101000000.pt
+"""
+import argparse
+import os
+
+import numpy as np
+import torch
+
+from ..services.dkt_model import DKTModel, export_numpy_weights, load_dkt_weights
+from ..services.dkt_runtime import load_dkt_runtime
+
+ML_DIR = os.path.dirname(__file__)
+SERVING_WEIGHTS_PATH = os.path.join(ML_DIR, "dkt_weights.npz")
+
+# Largest acceptable |torch - numpy| over predictions and hidden state.
+PARITY_TOLERANCE = 1e-4
+
+
+def check_parity(model: DKTModel, path: str, n_users: int = 64, max_len: int = 120, seed: int = 0) -> float:
+    """Max abs difference between torch and the exported NumPy runtime on random sequences.
+
+    Covers the full-sequence forward, continuing from a carried (h, c), and the
+    variable-length final-step path used for bulk recomputes.
+    """
+    model.eval()
+    runtime = load_dkt_runtime(path)
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(1, max_len + 1, n_users)
+    padded = np.zeros((n_users, max_len), dtype=np.int64)
+    for row, length in enumerate(lengths):
+        padded[row, :length] = rng.integers(0, 2 * model.num_skills, length)
+
+    diffs = []
+    with torch.no_grad():
+        head, tail = torch.from_numpy(padded[:, :max_len // 2]), torch.from_numpy(padded[:, max_len // 2:])
+        t_preds, t_hidden = model(head)
+        t_next, (t_h, t_c) = model(tail, t_hidden)
+        n_preds, n_hidden = runtime(padded[:, :max_len // 2])
+        n_next, (n_h, n_c) = runtime(padded[:, max_len // 2:], n_hidden)
+        diffs += [np.abs(t_preds.numpy() - n_preds).max(), np.abs(t_next.numpy() - n_next).max(),
+                  np.abs(t_h.numpy() - n_h).max(), np.abs(t_c.numpy() - n_c).max()]
+
+        t_last, (t_h, t_c) = model.forward_last(torch.from_numpy(padded), torch.from_numpy(lengths))
+        n_last, (n_h, n_c) = runtime.forward_last(padded, lengths)
+        diffs += [np.abs(t_last.numpy() - n_last).max(), np.abs(t_h.numpy() - n_h).max(),
+                  np.abs(t_c.numpy() - n_c).max()]
+    return float(max(diffs))
+
+
+def publish(model: DKTModel, version: str, path: str = SERVING_WEIGHTS_PATH) -> float:
+    """Export to `path`, refusing to leave an artifact that diverges from torch."""
+    staged = path + ".staged.npz"
+    export_numpy_weights(model, staged, version)
+    max_diff = check_parity(model, staged)
+    if max_diff > PARITY_TOLERANCE:
+        os.remove(staged)
+        raise ValueError(f"NumPy export of {version} diverges from torch by {max_diff:.2e}")
+    os.replace(staged, path)
+    print(f"Published {version} to {path} (max |torch - numpy| = {max_diff:.2e})")
+    return max_diff
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export DKT weights for torch-free serving.")
+    parser.add_argument("--weights", required=True, help="Checkpoint written by save_dkt_weights (dkt-<ts>.pt)")
+    parser.add_argument("--out", default=SERVING_WEIGHTS_PATH)
+    args = parser.parse_args()
+
+    model, version = load_dkt_weights(args.weights)
+    publish(model, version, args.out)
+
+
+if __name__ == "__main__":
+    main()
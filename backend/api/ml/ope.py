@@ -0,0 +1,390 @@
+# api/ml/ope.py
+"""Off-policy evaluation of learning-path and RLAgent policies from logged decisions.
+
+Every profile update logs a ProfileDecision: its context (SSI, dependency
+probability, RL state), the learning path and RL action chosen, and the
+probability the logging policy had of choosing each. A decision's reward is
+the mean quiz score (fraction correct) over the user's QuizScores between it
+and the user's next decision; decisions not followed by a quiz are dropped.
+
+For a candidate policy pi, with w = pi(a | x) / mu(a | x) for the logged
+action a and a tabular reward model rhat fitted on the log:
+
+    IPS    mean(w * r)
+    SNIPS  sum(w * r) / sum(w)
+    DM     mean(sum_a pi(a | x) * rhat(x, a))
+    DR     DM + mean(w * (r - rhat(x, a)))
+
+Everything is vectorized over the whole log. Every estimate is a ratio of
+per-user sums, so bootstrap confidence intervals resample users (a
+student's decisions are not independent) with Poisson(1) weights: a block
+of replicates for all policies is one (replicates, users) x (users,
+columns) product, and blocks run in parallel on a thread pool.
+
+The current path policy is deterministic, so only decisions where a
+candidate agrees with it carry IPS weight; DR relies on the reward model
+for the rest. PATH_EXPLORATION_RATE in adaptive_engine adds logged support.
+
+    python -m api.ml.ope
+    python -m api.ml.ope --synthetic 2000000 --bootstrap 1000
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timezone
+from typing import Callable, List, Optional
+
+import numpy as np
+
+from ..services.adaptive_engine import PATH_TYPES, SSI_STRONG_THRESHOLD, SSI_WEAK_THRESHOLD
+from .rl_agent import ACTIONS, DEPENDENCY_LEVEL_BOUNDS, DEPENDENCY_LEVELS, rl_agent
+
+# Bootstrap replicates per block; bounds the (block, users) weight matrix.
+BOOTSTRAP_BLOCK = 32
+OPE_THREADS = int(os.getenv("OPE_THREADS", str(os.cpu_count() or 1)))
+# Reward model cells: SSI bins x dependency levels (path) or RL states (rl)
+SSI_BINS = 10
+# Pseudo-count pulling sparse reward-model cells towards the action's mean reward
+MODEL_PRIOR = 5.0
+
+# Decision kind -> (action column, propensity column, action names)
+KINDS = {
+    "path": ("path", "path_propensity", PATH_TYPES),
+    "rl": ("rl_action", "rl_propensity", ACTIONS),
+}
+
+
+class CandidatePolicy:
+    """Epsilon-greedy around a deterministic rule: `choose(log)` gives the rule's action per decision."""
+
+    def __init__(self, name: str, kind: str, choose: Callable[[dict], np.ndarray], epsilon: float = 0.0):
+        self.name = name
+        self.kind = kind
+        self.choose = choose
+        self.epsilon = epsilon
+
+
+def threshold_policy(weak: float, strong: float, epsilon: float = 0.0) -> CandidatePolicy:
+    """Learning paths from SSI cut-offs, as in adaptive_engine.threshold_path."""
+    def choose(log):
+        ssi = log["ssi"]
+        return np.where(ssi < weak, 0, np.where(ssi > strong, 2, 1))
+    suffix = f" eps={epsilon:g}" if epsilon else ""
+    return CandidatePolicy(f"thresholds {weak:g}/{strong:g}{suffix}", "path", choose, epsilon)
+
+
+def q_policy(name: str, q: np.ndarray, epsilon: float = 0.0) -> CandidatePolicy:
+    """RLAgent's policy for a given Q-matrix."""
+    greedy = np.asarray(q).argmax(axis=1)
+    return CandidatePolicy(name, "rl", lambda log: greedy[log["rl_state"]], epsilon)
+
+
+def fixed_policy(kind: str, action: int) -> CandidatePolicy:
+    names = KINDS[kind][2]
+    return CandidatePolicy(f"always {names[action]}", kind, lambda log: np.full(log["decisions"], action))
+
+
+def default_candidates() -> List[CandidatePolicy]:
+    policies = [threshold_policy(weak, strong) for weak in (30, 35, 40, 45, 50) for strong in (60, 65, 70, 75, 80)]
+    policies += [threshold_policy(SSI_WEAK_THRESHOLD, SSI_STRONG_THRESHOLD, 0.1)]
+    policies += [fixed_policy("path", a) for a in range(len(PATH_TYPES))]
+    policies += [q_policy("rl_agent greedy", rl_agent.store.q),
+                 q_policy(f"rl_agent eps={rl_agent.epsilon:g}", rl_agent.store.q, rl_agent.epsilon)]
+    policies += [fixed_policy("rl", a) for a in range(len(ACTIONS))]
+    return policies
+
+
+# ---------- Log ----------
+
+def outcome_rewards(dec_user, dec_time, quiz_user, quiz_time, quiz_score) -> np.ndarray:
+    """Mean quiz score between each decision and the same user's next one (NaN if none)."""
+    n = len(dec_user)
+    if not n or not len(quiz_user):
+        return np.full(n, np.nan)
+    user = np.concatenate([dec_user, quiz_user])
+    kind = np.concatenate([np.zeros(n, dtype=np.int8), np.ones(len(quiz_user), dtype=np.int8)])
+    ref = np.concatenate([np.arange(n), np.arange(len(quiz_user))])
+    # Decisions sort before quizzes at the same instant
+    order = np.lexsort((kind, np.concatenate([dec_time, quiz_time]), user))
+    user, kind, ref = user[order], kind[order], ref[order]
+
+    is_decision = kind == 0
+    last = np.maximum.accumulate(np.where(is_decision, np.arange(len(order)), -1))
+    quiz = ~is_decision
+    owner = last[quiz]
+    owned = owner >= 0
+    owned[owned] = user[owner[owned]] == user[quiz][owned]
+
+    decision = ref[owner[owned]]
+    scores = quiz_score[ref[quiz][owned]]
+    counts = np.bincount(decision, minlength=n)
+    sums = np.bincount(decision, weights=scores, minlength=n)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+
+def assemble_log(columns: dict, quiz_user, quiz_time, quiz_score) -> dict:
+    """Attach rewards to decision columns and keep decisions with an outcome and a logged propensity."""
+    reward = outcome_rewards(columns["user_id"], columns["time"], quiz_user, quiz_time, quiz_score)
+    keep = ~np.isnan(reward) & (columns["path_propensity"] > 0) & (columns["rl_propensity"] > 0)
+    log = {key: np.asarray(values)[keep] for key, values in columns.items()}
+    log["reward"] = reward[keep]
+    _, log["user"] = np.unique(log.pop("user_id"), return_inverse=True)
+    log["users"] = int(log["user"].max()) + 1 if keep.any() else 0
+    log["decisions"] = int(keep.sum())
+    log["logged_decisions"] = len(reward)
+    return log
+
+
+def _epoch_seconds(values) -> np.ndarray:
+    # SQLite hands back naive UTC datetimes, PostgreSQL aware ones
+    return np.fromiter(((v if v.tzinfo else v.replace(tzinfo=timezone.utc)).timestamp() for v in values),
+                       dtype=np.float64, count=len(values))
+
+
+def load_log(db) -> dict:
+    """ProfileDecision + QuizScore, two column scans."""
+    from sqlalchemy import case, select
+
+    from ..models import ProfileDecision, QuizScore
+
+    decisions = db.execute(
+        select(ProfileDecision.user_id, ProfileDecision.created_at, ProfileDecision.ssi, ProfileDecision.dependency_prob,
+               ProfileDecision.path, ProfileDecision.path_propensity,
+               ProfileDecision.rl_state, ProfileDecision.rl_action, ProfileDecision.rl_propensity)
+        .order_by(ProfileDecision.id)
+    ).all()
+    quizzes = db.execute(
+        select(QuizScore.user_id, QuizScore.created_at,
+               case((QuizScore.total_questions > 0, QuizScore.score / QuizScore.total_questions)))
+        .where(QuizScore.total_questions > 0)
+    ).all()
+
+    names = ("user_id", "time", "ssi", "dependency_prob", "path", "path_propensity", "rl_state", "rl_action", "rl_propensity")
+    raw = list(zip(*decisions)) or [()] * len(names)
+    columns = {}
+    for name, values in zip(names, raw):
+        if name == "time":
+            columns[name] = _epoch_seconds(values)
+        elif name in ("user_id", "path", "rl_state", "rl_action"):
+            columns[name] = np.array([v if v is not None else -1 for v in values], dtype=np.int64)
+        else:
+            columns[name] = np.array([v if v is not None else np.nan for v in values], dtype=np.float64)
+    quiz_user, quiz_time, quiz_score = list(zip(*quizzes)) or ((), (), ())
+    return assemble_log(columns, np.array(quiz_user, dtype=np.int64), _epoch_seconds(quiz_time),
+                        np.array(quiz_score, dtype=np.float64))
+
+
+def synthetic_log(n: int, seed: int = 0, path_epsilon: float = 0.1, rl_epsilon: float = 0.1) -> dict:
+    """Simulated decision log with known expected rewards (`log["truth"](policy)`), for benchmarks and checks."""
+    rng = np.random.default_rng(seed)
+    n_users = max(1, n // 50)
+    user = rng.integers(0, n_users, n)
+    ssi = rng.uniform(0.0, 100.0, n)
+    dependency_prob = rng.beta(2.0, 5.0, n)
+    rl_state = _rl_states(ssi, dependency_prob)
+    best_rl = rng.integers(0, len(ACTIONS), len(rl_agent.states))
+
+    def expected(path, rl_action):
+        # Reinforcement pays off at low SSI, Acceleration at high SSI; one RL action per state is best
+        fit = np.select([path == 0, path == 2], [1.0 - ssi / 100.0, ssi / 100.0], 0.5)
+        return 0.35 + 0.3 * (ssi / 100.0) + 0.2 * fit + 0.08 * (rl_action == best_rl[rl_state]) - 0.1 * dependency_prob
+
+    path, path_propensity = _epsilon_greedy_log(rng, np.where(ssi < 40, 0, np.where(ssi > 70, 2, 1)), len(PATH_TYPES), path_epsilon)
+    rl_action, rl_propensity = _epsilon_greedy_log(rng, rng.integers(0, len(ACTIONS), len(rl_agent.states))[rl_state],
+                                                   len(ACTIONS), rl_epsilon)
+    reward = np.clip(expected(path, rl_action) + rng.normal(0.0, 0.15, n), 0.0, 1.0)
+
+    log = {"ssi": ssi, "dependency_prob": dependency_prob, "path": path, "path_propensity": path_propensity,
+           "rl_state": rl_state, "rl_action": rl_action, "rl_propensity": rl_propensity, "reward": reward,
+           "user": user, "users": n_users, "decisions": n, "logged_decisions": n}
+
+    def truth(policy: CandidatePolicy) -> float:
+        chosen = policy.choose(log)
+        n_actions = len(KINDS[policy.kind][2])
+        if policy.kind == "path":
+            value = lambda a: expected(np.full(n, a) if np.isscalar(a) else a, rl_action)
+        else:
+            value = lambda a: expected(path, np.full(n, a) if np.isscalar(a) else a)
+        uniform = np.mean([value(a) for a in range(n_actions)], axis=0)
+        # Clipping the noise shifts means slightly; ignored for the reference value
+        return float(np.mean(policy.epsilon * uniform + (1.0 - policy.epsilon) * value(chosen)))
+
+    log["truth"] = truth
+    return log
+
+
+def _rl_states(ssi, dependency_prob) -> np.ndarray:
+    bucket = np.where(ssi < SSI_WEAK_THRESHOLD, 0, np.where(ssi > SSI_STRONG_THRESHOLD, 2, 1))
+    return bucket * len(DEPENDENCY_LEVELS) + _dependency_levels(dependency_prob)
+
+
+def _dependency_levels(dependency_prob) -> np.ndarray:
+    return np.searchsorted(DEPENDENCY_LEVEL_BOUNDS, dependency_prob, side="right")
+
+
+def _epsilon_greedy_log(rng, chosen, n_actions, epsilon):
+    explore = rng.random(len(chosen)) < epsilon
+    action = np.where(explore, rng.integers(0, n_actions, len(chosen)), chosen)
+    propensity = np.where(action == chosen, 1.0 - epsilon + epsilon / n_actions, epsilon / n_actions)
+    return action, propensity
+
+
+# ---------- Estimation ----------
+
+def _contexts(log: dict, kind: str):
+    if kind == "rl":
+        return log["rl_state"], len(rl_agent.states)
+    ssi_bin = np.clip((log["ssi"] / 100.0 * SSI_BINS).astype(np.int64), 0, SSI_BINS - 1)
+    return ssi_bin * len(DEPENDENCY_LEVELS) + _dependency_levels(log["dependency_prob"]), SSI_BINS * len(DEPENDENCY_LEVELS)
+
+
+def fit_reward_model(context, n_contexts: int, action, n_actions: int, reward) -> np.ndarray:
+    """Mean reward per (context, action), shrunk towards the action's overall mean."""
+    cell = context * n_actions + action
+    counts = np.bincount(cell, minlength=n_contexts * n_actions)
+    sums = np.bincount(cell, weights=reward, minlength=n_contexts * n_actions)
+    action_counts = np.bincount(action, minlength=n_actions)
+    action_sums = np.bincount(action, weights=reward, minlength=n_actions)
+    overall = reward.mean() if len(reward) else 0.0
+    prior = np.where(action_counts > 0, action_sums / np.maximum(action_counts, 1), overall)
+    return ((sums + MODEL_PRIOR * np.tile(prior, n_contexts)) / (counts + MODEL_PRIOR)).reshape(n_contexts, n_actions)
+
+
+# Per-policy columns of the per-user sum matrix
+_COLUMNS = ("wr", "w", "w2", "dr", "dm", "match")
+
+
+def _policy_columns(log: dict, policy: CandidatePolicy, model: np.ndarray, context, max_weight: Optional[float]) -> list:
+    action_column, propensity_column, names = KINDS[policy.kind]
+    action, propensity, reward = log[action_column], log[propensity_column], log["reward"]
+    n_actions = len(names)
+
+    chosen = policy.choose(log)
+    match = chosen == action
+    pi = policy.epsilon / n_actions + (1.0 - policy.epsilon) * match
+    w = pi / propensity
+    if max_weight:
+        w = np.minimum(w, max_weight)
+    rows = model[context]
+    dm = policy.epsilon * rows.mean(axis=1) + (1.0 - policy.epsilon) * rows[np.arange(len(chosen)), chosen]
+    dr = dm + w * (reward - rows[np.arange(len(action)), action])
+    return [w * reward, w, w * w, dr, dm, match.astype(np.float64)]
+
+
+def _bootstrap_block(sums: np.ndarray, replicates: int, seed) -> np.ndarray:
+    weights = np.random.default_rng(seed).poisson(1.0, size=(replicates, sums.shape[0])).astype(np.float64)
+    return weights @ sums
+
+
+def bootstrap_sums(sums: np.ndarray, replicates: int, n_threads: int = OPE_THREADS, seed: int = 0) -> np.ndarray:
+    """(replicates, columns) column totals under Poisson(1) user weights."""
+    sizes = [min(BOOTSTRAP_BLOCK, replicates - start) for start in range(0, replicates, BOOTSTRAP_BLOCK)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    with ThreadPoolExecutor(max_workers=max(1, n_threads), thread_name_prefix="ope-bootstrap") as executor:
+        blocks = list(executor.map(_bootstrap_block, [sums] * len(sizes), sizes, seeds))
+    return np.vstack(blocks) if blocks else np.zeros((0, sums.shape[1]))
+
+
+def _interval(values: np.ndarray, alpha: float) -> list:
+    values = values[np.isfinite(values)]
+    if not len(values):
+        return [None, None]
+    low, high = np.quantile(values, [alpha / 2, 1 - alpha / 2])
+    return [round(float(low), 4), round(float(high), 4)]
+
+
+def evaluate(log: dict, policies: List[CandidatePolicy], replicates: int = 1000, n_threads: int = OPE_THREADS,
+             max_weight: Optional[float] = None, alpha: float = 0.05, seed: int = 0) -> dict:
+    """IPS / SNIPS / DM / DR estimates and bootstrap intervals for every candidate policy."""
+    n, n_users = log["decisions"], log["users"]
+    if not n:
+        return {"decisions": 0, "logged_decisions": log["logged_decisions"], "users": 0, "logged": None, "policies": []}
+
+    models = {}
+    for kind, (action_column, _, names) in KINDS.items():
+        if any(p.kind == kind for p in policies):
+            context, n_contexts = _contexts(log, kind)
+            models[kind] = (fit_reward_model(context, n_contexts, log[action_column], len(names), log["reward"]), context)
+
+    columns = [np.ones(n), log["reward"]]
+    for policy in policies:
+        model, context = models[policy.kind]
+        columns += _policy_columns(log, policy, model, context, max_weight)
+    # (users, columns): every estimator below is a ratio of these totals
+    sums = np.stack([np.bincount(log["user"], weights=c, minlength=n_users) for c in columns], axis=1)
+    totals = sums.sum(axis=0)
+    boot = bootstrap_sums(sums, replicates, n_threads, seed) if replicates else np.zeros((0, sums.shape[1]))
+
+    def ratio(num, den):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return totals[num] / totals[den], boot[:, num] / boot[:, den]
+
+    logged, logged_boot = ratio(1, 0)
+    results = []
+    for i, policy in enumerate(policies):
+        base = 2 + i * len(_COLUMNS)
+        wr, w, w2, dr, dm, match = (base + j for j in range(len(_COLUMNS)))
+        estimates = {"ips": ratio(wr, 0), "snips": ratio(wr, w), "dm": ratio(dm, 0), "dr": ratio(dr, 0)}
+        results.append({
+            "policy": policy.name,
+            "kind": policy.kind,
+            "match_rate": round(float(totals[match] / n), 4),
+            "ess": round(float(totals[w] ** 2 / totals[w2]), 1) if totals[w2] else 0.0,
+            **{name: round(float(point), 4) for name, (point, _) in estimates.items()},
+            **{f"{name}_ci": _interval(replicated, alpha) for name, (_, replicated) in estimates.items() if name != "dm"},
+        })
+    return {
+        "decisions": n,
+        "logged_decisions": log["logged_decisions"],
+        "users": n_users,
+        "logged": {"value": round(float(logged), 4), "ci": _interval(logged_boot, alpha)},
+        "policies": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Off-policy evaluation of learning-path and RLAgent policies.")
+    parser.add_argument("--synthetic", type=int, default=0, help="Evaluate on N simulated decisions instead of the log")
+    parser.add_argument("--bootstrap", type=int, default=1000, help="Bootstrap replicates (0 to skip intervals)")
+    parser.add_argument("--threads", type=int, default=OPE_THREADS)
+    parser.add_argument("--max-weight", type=float, default=None, help="Clip importance weights at this value")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    if args.synthetic:
+        log = synthetic_log(args.synthetic)
+    else:
+        from ..database import SessionLocal
+        db = SessionLocal()
+        try:
+            log = load_log(db)
+        finally:
+            db.close()
+    loaded = time.perf_counter()
+
+    policies = default_candidates()
+    report = evaluate(log, policies, args.bootstrap, args.threads, args.max_weight)
+    finished = time.perf_counter()
+    print(f"{report['decisions']:,} decisions with outcomes (of {report['logged_decisions']:,}), {report['users']:,} users; "
+          f"loaded in {loaded - started:.1f}s, {len(policies)} policies x {args.bootstrap} replicates in {finished - loaded:.1f}s")
+    if not report["decisions"]:
+        return
+    print(f"logged policy value {report['logged']['value']} {report['logged']['ci']}")
+
+    truth = log.get("truth")
+    for kind in KINDS:
+        rows = sorted(((r, p) for r, p in zip(report["policies"], policies) if p.kind == kind), key=lambda rp: -rp[0]["dr"])
+        print(f"\n{kind}: {'policy':<24} {'match':>6} {'ess':>10} {'ips':>7} {'snips':>7} {'dr':>7}  dr 95% ci" +
+              ("        true" if truth else ""))
+        for r, policy in rows:
+            line = (f"      {r['policy']:<24} {r['match_rate']:>6.2f} {r['ess']:>10,.0f} {r['ips']:>7.4f} "
+                    f"{r['snips']:>7.4f} {r['dr']:>7.4f}  {r['dr_ci']}")
+            if truth:
+                line += f"  {truth(policy):.4f}"
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+# api/ml/q_table_store.py
+"""Shared, write-behind Q-table storage for RLAgent.
+
+Q-values live in a SQLite table (WAL mode) that every worker process on the
+host opens, so all workers learn into and act from the same values. Updates
+are buffered in memory as transitions and replayed in order against the
+stored values in one write transaction per flush; SQLite serialises those
+transactions across processes, so concurrent workers never lose each
+other's updates. Between flushes a worker reads its last snapshot of the
+table plus its own pending updates.
+
+In memory the table is a dense (states, actions) float64 matrix over an
+enumerated state space, with the greedy action per state kept alongside so
+serving is two array lookups. On disk rows stay keyed by state and action
+name, so the enumeration can grow without migrating stored values.
+"""
+import atexit
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+# Anchored to the package rather than to whatever directory the process was started from
+Q_TABLE_STORE_PATH = os.getenv("Q_TABLE_STORE_PATH", os.path.join(os.path.dirname(__file__), "q_table.db"))
+# A flush happens every Q_TABLE_FLUSH_SECONDS, or earlier once this many updates are pending.
+Q_TABLE_FLUSH_SECONDS = float(os.getenv("Q_TABLE_FLUSH_SECONDS", "1.0"))
+Q_TABLE_FLUSH_UPDATES = int(os.getenv("Q_TABLE_FLUSH_UPDATES", "512"))
+# In-process locks are striped by state, so threads updating different states don't contend.
+Q_TABLE_LOCK_STRIPES = 64
+
+# (state index, action index, reward, next state index)
+Transition = Tuple[int, int, float, int]
+
+
+class QTableStore:
+    """Write-behind Q-matrix backed by a shared SQLite file.
+
+    `update` applies a Bellman step to the local matrix immediately and
+    queues the transition; `flush` replays queued transitions against the
+    shared table inside BEGIN IMMEDIATE, then reloads the matrix so the
+    other workers' updates become visible. `replace` publishes a whole
+    matrix (e.g. from the offline trainer). Store errors are logged and the
+    transitions stay queued for the next flush.
+    """
+
+    def __init__(self, states: List[str], actions: List[str], alpha: float, gamma: float,
+                 path: str = Q_TABLE_STORE_PATH,
+                 flush_seconds: float = Q_TABLE_FLUSH_SECONDS,
+                 flush_updates: int = Q_TABLE_FLUSH_UPDATES,
+                 snapshot_path: Optional[str] = None):
+        self.states = list(states)
+        self.actions = list(actions)
+        self.state_index = {state: i for i, state in enumerate(self.states)}
+        self.action_index = {action: i for i, action in enumerate(self.actions)}
+        self.alpha = alpha
+        self.gamma = gamma
+        self.path = path
+        self.flush_seconds = flush_seconds
+        self.flush_updates = flush_updates
+        self.snapshot_path = snapshot_path
+
+        self.q = np.zeros((len(self.states), len(self.actions)))
+        self.greedy = np.zeros(len(self.states), dtype=np.int64)
+        self._state_locks = [threading.Lock() for _ in range(Q_TABLE_LOCK_STRIPES)]
+        self._pending: List[Transition] = []
+        self._pending_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._conn = None
+        self._pid = None
+        self._flusher = None
+        self.stats = {"updates": 0, "flushes": 0, "flushed_updates": 0, "store_errors": 0, "unknown_rows": 0}
+        atexit.register(self.close)
+
+    # --- Storage ---
+
+    def _connection(self) -> sqlite3.Connection:
+        # A connection (or flusher thread) inherited through fork() is not usable
+        # in the child, so each process opens its own.
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS q_values ("
+                " state TEXT NOT NULL,"
+                " action TEXT NOT NULL,"
+                " value REAL NOT NULL,"
+                " updates INTEGER NOT NULL DEFAULT 0,"
+                " PRIMARY KEY (state, action))"
+            )
+            self._conn, self._pid, self._flusher = conn, os.getpid(), None
+        return self._conn
+
+    def load(self, seed_path: Optional[str] = None):
+        """Read the shared table into the matrix, seeding an empty store from a legacy JSON file."""
+        try:
+            conn = self._connection()
+            if seed_path and os.path.exists(seed_path):
+                with open(seed_path) as f:
+                    legacy = json.load(f)
+                rows = [(state, action, float(value)) for state, values in legacy.items() for action, value in values.items()]
+                # Only the first worker to get here seeds; the rest see a non-empty table.
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    if conn.execute("SELECT 1 FROM q_values LIMIT 1").fetchone() is None:
+                        conn.executemany("INSERT INTO q_values (state, action, value) VALUES (?, ?, ?)", rows)
+                    conn.execute("COMMIT")
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    raise
+            self._refresh(conn)
+        except (sqlite3.Error, OSError, ValueError) as e:
+            print(f"WARNING: Q-table store load failed: {e}")
+            self.stats["store_errors"] += 1
+
+    def _read_matrix(self, conn: sqlite3.Connection) -> np.ndarray:
+        q = np.zeros((len(self.states), len(self.actions)))
+        unknown = 0
+        for state, action, value in conn.execute("SELECT state, action, value FROM q_values"):
+            s, a = self.state_index.get(state), self.action_index.get(action)
+            if s is None or a is None:
+                unknown += 1
+                continue
+            q[s, a] = value
+        self.stats["unknown_rows"] = unknown
+        return q
+
+    def _refresh(self, conn: sqlite3.Connection):
+        q = self._read_matrix(conn)
+        with self._pending_lock:
+            # Updates queued since the flush started are re-applied on top.
+            for transition in self._pending:
+                self._bellman(q, *transition)
+            self.q, self.greedy = q, q.argmax(axis=1)
+
+    # --- Q-values ---
+
+    def _bellman(self, q: np.ndarray, s: int, a: int, reward: float, s_next: int):
+        current_q = q[s, a]
+        q[s, a] = current_q + self.alpha * (reward + self.gamma * q[s_next].max() - current_q)
+
+    def update(self, s: int, a: int, reward: float, s_next: int) -> float:
+        """Apply one Q-learning step locally and queue it for the shared table."""
+        with self._state_locks[s % Q_TABLE_LOCK_STRIPES]:
+            q = self.q
+            self._bellman(q, s, a, reward, s_next)
+            self.greedy[s] = q[s].argmax()
+            new_q = float(q[s, a])
+        with self._pending_lock:
+            self._pending.append((s, a, float(reward), s_next))
+            self.stats["updates"] += 1
+            pending = len(self._pending)
+        self._ensure_flusher()
+        if pending >= self.flush_updates:
+            self._wakeup.set()
+        return new_q
+
+    def as_dict(self) -> dict:
+        q = self.q
+        return {state: dict(zip(self.actions, q[s].tolist())) for s, state in enumerate(self.states)}
+
+    # --- Write-behind ---
+
+    def _ensure_flusher(self):
+        if self._flusher is not None and self._pid == os.getpid():
+            return
+        with self._flush_lock:
+            self._connection()
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name="q-table-flush", daemon=True)
+                self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            self._wakeup.wait(self.flush_seconds)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self) -> int:
+        """Replay pending transitions against the shared table. Returns how many were written."""
+        with self._flush_lock:
+            with self._pending_lock:
+                batch, self._pending = self._pending, []
+            try:
+                conn = self._connection()
+                if batch:
+                    self._apply(conn, batch)
+            except sqlite3.Error as e:
+                print(f"WARNING: Q-table flush failed, {len(batch)} updates kept for retry: {e}")
+                self.stats["store_errors"] += 1
+                with self._pending_lock:
+                    self._pending = batch + self._pending
+                return 0
+
+            self.stats["flushes"] += 1
+            self.stats["flushed_updates"] += len(batch)
+            self._after_write(conn, bool(batch))
+            return len(batch)
+
+    def _write_rows(self, conn: sqlite3.Connection, q: np.ndarray, counts: np.ndarray, states):
+        conn.executemany(
+            "INSERT INTO q_values (state, action, value, updates) VALUES (?, ?, ?, ?)"
+            " ON CONFLICT (state, action) DO UPDATE SET value = excluded.value, updates = updates + excluded.updates",
+            [(self.states[s], action, float(q[s, a]), int(counts[s, a]))
+             for s in states for a, action in enumerate(self.actions)],
+        )
+
+    def _apply(self, conn: sqlite3.Connection, batch: List[Transition]):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            q = self._read_matrix(conn)
+            counts = np.zeros(q.shape, dtype=np.int64)
+            for s, a, reward, s_next in batch:
+                self._bellman(q, s, a, reward, s_next)
+                counts[s, a] += 1
+            self._write_rows(conn, q, counts, sorted({t[0] for t in batch}))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def replace(self, q: np.ndarray) -> bool:
+        """Publish a whole matrix to the shared store. Pending online updates are replayed on top of it."""
+        q = np.asarray(q, dtype=np.float64)
+        if q.shape != self.q.shape:
+            raise ValueError(f"Expected a {self.q.shape} Q-matrix, got {q.shape}")
+        with self._flush_lock:
+            try:
+                conn = self._connection()
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    self._write_rows(conn, q, np.zeros(q.shape, dtype=np.int64), range(len(self.states)))
+                    conn.execute("COMMIT")
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    raise
+            except sqlite3.Error as e:
+                print(f"WARNING: Q-table replace failed: {e}")
+                self.stats["store_errors"] += 1
+                return False
+            self._after_write(conn, True)
+            return True
+
+    def _after_write(self, conn: sqlite3.Connection, changed: bool):
+        try:
+            self._refresh(conn)
+        except sqlite3.Error as e:
+            print(f"WARNING: Q-table refresh failed: {e}")
+            self.stats["store_errors"] += 1
+        if changed and self.snapshot_path:
+            self._write_snapshot()
+
+    def _write_snapshot(self):
+        # Human-readable copy of the table; written to a temp file and renamed into
+        # place so readers never see a partial file.
+        directory = os.path.dirname(os.path.abspath(self.snapshot_path))
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".q_table.", suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(self.as_dict(), f)
+            os.replace(tmp_path, self.snapshot_path)
+        except OSError as e:
+            print(f"Error saving Q-table: {e}")
+
+    def get_stats(self) -> dict:
+        with self._pending_lock:
+            return {**self.stats, "pending": len(self._pending), "states": len(self.states)}
+
+    def close(self):
+        if self._pid == os.getpid():
+            self.flush()
@@ -1,65 +1,93 @@
-import json
 import random
 import os
-import numpy as np
+from itertools import product
+from .q_table_store import Q_TABLE_STORE_PATH, QTableStore
+
+# Enumerated state space. Logged experience stores these indices, so only ever append.
+SKILL_BUCKETS = ("Weak", "Moderate", "Strong")
+DEPENDENCY_LEVELS = ("Low", "Medium", "High")
+ACTIONS = ("Theory-First", "Code-First", "Balanced")
+# Dependency probability cut-offs between Low / Medium / High
+DEPENDENCY_LEVEL_BOUNDS = (0.33, 0.66)
+# Readable JSON snapshot of the store; by default next to the store file, with a .json suffix
+Q_TABLE_SNAPSHOT_PATH = os.getenv("Q_TABLE_SNAPSHOT_PATH")
+
+
+def dependency_level(dependency_prob):
+    if dependency_prob < DEPENDENCY_LEVEL_BOUNDS[0]:
+        return "Low"
+    if dependency_prob < DEPENDENCY_LEVEL_BOUNDS[1]:
+        return "Medium"
+    return "High"
+
 
 class RLAgent:
-    def __init__(self, alpha=0.1, gamma=0.9, epsilon=0.1):
-        self.q_table = {}
+    def __init__(self, alpha=0.1, gamma=0.9, epsilon=0.1, store_path=None, snapshot_path=None):
         self.alpha = alpha  # Learning rate
         self.gamma = gamma  # Discount factor
         self.epsilon = epsilon  # Exploration rate
-        self.actions = ["Theory-First", "Code-First", "Balanced"]
-        self.filepath = os.path.join(os.path.dirname(__file__), "q_table.json")
+        self.actions = list(ACTIONS)
+        self.states = [self.get_state_key(bucket, level) for bucket, level in product(SKILL_BUCKETS, DEPENDENCY_LEVELS)]
+        self._state_ids = {(bucket, level): i for i, (bucket, level) in enumerate(product(SKILL_BUCKETS, DEPENDENCY_LEVELS))}
+        store_path = store_path or Q_TABLE_STORE_PATH
+        # Readable snapshot of the shared store; also seeds an empty store on first start
+        self.filepath = snapshot_path or Q_TABLE_SNAPSHOT_PATH or os.path.splitext(store_path)[0] + ".json"
+        self.store = QTableStore(self.states, self.actions, alpha, gamma, path=store_path, snapshot_path=self.filepath)
         self.load_q_table()
 
+    @property
+    def q_table(self):
+        return self.store.as_dict()
+
     def get_state_key(self, skill_bucket, dependency_level):
         return f"{skill_bucket}_{dependency_level}"
 
+    def state_index(self, skill_bucket, dependency_level):
+        try:
+            return self._state_ids[(skill_bucket, dependency_level)]
+        except KeyError:
+            raise ValueError(f"Unknown state: {skill_bucket}, {dependency_level}") from None
+
     def get_q_values(self, state):
-        if state not in self.q_table:
-            self.q_table[state] = {action: 0.0 for action in self.actions}
-        return self.q_table[state]
+        return dict(zip(self.actions, self.store.q[self.store.state_index[state]].tolist()))
 
     def choose_action(self, skill_bucket, dependency_level):
-        state = self.get_state_key(skill_bucket, dependency_level)
-        
+        return self.choose_action_with_propensity(skill_bucket, dependency_level)[0]
+
+    def choose_action_with_propensity(self, skill_bucket, dependency_level):
+        """Epsilon-greedy action plus the probability the policy had of picking it (for off-policy evaluation)."""
+        greedy = self.actions[self.store.greedy[self.state_index(skill_bucket, dependency_level)]]
+        explore = self.epsilon / len(self.actions)
+
         # Epsilon-greedy strategy
         if random.uniform(0, 1) < self.epsilon:
-            return random.choice(self.actions)  # Explore
-        
-        q_values = self.get_q_values(state)
-        return max(q_values, key=q_values.get)  # Exploit best action
+            action = random.choice(self.actions)  # Explore
+        else:
+            action = greedy  # Exploit best action
+        return action, (1.0 - self.epsilon + explore) if action == greedy else explore
 
     def learn(self, skill_bucket, dependency_level, action, reward, next_skill_bucket, next_dependency_level):
-        state = self.get_state_key(skill_bucket, dependency_level)
-        next_state = self.get_state_key(next_skill_bucket, next_dependency_level)
-        
-        q_values = self.get_q_values(state)
-        next_q_values = self.get_q_values(next_state)
-        
-        current_q = q_values[action]
-        max_next_q = max(next_q_values.values())
-        
-        # Bellman Equation
-        new_q = current_q + self.alpha * (reward + self.gamma * max_next_q - current_q)
-        self.q_table[state][action] = new_q
-        self.save_q_table()
+        # Bellman Equation, applied locally now and written to the shared store on the next flush
+        return self.learn_indices(
+            self.state_index(skill_bucket, dependency_level),
+            self.actions.index(action),
+            reward,
+            self.state_index(next_skill_bucket, next_dependency_level),
+        )
+
+    def learn_indices(self, state, action, reward, next_state):
+        return self.store.update(state, action, reward, next_state)
+
+    def load_weights(self, q):
+        """Replace the shared Q-matrix, e.g. with one fitted offline by api.ml.train_rl."""
+        return self.store.replace(q)
 
     def save_q_table(self):
-        try:
-            with open(self.filepath, 'w') as f:
-                json.dump(self.q_table, f, indent=4)
-        except Exception as e:
-            print(f"Error saving Q-table: {e}")
+        """Flush pending updates to the shared store (and the JSON snapshot)."""
+        return self.store.flush()
 
     def load_q_table(self):
-        if os.path.exists(self.filepath):
-            try:
-                with open(self.filepath, 'r') as f:
-                    self.q_table = json.load(f)
-            except Exception as e:
-                print(f"Error loading Q-table: {e}")
-                
+        self.store.load(seed_path=self.filepath)
+
 # Singleton instance
 rl_agent = RLAgent()
@@ -0,0 +1,317 @@
+# api/ml/train_dkt.py
+"""CPU training pipeline for the DKT model.
+
+Streams interaction sequences (from QuizScore, or a synthetic simulator) in
+chunks of users, buckets them by length, trains with several DataLoader
+workers, checkpoints every epoch (and every --checkpoint-every steps) and
+writes a versioned checkpoint, then exports it to the NumPy serving file
+that adaptive_engine loads at startup.
+
+    python -m api.ml.train_dkt --epochs 5 --workers 4
+    python -m api.ml.train_dkt --synthetic 1000000 --epochs 3
+"""
+import argparse
+import os
+import random
+import time
+from datetime import datetime, timezone
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader, IterableDataset, get_worker_info
+
+from ..services.adaptive_engine import NUM_SKILLS
+from ..services.dkt_model import DKTModel, save_dkt_weights
+from .export_dkt import SERVING_WEIGHTS_PATH, publish
+
+ML_DIR = os.path.dirname(__file__)
+CHECKPOINT_DIR = os.path.join(ML_DIR, "dkt_checkpoints")
+
+# Every HOLDOUT_MODULUS-th user is held out for evaluation.
+HOLDOUT_MODULUS = 10
+
+
+# ---------- Sources ----------
+
+def _worker_range(start: int, end: int, worker_id: int, num_workers: int) -> Tuple[int, int]:
+    """This worker's contiguous share of the id range [start, end)."""
+    span = end - start
+    return start + span * worker_id // num_workers, start + span * (worker_id + 1) // num_workers
+
+
+def _db_chunks(chunk_users: int, worker_id: int = 0, num_workers: int = 1) -> Iterator[list]:
+    """Lists of (user_id, input id sequence), one query per chunk of users.
+
+    Only the users in this worker's share of the user-id range are queried.
+    """
+    from sqlalchemy import func
+
+    from ..database import SessionLocal
+    from ..models import QuizScore
+    from ..services.dkt_batch import _load_sequences, _user_chunks
+
+    db = SessionLocal()
+    try:
+        low, high = db.query(func.min(QuizScore.user_id), func.max(QuizScore.user_id)).one()
+        if low is None:
+            return
+        id_range = _worker_range(low, high + 1, worker_id, num_workers)
+        for user_ids in _user_chunks(db, None, chunk_users, id_range):
+            sequences = _load_sequences(db, user_ids)
+            yield [(uid, seq) for uid, (seq, _) in sequences.items()]
+    finally:
+        db.close()
+
+
+def _synthetic_chunks(total_interactions: int, chunk_users: int, seed: int = 0, keep_user=None,
+                      worker_id: int = 0, num_workers: int = 1) -> Iterator[list]:
+    """Simulated students: ability + per-skill difficulty, mastery grows with practice.
+
+    Users are generated deterministically from their id, so every epoch sees
+    the same dataset; each worker only generates its share of the ids.
+    """
+    difficulty = np.random.default_rng(seed).normal(0.0, 1.0, NUM_SKILLS)
+    n_users = max(1, total_interactions // 50)
+    first, end = _worker_range(1, n_users + 1, worker_id, num_workers)
+    for start in range(first, end, chunk_users):
+        chunk = []
+        for uid in range(start, min(start + chunk_users, end)):
+            if keep_user and not keep_user(uid):
+                continue
+            rng = np.random.default_rng(seed * 1_000_003 + uid)
+            ability = rng.normal()
+            topics = rng.choice(NUM_SKILLS, size=5, replace=False)
+            length = int(rng.integers(10, 91))
+            skills = rng.choice(topics, size=length)
+            # Number of earlier attempts at the same skill, for every step.
+            prior = np.zeros(length)
+            seen = {}
+            for t, skill in enumerate(skills):
+                prior[t] = seen.get(skill, 0)
+                seen[skill] = prior[t] + 1
+            p = 1.0 / (1.0 + np.exp(-(ability + 0.4 * prior - difficulty[skills])))
+            correct = (rng.random(length) < p).astype(np.int64)
+            seq = (skills + NUM_SKILLS * correct).tolist()
+            chunk.append((uid, seq))
+        yield chunk
+
+
+# ---------- Dataset ----------
+
+class InteractionSequences(IterableDataset):
+    """Yields ready-to-train padded batches, bucketed by sequence length.
+
+    Each DataLoader worker loads only its own share of the user ids. Long
+    sequences are cut into `max_len` windows. Within a buffer of `bucket_buffer`
+    sequences, windows are sorted by length and cut into batches, so padding
+    stays small; batch order is shuffled.
+    """
+
+    def __init__(self, split: str, batch_size: int = 64, max_len: int = 200, chunk_users: int = 2000,
+                 bucket_buffer: int = 4096, synthetic: Optional[int] = None, seed: int = 0):
+        self.split = split
+        self.batch_size = batch_size
+        self.max_len = max_len
+        self.chunk_users = chunk_users
+        self.bucket_buffer = bucket_buffer
+        self.synthetic = synthetic
+        self.seed = seed
+        self.epoch = 0
+
+    def _chunks(self):
+        info = get_worker_info()
+        worker_id, num_workers = (info.id, info.num_workers) if info else (0, 1)
+        if self.synthetic:
+            return _synthetic_chunks(self.synthetic, self.chunk_users, self.seed,
+                                     keep_user=lambda uid: (uid % HOLDOUT_MODULUS == 0) == (self.split == "eval"),
+                                     worker_id=worker_id, num_workers=num_workers)
+        return _db_chunks(self.chunk_users, worker_id, num_workers)
+
+    def _windows(self) -> Iterator[List[int]]:
+        for chunk in self._chunks():
+            for uid, seq in chunk:
+                held_out = uid % HOLDOUT_MODULUS == 0
+                if held_out != (self.split == "eval") or len(seq) < 2:
+                    continue
+                for start in range(0, len(seq), self.max_len):
+                    window = seq[start:start + self.max_len]
+                    if len(window) >= 2:
+                        yield window
+
+    def _batches(self, buffer: List[List[int]], rng: random.Random):
+        buffer.sort(key=len)
+        batches = [buffer[i:i + self.batch_size] for i in range(0, len(buffer), self.batch_size)]
+        if self.split == "train":
+            rng.shuffle(batches)
+        for batch in batches:
+            lengths = torch.tensor([len(s) for s in batch])
+            inputs = torch.zeros((len(batch), int(lengths.max())), dtype=torch.long)
+            for row, seq in enumerate(batch):
+                inputs[row, :len(seq)] = torch.tensor(seq)
+            yield inputs, lengths
+
+    def __iter__(self):
+        info = get_worker_info()
+        rng = random.Random(self.seed * 7919 + self.epoch * 31 + (info.id if info else 0))
+        buffer = []
+        for window in self._windows():
+            buffer.append(window)
+            if len(buffer) >= self.bucket_buffer:
+                yield from self._batches(buffer, rng)
+                buffer = []
+        if buffer:
+            yield from self._batches(buffer, rng)
+
+
+def _worker_init(_):
+    # Forked workers must not reuse the parent's pooled DB connections.
+    from ..database import engine
+    engine.dispose(close=False)
+    torch.set_num_threads(1)
+
+
+# ---------- Training / evaluation ----------
+
+def _next_step_targets(model: DKTModel, inputs: torch.Tensor, lengths: torch.Tensor):
+    """Predicted vs actual correctness of interaction t+1, for every valid t."""
+    preds, _ = model(inputs)
+    skills = inputs % NUM_SKILLS
+    correct = (inputs >= NUM_SKILLS).float()
+    p_next = preds[:, :-1, :].gather(2, skills[:, 1:].unsqueeze(-1)).squeeze(-1)
+    mask = torch.arange(inputs.shape[1] - 1).unsqueeze(0) < (lengths - 1).unsqueeze(1)
+    return p_next[mask], correct[:, 1:][mask]
+
+
+def roc_auc(labels: np.ndarray, scores: np.ndarray) -> float:
+    """Rank-based (Mann-Whitney) ROC AUC with tie handling."""
+    labels = np.asarray(labels, dtype=bool)
+    n_pos = int(labels.sum())
+    n_neg = len(labels) - n_pos
+    if n_pos == 0 or n_neg == 0:
+        return float("nan")
+    _, inverse, counts = np.unique(scores, return_inverse=True, return_counts=True)
+    avg_rank = np.cumsum(counts) - (counts - 1) / 2.0
+    ranks = avg_rank[inverse]
+    return float((ranks[labels].sum() - n_pos * (n_pos + 1) / 2.0) / (n_pos * n_neg))
+
+
+def evaluate(model: DKTModel, loader: DataLoader) -> dict:
+    model.eval()
+    all_p, all_y = [], []
+    with torch.no_grad():
+        for inputs, lengths in loader:
+            p, y = _next_step_targets(model, inputs, lengths)
+            all_p.append(p.numpy())
+            all_y.append(y.numpy())
+    model.train()
+    if not all_p:
+        return {"auc": float("nan"), "interactions": 0}
+    p = np.concatenate(all_p)
+    y = np.concatenate(all_y)
+    return {"auc": roc_auc(y, p), "accuracy": float(((p >= 0.5) == y).mean()), "interactions": int(len(y))}
+
+
+def _checkpoint_path(name: str) -> str:
+    return os.path.join(CHECKPOINT_DIR, name)
+
+
+def _save_checkpoint(model, optimizer, epoch: int, step: int, args):
+    os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+    tmp = _checkpoint_path("last.pt.tmp")
+    torch.save({
+        "model": model.state_dict(),
+        "optimizer": optimizer.state_dict(),
+        "epoch": epoch,
+        "step": step,
+        "args": vars(args),
+    }, tmp)
+    os.replace(tmp, _checkpoint_path("last.pt"))
+
+
+def train(args) -> dict:
+    torch.manual_seed(args.seed)
+    torch.set_num_threads(args.threads or os.cpu_count() or 1)
+
+    model = DKTModel(num_skills=NUM_SKILLS, hidden_dim=args.hidden_dim, input_dim=args.input_dim)
+    optimizer = torch.optim.Adam(model.parameters(), lr=args.lr)
+    loss_fn = nn.BCELoss()
+
+    start_epoch, skip_steps = 0, 0
+    if args.resume and os.path.exists(_checkpoint_path("last.pt")):
+        checkpoint = torch.load(_checkpoint_path("last.pt"), map_location="cpu")
+        model.load_state_dict(checkpoint["model"])
+        optimizer.load_state_dict(checkpoint["optimizer"])
+        start_epoch, skip_steps = checkpoint["epoch"], checkpoint["step"]
+        print(f"Resuming from epoch {start_epoch}, step {skip_steps}")
+
+    def loader(split: str) -> DataLoader:
+        dataset = InteractionSequences(split, args.batch_size, args.max_len, args.chunk_users,
+                                       synthetic=args.synthetic, seed=args.seed)
+        return dataset, DataLoader(dataset, batch_size=None, num_workers=args.workers,
+                                   worker_init_fn=_worker_init if args.workers else None,
+                                   persistent_workers=False)
+
+    train_set, train_loader = loader("train")
+    _, eval_loader = loader("eval")
+
+    model.train()
+    metrics = {}
+    for epoch in range(start_epoch, args.epochs):
+        train_set.epoch = epoch
+        started = time.perf_counter()
+        step, seen, total_loss = 0, 0, 0.0
+        for inputs, lengths in train_loader:
+            step += 1
+            if step <= skip_steps:
+                continue
+            p, y = _next_step_targets(model, inputs, lengths)
+            loss = loss_fn(p, y)
+            optimizer.zero_grad()
+            loss.backward()
+            nn.utils.clip_grad_norm_(model.parameters(), 5.0)
+            optimizer.step()
+
+            seen += len(y)
+            total_loss += loss.item() * len(y)
+            if args.checkpoint_every and step % args.checkpoint_every == 0:
+                _save_checkpoint(model, optimizer, epoch, step, args)
+        skip_steps = 0
+
+        elapsed = time.perf_counter() - started
+        metrics = evaluate(model, eval_loader)
+        metrics["train_loss"] = total_loss / seen if seen else float("nan")
+        print(f"epoch {epoch + 1}/{args.epochs}: loss {metrics['train_loss']:.4f} | "
+              f"eval AUC {metrics['auc']:.4f} | {seen / elapsed:,.0f} interactions/s")
+        _save_checkpoint(model, optimizer, epoch + 1, 0, args)
+
+    version = datetime.now(timezone.utc).strftime("dkt-%Y%m%d%H%M%S")
+    versioned_path = os.path.join(ML_DIR, f"{version}.pt")
+    save_dkt_weights(model, versioned_path, version, metrics)
+    if not args.no_publish:
+        publish(model, version, SERVING_WEIGHTS_PATH)
+    return {"version": version, "path": versioned_path, **metrics}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the DKT model on CPU.")
+    parser.add_argument("--epochs", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--max-len", type=int, default=200)
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument("--hidden-dim", type=int, default=100)
+    parser.add_argument("--input-dim", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=2, help="DataLoader worker processes")
+    parser.add_argument("--threads", type=int, default=None, help="Torch intra-op threads")
+    parser.add_argument("--chunk-users", type=int, default=2000, help="Users streamed per DB round trip")
+    parser.add_argument("--checkpoint-every", type=int, default=500, help="Steps between mid-epoch checkpoints")
+    parser.add_argument("--synthetic", type=int, default=None, help="Train on N simulated interactions instead of the DB")
+    parser.add_argument("--resume", action="store_true", help="Continue from dkt_checkpoints/last.pt")
+    parser.add_argument("--no-publish", action="store_true", help="Do not replace the serving dkt_weights.npz")
+    parser.add_argument("--seed", type=int, default=0)
+    print(train(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
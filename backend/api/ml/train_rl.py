@@ -0,0 +1,147 @@
+# api/ml/train_rl.py
+"""Offline batch trainer for RLAgent from the experience-replay log.
+
+The logged transitions are reduced, in one vectorized pass per chunk, to
+per-(state, action) sufficient statistics: visit counts, reward sums and
+next-state counts. Sweeps of the batch Q-learning update
+
+    Q[s, a] <- mean reward(s, a) + gamma * sum_s' P(s' | s, a) * max_a' Q[s', a']
+
+then run over the whole (states, actions) matrix at once until it stops
+moving. That is the fixed point sequential Q-learning over the same log
+converges to (with decaying step sizes), at a cost independent of the
+log's length after the first pass.
+Pairs never seen in the log keep their current value.
+
+    python -m api.ml.train_rl
+    python -m api.ml.train_rl --synthetic 5000000 --dry-run
+"""
+import argparse
+import time
+from typing import Iterable, Iterator, Optional, Tuple
+
+import numpy as np
+
+from .rl_agent import rl_agent
+
+# Log rows pulled from the database per chunk.
+REPLAY_CHUNK_ROWS = 200_000
+
+# (states, actions, rewards, next_states) as equal-length arrays
+ReplayChunk = Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+
+
+# ---------- Sources ----------
+
+def _db_chunks(chunk_rows: int = REPLAY_CHUNK_ROWS) -> Iterator[ReplayChunk]:
+    """The RLExperience log in id order, a chunk of columns at a time."""
+    from sqlalchemy import select
+
+    from ..database import SessionLocal
+    from ..models import RLExperience
+
+    db = SessionLocal()
+    try:
+        rows = db.execute(
+            select(RLExperience.state, RLExperience.action, RLExperience.reward, RLExperience.next_state)
+            .order_by(RLExperience.id)
+            .execution_options(yield_per=chunk_rows)
+        )
+        for partition in rows.partitions():
+            columns = np.array(partition, dtype=np.float64).T
+            yield columns[0].astype(np.int64), columns[1].astype(np.int64), columns[2], columns[3].astype(np.int64)
+    finally:
+        db.close()
+
+
+def _synthetic_chunks(total: int, n_states: int, n_actions: int, seed: int = 0,
+                      chunk_rows: int = REPLAY_CHUNK_ROWS) -> Iterator[ReplayChunk]:
+    """Random transitions where each action has a fixed expected reward per state."""
+    rng = np.random.default_rng(seed)
+    mean_reward = rng.normal(0.0, 0.05, (n_states, n_actions))
+    for start in range(0, total, chunk_rows):
+        n = min(chunk_rows, total - start)
+        s = rng.integers(0, n_states, n)
+        a = rng.integers(0, n_actions, n)
+        yield s, a, mean_reward[s, a] + rng.normal(0.0, 0.1, n), rng.integers(0, n_states, n)
+
+
+# ---------- Training ----------
+
+def replay_statistics(chunks: Iterable[ReplayChunk], n_states: int, n_actions: int) -> dict:
+    counts = np.zeros(n_states * n_actions)
+    reward_sum = np.zeros(n_states * n_actions)
+    next_counts = np.zeros(n_states * n_actions * n_states)
+    rows = 0
+    for s, a, r, s_next in chunks:
+        valid = (s >= 0) & (s < n_states) & (a >= 0) & (a < n_actions) & (s_next >= 0) & (s_next < n_states)
+        s, a, r, s_next = s[valid], a[valid], r[valid], s_next[valid]
+        pair = s * n_actions + a
+        counts += np.bincount(pair, minlength=counts.size)
+        reward_sum += np.bincount(pair, weights=r, minlength=reward_sum.size)
+        next_counts += np.bincount(pair * n_states + s_next, minlength=next_counts.size)
+        rows += len(s)
+    return {
+        "rows": rows,
+        "counts": counts.reshape(n_states, n_actions),
+        "reward_sum": reward_sum.reshape(n_states, n_actions),
+        "next_counts": next_counts.reshape(n_states, n_actions, n_states),
+    }
+
+
+def fit_q(stats: dict, gamma: float, q_init: Optional[np.ndarray] = None,
+          max_sweeps: int = 1000, tol: float = 1e-8) -> Tuple[np.ndarray, int]:
+    """Batch Q-learning sweeps over the empirical model. Returns (Q, sweeps run)."""
+    counts = stats["counts"]
+    seen = counts > 0
+    safe = np.where(seen, counts, 1.0)
+    mean_reward = stats["reward_sum"] / safe
+    transition = stats["next_counts"] / safe[:, :, None]
+
+    q = np.zeros(counts.shape) if q_init is None else np.array(q_init, dtype=np.float64)
+    for sweep in range(1, max_sweeps + 1):
+        target = mean_reward + gamma * (transition @ q.max(axis=1))
+        updated = np.where(seen, target, q)
+        delta = np.max(np.abs(updated - q)) if q.size else 0.0
+        q = updated
+        if delta < tol:
+            break
+    return q, sweep
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Refit the RLAgent Q-matrix from logged experience.")
+    parser.add_argument("--synthetic", type=int, default=0, help="Train on N simulated transitions instead of the log")
+    parser.add_argument("--chunk-rows", type=int, default=REPLAY_CHUNK_ROWS)
+    parser.add_argument("--max-sweeps", type=int, default=1000)
+    parser.add_argument("--tol", type=float, default=1e-8)
+    parser.add_argument("--dry-run", action="store_true", help="Fit and report without publishing")
+    args = parser.parse_args()
+
+    n_states, n_actions = len(rl_agent.states), len(rl_agent.actions)
+    if args.synthetic:
+        chunks = _synthetic_chunks(args.synthetic, n_states, n_actions, chunk_rows=args.chunk_rows)
+    else:
+        chunks = _db_chunks(args.chunk_rows)
+
+    started = time.perf_counter()
+    stats = replay_statistics(chunks, n_states, n_actions)
+    replayed = time.perf_counter()
+    q, sweeps = fit_q(stats, rl_agent.gamma, rl_agent.store.q, args.max_sweeps, args.tol)
+    fitted = time.perf_counter()
+    print(f"replayed {stats['rows']:,} transitions in {replayed - started:.2f}s "
+          f"({stats['rows'] / max(replayed - started, 1e-9):,.0f}/s), {sweeps} sweeps in {(fitted - replayed) * 1000:.1f} ms")
+    print(f"unvisited (state, action) pairs: {int((stats['counts'] == 0).sum())}")
+
+    greedy = q.argmax(axis=1)
+    for s, state in enumerate(rl_agent.states):
+        print(f"  {state:<16} {rl_agent.actions[greedy[s]]:<13} {np.round(q[s], 4).tolist()}")
+
+    if args.dry_run or not stats["rows"]:
+        return
+    if rl_agent.load_weights(q):
+        print(f"published to {rl_agent.store.path}")
+
+
+if __name__ == "__main__":
+    main()
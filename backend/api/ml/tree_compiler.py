@@ -0,0 +1,167 @@
+# api/ml/tree_compiler.py
+"""Compiles an XGBoost JSON model into flat NumPy arrays for scoring without xgboost.
+
+Every tree is re-laid out as a perfect binary tree of the ensemble's max
+depth (shallower leaves are pushed down through always-left dummy splits).
+A tree's leaf is then a pure function of its split outcomes, so each tree
+gets a lookup table from the bit pattern of its split results to the leaf
+weight. Scoring a chunk of rows is: evaluate each distinct split once,
+pack every tree's split bits into a code, gather one weight per tree, and
+sum the trees in order.
+"""
+import json
+
+import numpy as np
+
+# Rows scored per step; bounds the (splits, rows) scratch arrays.
+CHUNK_ROWS = 16384
+# Below this many rows one flat gather over all trees beats a per-tree loop.
+SMALL_BATCH_ROWS = 1024
+# Lookup tables hold 2 ** (2 ** depth - 1) entries per tree, so deeper
+# ensembles are rejected and the caller falls back to xgboost.
+MAX_COMPILED_DEPTH = 4
+
+_OBJECTIVES = {"binary:logistic", "reg:logistic"}
+
+
+def _sigmoid(margin: np.ndarray) -> np.ndarray:
+    # exp is rounded from float64 (closer to libm expf than NumPy's float32 SIMD exp),
+    # the rest is float32 like XGBoost's 1 / (1 + exp(-x)).
+    one = np.float32(1.0)
+    return one / (one + np.exp(-margin.astype(np.float64)).astype(np.float32))
+
+
+def _tree_depth(left: list, right: list) -> int:
+    depth, stack = 0, [(0, 0)]
+    while stack:
+        node, level = stack.pop()
+        if left[node] == -1:
+            depth = max(depth, level)
+        else:
+            stack += [(left[node], level + 1), (right[node], level + 1)]
+    return depth
+
+
+class CompiledForest:
+    """Tree ensemble from `dependency_detection_model.json`, scored with NumPy only."""
+
+    def __init__(self, model_json: dict):
+        learner = model_json["learner"]
+        objective = learner["objective"]["name"]
+        if objective not in _OBJECTIVES:
+            raise ValueError(f"Unsupported objective: {objective}")
+        params = learner["learner_model_param"]
+        if int(params.get("num_class", "0")) > 1 or int(params.get("num_target", "1")) != 1:
+            raise ValueError("Only single-output models are supported")
+        booster = learner["gradient_booster"]
+        if booster["name"] != "gbtree":
+            raise ValueError(f"Unsupported booster: {booster['name']}")
+
+        trees = booster["model"]["trees"]
+        if any(any(t["split_type"]) for t in trees):
+            raise ValueError("Categorical splits are not supported")
+
+        self.feature_names = learner.get("feature_names") or []
+        self.num_features = int(params["num_feature"])
+        self.num_trees = len(trees)
+
+        # base_score is stored as a probability ("[2.2688067E-1]" in XGBoost 3.x) and
+        # converted to a margin the way XGBoost does it, in float32.
+        base_score = np.float32(float(params["base_score"].strip("[]")))
+        self.base_margin = np.float32(-np.log(np.float32(1.0) / base_score - np.float32(1.0)))
+
+        # At least one level, so stump-only ensembles still have a split bit per tree.
+        self.max_depth = max(1, max(_tree_depth(t["left_children"], t["right_children"]) for t in trees))
+        if self.max_depth > MAX_COMPILED_DEPTH:
+            raise ValueError(f"Trees of depth {self.max_depth} exceed MAX_COMPILED_DEPTH")
+        n_splits = 2 ** self.max_depth - 1
+        shape = (self.num_trees, n_splits)
+        feature = np.zeros(shape, dtype=np.int64)
+        threshold = np.full(shape, np.inf, dtype=np.float32)
+        default_left = np.ones(shape, dtype=bool)
+        leaf_value = np.zeros((self.num_trees, n_splits + 1), dtype=np.float32)
+
+        for t, tree in enumerate(trees):
+            stack = [(0, 0)]  # (xgboost node id, perfect-tree position)
+            while stack:
+                node, pos = stack.pop()
+                if tree["left_children"][node] == -1:
+                    # Leaf above the bottom level: dummy splits all go left, so the
+                    # leftmost bottom descendant carries the weight.
+                    while pos < n_splits:
+                        pos = 2 * pos + 1
+                    leaf_value[t, pos - n_splits] = tree["split_conditions"][node]
+                    continue
+                feature[t, pos] = tree["split_indices"][node]
+                threshold[t, pos] = tree["split_conditions"][node]
+                default_left[t, pos] = bool(tree["default_left"][node])
+                stack += [(tree["left_children"][node], 2 * pos + 1), (tree["right_children"][node], 2 * pos + 2)]
+
+        # Distinct (feature, threshold, default_left) splits are evaluated once per row.
+        keys, split_index = np.unique(
+            np.stack([feature.ravel(), threshold.ravel(), default_left.ravel()]), axis=1, return_inverse=True
+        )
+        self.split_feature = keys[0].astype(np.int64)
+        self.split_threshold = keys[1].astype(np.float32)[:, None]
+        self.split_default_left = keys[2].astype(bool)[:, None]
+        self.split_index = split_index.reshape(shape)
+        self._split_columns = [np.ascontiguousarray(self.split_index[:, j]) for j in range(n_splits)]
+
+        # Bit j of a tree's code is "go left" at perfect-tree position j.
+        codes = np.arange(2 ** n_splits, dtype=np.int64)
+        pos = np.zeros_like(codes)
+        for _ in range(self.max_depth):
+            go_left = (codes >> pos) & 1
+            pos = 2 * pos + 2 - go_left
+        self.leaf_table = np.ascontiguousarray(leaf_value[:, pos - n_splits])
+        self._code_dtype = np.uint8 if n_splits <= 8 else np.uint16
+        self._tree_tables = list(self.leaf_table)
+        self._table_offsets = (np.arange(self.num_trees, dtype=np.int64) * 2 ** n_splits)[:, None]
+        self._n_splits = n_splits
+
+    @classmethod
+    def from_file(cls, path: str) -> "CompiledForest":
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def _margin_chunk(self, X: np.ndarray) -> np.ndarray:
+        Xt = np.ascontiguousarray(X.T)
+        x = Xt[self.split_feature]
+        go_left = x < self.split_threshold
+        missing = np.isnan(x)
+        if missing.any():
+            go_left |= missing & self.split_default_left
+        go_left = go_left.view(np.uint8).astype(self._code_dtype, copy=False)
+
+        # (trees, rows) codes; bit j is the outcome at perfect-tree position j.
+        code = go_left.take(self._split_columns[0], axis=0)
+        shifted = np.empty_like(code)
+        for j in range(1, self._n_splits):
+            np.left_shift(go_left.take(self._split_columns[j], axis=0), j, out=shifted)
+            code |= shifted
+
+        # Trees are summed in order in float32, as XGBoost adds them.
+        if len(X) < SMALL_BATCH_ROWS:
+            stacked = np.empty((self.num_trees + 1, len(X)), dtype=np.float32)
+            stacked[0] = self.base_margin
+            stacked[1:] = self.leaf_table.ravel()[code + self._table_offsets]
+            return np.cumsum(stacked, axis=0, dtype=np.float32)[-1]
+        margin = np.full(len(X), self.base_margin, dtype=np.float32)
+        for table, tree_code in zip(self._tree_tables, code):
+            margin += table.take(tree_code)
+        return margin
+
+    def predict_margin(self, X) -> np.ndarray:
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X[None, :]
+        if X.shape[1] != self.num_features:
+            raise ValueError(f"Expected {self.num_features} features, got {X.shape[1]}")
+        if len(X) <= CHUNK_ROWS:
+            return self._margin_chunk(X)
+        return np.concatenate([self._margin_chunk(X[start:start + CHUNK_ROWS])
+                               for start in range(0, len(X), CHUNK_ROWS)])
+
+    def predict(self, X) -> np.ndarray:
+        """Probabilities for a (rows, features) array or a single feature row."""
+        return _sigmoid(self.predict_margin(X))
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, JSON, Boolean
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, JSON, Boolean, LargeBinary, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from .database import Base
@@ -30,12 +30,21 @@ class UserHistory(Base):
     title = Column(String, nullable=True) # Chat Title
     prompt = Column(String)
     response = Column(String)
-    embedding_vector = Column(JSON, nullable=True) 
+    embedding_vector = Column(JSON(none_as_null=True), nullable=True) # Legacy; superseded by embedding_blob
+    embedding_blob = Column(LargeBinary, nullable=True) # Packed float32, see services/embedding_storage.py
+    embedding_model = Column(String, nullable=True)
+    embedding_dim = Column(Integer, nullable=True)
     telemetry_data = Column(JSON, nullable=True) # New Telemetry Column
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     user = relationship("User", back_populates="history")
 
+    # Per-user "latest N" lookups (SSI inputs) read these instead of scanning the table
+    __table_args__ = (
+        Index("ix_user_history_user_id_id", "user_id", "id"),
+        Index("ix_user_history_user_session_created", "user_id", "session_id", "created_at"),
+    )
+
 class StudentSkillIndex(Base):
     __tablename__ = "student_skill_index"
     
@@ -83,6 +92,8 @@ class QuizScore(Base):
     
     user = relationship("User", back_populates="quiz_scores")
 
+    __table_args__ = (Index("ix_quiz_scores_user_created", "user_id", "created_at"),)
+
 class TelemetryLog(Base):
     __tablename__ = "telemetry_logs"
     
@@ -97,6 +108,8 @@ class TelemetryLog(Base):
     
     user = relationship("User", back_populates="telemetry")
 
+    __table_args__ = (Index("ix_telemetry_logs_user_created", "user_id", "created_at"),)
+
 
 class DKTState(Base):
     __tablename__ = "dkt_states"
@@ -105,7 +118,139 @@ class DKTState(Base):
     user_id = Column(Integer, ForeignKey("users.id"), unique=True)
     
     skill_vector = Column(JSON) 
+
+    # Incremental DKT: packed float32 LSTM (h, c) after the last consumed interaction
+    hidden_state = Column(LargeBinary, nullable=True)
+    last_quiz_id = Column(Integer, default=0)
+    interaction_count = Column(Integer, default=0)
+    model_version = Column(String, nullable=True)
     
-    last_update = Column(DateTime(timezone=True), server_default=func.now())
+    last_update = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
     
-    user = relationship("User", back_populates="dkt_state")
\ No newline at end of file
+    user = relationship("User", back_populates="dkt_state")
+
+
+class SessionFeatureState(Base):
+    """Running telemetry aggregate per chat session (see services/session_features.py)."""
+    __tablename__ = "session_feature_state"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    session_id = Column(String)
+
+    turn_count = Column(Integer, default=0)
+    # Last SESSION_FEATURE_ROWS turns, oldest first: [history_id, has_data, copy, paste, tab_switch, time_ms]
+    window = Column(JSON)
+    # Sums over the window; the dependency features are read straight from these
+    window_rows = Column(Integer, default=0)
+    copy_sum = Column(Float, default=0.0)
+    paste_sum = Column(Float, default=0.0)
+    tab_switch_sum = Column(Float, default=0.0)
+    time_to_query_sum = Column(Float, default=0.0)
+    last_history_id = Column(Integer, default=0)
+
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (UniqueConstraint("user_id", "session_id", name="uq_session_feature_state_user_session"),)
+
+
+class RLExperience(Base):
+    """Replay log for RLAgent: one (state, action, reward, next state) per profile update."""
+    __tablename__ = "rl_experience"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+
+    # Indices into rl_agent's enumerated states / ACTIONS
+    state = Column(Integer)
+    action = Column(Integer)
+    propensity = Column(Float)  # Probability the logging policy picked `action`
+    reward = Column(Float)
+    next_state = Column(Integer)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (Index("ix_rl_experience_user_created", "user_id", "created_at"),)
+
+
+class ProfileDecision(Base):
+    """Log of what each profile update chose, with propensities, for off-policy evaluation (api/ml/ope.py)."""
+    __tablename__ = "profile_decisions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+
+    # Context the decision was made in
+    ssi = Column(Float)
+    dependency_prob = Column(Float)
+
+    # Learning path: index into adaptive_engine.PATH_TYPES
+    path = Column(Integer)
+    path_propensity = Column(Float)
+
+    # RLAgent decision: indices into rl_agent's states / ACTIONS
+    rl_state = Column(Integer)
+    rl_action = Column(Integer)
+    rl_propensity = Column(Float)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (Index("ix_profile_decisions_user_created", "user_id", "created_at"),)
+
+
+class PregeneratedQuiz(Base):
+    """Quiz generated ahead of /quiz/generate for a user's current chat context (see services/quiz_cache.py)."""
+    __tablename__ = "pregenerated_quizzes"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    scope = Column(String, nullable=False)  # session_id, or "" for the latest turns across sessions
+
+    context_hash = Column(String)  # sha256 of (context row ids, weak topics, model)
+    model = Column(String)
+    quiz = Column(JSON)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (UniqueConstraint("user_id", "scope", name="uq_pregenerated_quizzes_user_scope"),)
+
+
+class QuizBankQuestion(Base):
+    """Validated LLM-generated quiz question, reused across users by similarity (see services/question_bank.py)."""
+    __tablename__ = "quiz_bank_questions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    topic = Column(String, index=True)
+    question_text = Column(String)
+    options = Column(JSON)  # [{"id": "A", "text": "..."}, ...]
+    correct_option_id = Column(String)
+    explanation = Column(String)
+    source_model = Column(String)  # LLM that wrote the question
+
+    # Embedding of "topic: question_text", same model and packing as UserHistory.embedding_blob
+    embedding_blob = Column(LargeBinary)
+    embedding_model = Column(String)
+    embedding_dim = Column(Integer)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class TopicMastery(Base):
+    """Running per-topic quiz aggregate for a user (see services/topic_mastery.py)."""
+    __tablename__ = "topic_mastery"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    topic_tag = Column(String)
+
+    attempts = Column(Integer, default=0)
+    score_sum = Column(Float, default=0.0)
+    question_sum = Column(Integer, default=0)
+    ratio_sum = Column(Float, default=0.0)  # Sum of per-quiz fraction correct; / attempts is the plain average
+    min_ratio = Column(Float)  # Lowest fraction correct on any quiz
+    # Average fraction correct with each quiz's weight halving every TOPIC_MASTERY_HALF_LIFE_DAYS
+    decayed_ratio = Column(Float, default=0.0)
+    decayed_weight = Column(Float, default=0.0)
+    last_seen = Column(DateTime(timezone=True))
+
+    __table_args__ = (UniqueConstraint("user_id", "topic_tag", name="uq_topic_mastery_user_topic"),)
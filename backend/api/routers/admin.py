@@ -0,0 +1,56 @@
+import asyncio
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy.orm import Session
+from ..deps import get_db, get_admin_user
+from ..schemas import MasteryRecomputeRequest, SSIRecomputeRequest
+from ..services.adaptive_engine import WEIGHT_INDEPENDENCE, WEIGHT_QUALITY, WEIGHT_RETENTION
+from ..services.dkt_batch import recompute_mastery_bulk
+from ..services.ssi_batch import SSIJobRunning, recompute_ssi_bulk, ssi_job_status
+
+router = APIRouter(
+    prefix="/admin",
+    tags=["admin"]
+)
+
+
+@router.post("/mastery/recompute")
+async def recompute_mastery(
+    request: Optional[MasteryRecomputeRequest] = None,
+    db: Session = Depends(get_db),
+    admin: dict = Depends(get_admin_user)
+):
+    """
+    Bulk DKT mastery recompute. Runs off the event loop and reports users/second.
+    """
+    request = request or MasteryRecomputeRequest()
+    return await asyncio.to_thread(recompute_mastery_bulk, db, request.user_ids, request.batch_size)
+
+
+@router.post("/ssi/recompute")
+async def recompute_ssi(
+    request: Optional[SSIRecomputeRequest] = None,
+    db: Session = Depends(get_db),
+    admin: dict = Depends(get_admin_user)
+):
+    """
+    Cohort-wide SSI / bucket / learning path recompute. With dry_run, returns the
+    diff report without writing. Progress: GET /admin/ssi/recompute/status.
+    """
+    request = request or SSIRecomputeRequest()
+    weights = None
+    if any(w is not None for w in (request.weight_retention, request.weight_independence, request.weight_quality)):
+        weights = (
+            WEIGHT_RETENTION if request.weight_retention is None else request.weight_retention,
+            WEIGHT_INDEPENDENCE if request.weight_independence is None else request.weight_independence,
+            WEIGHT_QUALITY if request.weight_quality is None else request.weight_quality,
+        )
+    try:
+        return await asyncio.to_thread(recompute_ssi_bulk, db, request.user_ids, request.dry_run, weights)
+    except SSIJobRunning as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+
+
+@router.get("/ssi/recompute/status")
+def ssi_recompute_status(admin: dict = Depends(get_admin_user)):
+    return ssi_job_status
@@ -2,8 +2,10 @@ from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from sqlalchemy import func, desc
 from typing import List, Dict, Any
-from ..deps import get_db, get_current_user
+from ..deps import get_db, get_current_user, get_admin_user
 from ..models import QuizScore
+from ..services.profile_worker import profile_worker
+from ..services.topic_mastery import user_mastery
 
 router = APIRouter(
     prefix="/analytics",
@@ -59,30 +61,31 @@ async def get_weakness_heatmap(
 ):
     """
     Returns topics ordered by lowest average score.
+    Read from the per-topic rollup, so the cost does not grow with quiz history.
     """
     user_id = current_user['user_id']
-    
-    results = db.query(
-        QuizScore.topic_tag,
-        func.avg(QuizScore.score / QuizScore.total_questions * 100).label('avg_score'),
-        func.count(QuizScore.id).label('attempts')
-    ).filter(
-        QuizScore.user_id == user_id
-    ).group_by(
-        QuizScore.topic_tag
-    ).order_by(
-        'avg_score' # Ascending (Lowest first)
-    ).all()
+
+    mastery = [m for m in user_mastery(db, user_id) if m.attempts]
+    mastery.sort(key=lambda m: m.ratio_sum / m.attempts) # Ascending (Lowest first)
 
     data = []
-    for r in results:
-        score = round(r.avg_score, 1)
+    for m in mastery:
+        score = round(m.ratio_sum / m.attempts * 100, 1)
         bucket = "Critical" if score < 40 else ("Weak" if score < 70 else "Strong")
         data.append({
-            "topic": r.topic_tag,
+            "topic": m.topic_tag,
             "score": score,
-            "attempts": r.attempts,
+            "recent_score": round(m.decayed_ratio * 100, 1),
+            "attempts": m.attempts,
+            "last_seen": m.last_seen,
             "bucket": bucket
         })
         
     return data
+
+@router.get("/profile-updates")
+async def get_profile_update_stats(admin: dict = Depends(get_admin_user)):
+    """
+    Queue depth, coalescing and recompute latency of the background profile updater (admins only).
+    """
+    return profile_worker.get_stats()
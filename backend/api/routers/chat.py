@@ -1,16 +1,30 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from sqlalchemy import desc
 from sqlalchemy.sql import func
-from typing import List, Optional
+from typing import AsyncIterator, List, Optional, Tuple
+import asyncio
+import functools
+import json
 import os
-import numpy as np
+import time
 import google.generativeai as genai
+from ..database import SessionLocal
 from ..deps import get_db, get_current_user
-from ..models import User, UserHistory, LearningPath
-from ..schemas import UserHistoryCreate, UserHistoryResponse
-from ..services.adaptive_engine import update_student_profile
-from groq import Groq
+from ..models import User, UserHistory, LearningPath, StudentSkillIndex
+from ..schemas import SimilarPromptResponse, UserHistoryCreate, UserHistoryResponse
+from ..services.embedding_cache import embedding_cache
+from ..services.embedding_storage import embedding_columns, stack_history_embeddings
+from ..services.llm_resilience import get_breaker, get_resilience_status, hedged_call
+from ..services.profile_worker import profile_worker
+from ..services.quiz_cache import quiz_cache
+from ..services.response_cache import response_cache
+from ..services.session_features import forget_session, history_deleted, record_turn
+from ..services.similarity import best_match
+from ..services.title_service import fallback_title, title_worker
+from ..services.vector_index import vector_index
+from groq import AsyncGroq
 import uuid
 
 # ---------- Configuration / Constants ----------
@@ -22,6 +36,15 @@ GEMINI_PRIMARY_MODEL = "models/gemini-2.5-flash"
 GEMINI_FALLBACK_MODEL = "models/gemini-2.0-flash"  # set to a different model if available
 EMBEDDING_MODEL = "models/text-embedding-004"
 
+# Struggle detection: how many past turns of the session to compare against
+# (0 = the whole session) and the cosine similarity that counts as a repeat.
+STRUGGLE_WINDOW_TURNS = int(os.getenv("STRUGGLE_WINDOW_TURNS", "5"))
+STRUGGLE_SIMILARITY_THRESHOLD = float(os.getenv("STRUGGLE_SIMILARITY_THRESHOLD", "0.70"))
+# Also flag repeats of prompts from earlier sessions via the per-user vector index.
+STRUGGLE_CROSS_SESSION = os.getenv("STRUGGLE_CROSS_SESSION", "1") == "1"
+# Index hits fetched per cross-session check; deleted prompts among them are skipped.
+STRUGGLE_CROSS_SESSION_CANDIDATES = 5
+
 # initialize SDKs
 if GEMINI_API_KEY:
     genai.configure(api_key=GEMINI_API_KEY)
@@ -30,7 +53,7 @@ else:
 
 try:
     if GROQ_API_KEY:
-        groq_client = Groq(api_key=GROQ_API_KEY)
+        groq_client = AsyncGroq(api_key=GROQ_API_KEY)
     else:
         groq_client = None
         print("INFO: GROQ_API_KEY not set — Llama3 fallback disabled.")
@@ -43,28 +66,35 @@ router = APIRouter(prefix="/chat", tags=["chat"])
 
 # ---------- Utilities ----------
 
-def calculate_cosine_similarity(vec_a: List[float], vec_b: List[float]) -> float:
-    if not vec_a or not vec_b:
-        return 0.0
-    a = np.array(vec_a)
-    b = np.array(vec_b)
-    norm_a = np.linalg.norm(a)
-    norm_b = np.linalg.norm(b)
-    if norm_a == 0 or norm_b == 0:
-        return 0.0
-    return float(np.dot(a, b) / (norm_a * norm_b))
-
-
-def get_embedding(text: str) -> List[float]:
+async def get_embedding(text: str) -> List[float]:
+    # Memory tier inline; the SQLite tier is blocking I/O, keep it off the event loop
+    cached = embedding_cache.get_memory(EMBEDDING_MODEL, text)
+    if cached is None:
+        cached = await asyncio.to_thread(embedding_cache.get_disk, EMBEDDING_MODEL, text)
+    if cached is not None:
+        return cached
     try:
-        result = genai.embed_content(model=EMBEDDING_MODEL, content=text)
-        return result.get('embedding', [])
+        result = await genai.embed_content_async(model=EMBEDDING_MODEL, content=text)
+        embedding = result.get('embedding', [])
+        embedding_cache.remember(EMBEDDING_MODEL, text, embedding)
+        await asyncio.to_thread(embedding_cache.store_disk, EMBEDDING_MODEL, text, embedding)
+        return embedding
     except Exception as e:
         print(f"Embedding Error: {e}")
         return []
 
 
-def get_system_persona(learning_path: Optional[LearningPath], struggle_override: bool = False) -> str:
+# Teaching style for each RL agent action (api.ml.rl_agent.ACTIONS). The action chosen at the
+# user's last profile update shapes every answer until the next one, whose SSI change rewards it.
+TEACHING_STYLES = {
+    "Theory-First": "Explain the underlying concept before showing any code.",
+    "Code-First": "Lead with a short working code example, then explain the concept behind it.",
+    "Balanced": "Alternate short concept explanations with small code examples.",
+}
+
+
+def get_system_persona(learning_path: Optional[LearningPath], struggle_override: bool = False,
+                       teaching_style: Optional[str] = None) -> str:
     if struggle_override:
         return (
             "SYSTEM OVERRIDE: ACTIVE RECALL MODE ENABLED.\n"
@@ -77,94 +107,382 @@ def get_system_persona(learning_path: Optional[LearningPath], struggle_override:
         )
 
     if not learning_path:
-        return "You are a helpful and clear computer science tutor."
+        persona = "You are a helpful and clear computer science tutor."
+    else:
+        mode = getattr(learning_path, 'path_type', None)
+        if mode == "Reinforcement":
+            persona = "You are a supportive tutor. Use analogies and hints. Avoid full code answers."
+        elif mode == "Acceleration":
+            persona = "You are a strict technical examiner. Be concise and challenge the student."
+        else:
+            persona = "You are a balanced tutor. Explain clearly."
 
-    mode = getattr(learning_path, 'path_type', None)
-    if mode == "Reinforcement":
-        return "You are a supportive tutor. Use analogies and hints. Avoid full code answers."
-    if mode == "Acceleration":
-        return "You are a strict technical examiner. Be concise and challenge the student."
-    return "You are a balanced tutor. Explain clearly."
+    if teaching_style in TEACHING_STYLES:
+        persona = f"{persona} {TEACHING_STYLES[teaching_style]}"
+    return persona
 
 
 # ---------- LLM calling logic (refactored) ----------
 
-def _call_gemini_model(model_name: str, system_prompt: str, chat_history: List[dict], user_message: str) -> str:
-    """Call Gemini via google.generativeai with a prepared history.
-    Returns the text response or raises an exception if the call fails.
-    """
-    model = genai.GenerativeModel(model_name=model_name, system_instruction=system_prompt)
+LLM_FAILURE_MESSAGE = "I'm having trouble thinking right now. Please try again later."
+
 
+def _to_gemini_history(chat_history: List[dict]) -> List[dict]:
     gemini_history = []
     for msg in chat_history:
         gemini_history.append({"role": "user", "parts": [msg.get('prompt', '')]})
         gemini_history.append({"role": "model", "parts": [msg.get('response', '')]})
+    return gemini_history
 
-    chat = model.start_chat(history=gemini_history)
-    response = chat.send_message(user_message)
-    return response.text
-
-
-def _call_groq_model(model_name: str, system_prompt: str, chat_history: List[dict], user_message: str) -> str:
-    if not groq_client:
-        raise RuntimeError("Groq client not configured")
 
+def _to_groq_messages(system_prompt: str, chat_history: List[dict], user_message: str) -> List[dict]:
     messages = [{"role": "system", "content": system_prompt}]
     for msg in chat_history:
         messages.append({"role": "user", "content": msg.get('prompt', '')})
         messages.append({"role": "assistant", "content": msg.get('response', '')})
     messages.append({"role": "user", "content": user_message})
+    return messages
+
+
+async def _call_gemini_model(model_name: str, system_prompt: str, chat_history: List[dict], user_message: str) -> str:
+    """Call Gemini via google.generativeai with a prepared history.
+    Uses the async transport so the event loop is free while the model generates.
+    Returns the text response or raises an exception if the call fails.
+    """
+    model = genai.GenerativeModel(model_name=model_name, system_instruction=system_prompt)
+    chat = model.start_chat(history=_to_gemini_history(chat_history))
+    response = await chat.send_message_async(user_message)
+    return response.text
 
-    chat_completion = groq_client.chat.completions.create(
-        messages=messages,
+
+async def _call_groq_model(model_name: str, system_prompt: str, chat_history: List[dict], user_message: str) -> str:
+    if not groq_client:
+        raise RuntimeError("Groq client not configured")
+
+    chat_completion = await groq_client.chat.completions.create(
+        messages=_to_groq_messages(system_prompt, chat_history, user_message),
         model=model_name,
     )
     return chat_completion.choices[0].message.content
 
 
-def call_llm_service(system_prompt: str, chat_history: List[dict], user_message: str, model_choice: str = "gemini") -> str:
-    """High-level LLM selector with robust fallbacks.
+async def _stream_gemini_model(model_name: str, system_prompt: str, chat_history: List[dict], user_message: str) -> AsyncIterator[str]:
+    """Same as `_call_gemini_model` but yields text chunks as Gemini produces them."""
+    model = genai.GenerativeModel(model_name=model_name, system_instruction=system_prompt)
+    chat = model.start_chat(history=_to_gemini_history(chat_history))
+    response = await chat.send_message_async(user_message, stream=True)
+    async for chunk in response:
+        if chunk.text:
+            yield chunk.text
+
+
+async def _stream_groq_model(model_name: str, system_prompt: str, chat_history: List[dict], user_message: str) -> AsyncIterator[str]:
+    if not groq_client:
+        raise RuntimeError("Groq client not configured")
+
+    stream = await groq_client.chat.completions.create(
+        messages=_to_groq_messages(system_prompt, chat_history, user_message),
+        model=model_name,
+        stream=True,
+    )
+    async for chunk in stream:
+        delta = chunk.choices[0].delta.content if chunk.choices else None
+        if delta:
+            yield delta
+
+
+_CALLERS = {"gemini": _call_gemini_model, "groq": _call_groq_model}
+_STREAMERS = {"gemini": _stream_gemini_model, "groq": _stream_groq_model}
+
+
+def _backend_chain(model_choice: str) -> List[tuple]:
+    """Ordered (provider, model_name) pairs to try for `model_choice`.
 
     Fallback order (for `model_choice == 'gemini'`):
       1) GEMINI_PRIMARY_MODEL
       2) GEMINI_FALLBACK_MODEL
       3) groq/llama3 (if configured)
 
-    If `model_choice` is 'llama3' or 'deepseek', we route to Groq.
+    If `model_choice` is 'llama3' or 'deepseek', we route to Groq only.
     """
+    if model_choice == "llama3":
+        return [("groq", "llama-3.1-8b-instant")]
+    if model_choice == "deepseek":
+        # Using DeepSeek R1 Distill Llama 70B via Groq
+        return [("groq", "deepseek-r1-distill-llama-70b")]
+
+    chain = [("gemini", GEMINI_PRIMARY_MODEL)]
+    if GEMINI_FALLBACK_MODEL and GEMINI_FALLBACK_MODEL != GEMINI_PRIMARY_MODEL:
+        chain.append(("gemini", GEMINI_FALLBACK_MODEL))
+    if groq_client:
+        chain.append(("groq", "llama-3.1-8b-instant"))
+    return chain
+
+
+async def call_llm_service(system_prompt: str, chat_history: List[dict], user_message: str, model_choice: str = "gemini") -> str:
+    """High-level LLM selector with hedging and per-backend circuit breakers.
+
+    Backends from `_backend_chain` are raced via `hedged_call`: the next one starts
+    when the current one errors or runs past its hedge delay (a high percentile of
+    its recent latencies), and backends whose breaker is open are skipped.
+    """
+    attempts = [
+        (f"{provider}:{model_name}",
+         functools.partial(_CALLERS[provider], model_name, system_prompt, chat_history, user_message))
+        for provider, model_name in _backend_chain(model_choice)
+    ]
     try:
-        if model_choice == "llama3":
-            return _call_groq_model("llama-3.1-8b-instant", system_prompt, chat_history, user_message)
-        
-        if model_choice == "deepseek":
-            # Using DeepSeek R1 Distill Llama 70B via Groq
-            return _call_groq_model("deepseek-r1-distill-llama-70b", system_prompt, chat_history, user_message)
-
-        # Primary Gemini attempt
+        return await hedged_call(attempts)
+    except Exception as e:
+        print(f"CRITICAL LLM ERROR ({model_choice}): {e}")
+        return LLM_FAILURE_MESSAGE
+
+
+async def stream_llm_service(system_prompt: str, chat_history: List[dict], user_message: str, model_choice: str = "gemini") -> AsyncIterator[str]:
+    """Streaming counterpart of `call_llm_service`.
+
+    A backend is only abandoned for the next one in the chain if it fails before
+    emitting its first token; once text has reached the client a mid-stream error
+    is re-raised instead of splicing in a different model's answer. Streams are
+    not hedged, but they share the circuit breakers of the blocking path.
+    """
+    for provider, model_name in _backend_chain(model_choice):
+        breaker = get_breaker(f"{provider}:{model_name}")
+        if not breaker.allow():
+            continue
+        emitted = False
         try:
-            return _call_gemini_model(GEMINI_PRIMARY_MODEL, system_prompt, chat_history, user_message)
-        except Exception as gem_primary_exc:
-            print(f"WARNING: Gemini primary model failed ({gem_primary_exc})")
-            # If fallback model differs, try it once
-            if GEMINI_FALLBACK_MODEL and GEMINI_FALLBACK_MODEL != GEMINI_PRIMARY_MODEL:
-                try:
-                    return _call_gemini_model(GEMINI_FALLBACK_MODEL, system_prompt, chat_history, user_message)
-                except Exception as gem_fallback_exc:
-                    print(f"WARNING: Gemini fallback model also failed ({gem_fallback_exc})")
-
-            # Try Groq/llama3 as a last resort
-            if groq_client:
-                try:
-                    return _call_groq_model("llama-3.1-8b-instant", system_prompt, chat_history, user_message)
-                except Exception as groq_exc:
-                    print(f"WARNING: Groq fallback failed ({groq_exc})")
-
-            # If we reach here, all real backends failed
-            raise RuntimeError("All LLM backends failed for this request.")
+            async for token in _STREAMERS[provider](model_name, system_prompt, chat_history, user_message):
+                emitted = True
+                yield token
+        except (asyncio.CancelledError, GeneratorExit):
+            # Client went away mid-stream; that says nothing about the backend.
+            breaker.release_probe()
+            raise
+        except Exception as exc:
+            breaker.record_failure()
+            if emitted:
+                raise
+            print(f"WARNING: Streaming from {model_name} failed ({exc})")
+            continue
+        breaker.record_success()
+        return
+
+    print(f"CRITICAL LLM ERROR ({model_choice}): all streaming backends failed")
+    yield LLM_FAILURE_MESSAGE
+
+
+# ---------- Chat turn helpers ----------
+
+def find_struggle_match(db: Session, user_id: int, session_id: str, embedding: List[float],
+                        window: int = None) -> Optional[Tuple[int, float]]:
+    """(history id, cosine score) of the past prompt in this session closest to `embedding`.
+
+    Looks at the last `window` turns (STRUGGLE_WINDOW_TURNS by default, 0 for the
+    whole session). Only the embedding columns are loaded, stacked into a single
+    matrix and scored with one matrix-vector product.
+    """
+    window = STRUGGLE_WINDOW_TURNS if window is None else window
+    query = db.query(
+        UserHistory.id,
+        UserHistory.embedding_blob,
+        UserHistory.embedding_model,
+        UserHistory.embedding_dim,
+        UserHistory.embedding_vector,
+    )\
+        .filter(UserHistory.user_id == user_id, UserHistory.session_id == session_id)\
+        .order_by(desc(UserHistory.created_at))
+    if window > 0:
+        query = query.limit(window)
+
+    matrix, history_ids = stack_history_embeddings(query.all(), EMBEDDING_MODEL, len(embedding))
+    match = best_match(embedding, matrix)
+    if match is None:
+        return None
+    idx, score = match
+    return history_ids[idx], score
+
+
+def find_cross_session_struggle(db: Session, user_id: int, embedding: List[float]) -> Optional[Tuple[int, float]]:
+    """(history id, cosine score) of the closest past prompt from any session, if it is a repeat.
+
+    The vector index is append-only, so ids of deleted history rows can still
+    come back from it; only matches whose row still exists count.
+    """
+    matches = [
+        (history_id, score)
+        for history_id, score in vector_index.search(user_id, embedding, EMBEDDING_MODEL, STRUGGLE_CROSS_SESSION_CANDIDATES, db)
+        if score > STRUGGLE_SIMILARITY_THRESHOLD
+    ]
+    if not matches:
+        return None
+    existing = {r.id for r in db.query(UserHistory.id)
+                .filter(UserHistory.user_id == user_id, UserHistory.id.in_([history_id for history_id, _ in matches]))}
+    return next(((history_id, score) for history_id, score in matches if history_id in existing), None)
 
+
+async def _prepare_chat_turn(chat_request: UserHistoryCreate, user_id: int, db: Session) -> dict:
+    """Load context, run struggle detection and build the persona for one chat turn.
+    Shared by the blocking and the streaming message endpoints.
+    """
+    prompt = chat_request.prompt
+    session_id = chat_request.session_id or str(uuid.uuid4())
+
+    learning_path, skill_metrics = db.query(LearningPath, StudentSkillIndex.metrics_json)\
+        .select_from(User)\
+        .outerjoin(LearningPath, LearningPath.user_id == User.id)\
+        .outerjoin(StudentSkillIndex, StudentSkillIndex.user_id == User.id)\
+        .filter(User.id == user_id)\
+        .one_or_none() or (None, None)
+    teaching_style = (skill_metrics or {}).get("rl_action_name")
+
+    history_limit = 5
+    recent_history = db.query(UserHistory)\
+        .filter(UserHistory.user_id == user_id, UserHistory.session_id == session_id)\
+        .order_by(desc(UserHistory.created_at))\
+        .limit(history_limit)\
+        .all()
+
+    chat_history_list = [{"prompt": h.prompt, "response": h.response} for h in reversed(recent_history)]
+
+    current_embedding = await get_embedding(prompt)
+    struggle_detected = False
+
+    match = find_struggle_match(db, user_id, session_id, current_embedding) if current_embedding else None
+    if match:
+        history_id, similarity = match
+        print(f"DEBUG: Closest past msg {history_id} similarity: {similarity:.4f}")
+        if similarity > STRUGGLE_SIMILARITY_THRESHOLD:
+            print("DEBUG: Struggle Detected!")
+            struggle_detected = True
+    else:
+        print("DEBUG: No current embedding or history found.")
+
+    if current_embedding and not struggle_detected and STRUGGLE_CROSS_SESSION:
+        # Same question asked again in an earlier session, possibly weeks ago.
+        past = await asyncio.to_thread(find_cross_session_struggle, db, user_id, current_embedding)
+        if past:
+            print(f"DEBUG: Struggle Detected across sessions (msg {past[0]}, similarity {past[1]:.4f})")
+            struggle_detected = True
+
+    llm_input = prompt
+    if struggle_detected:
+        llm_input = (
+            f"{prompt}\n\n"
+            "[SYSTEM NOTE: The user has asked this exact question again. The previous answer failed. "
+            "Do NOT repeat it. Ask guiding questions instead to test understanding.]"
+        )
+
+    return {
+        "prompt": prompt,
+        "session_id": session_id,
+        "recent_history": recent_history,
+        "chat_history": chat_history_list,
+        "embedding": current_embedding,
+        "struggle_detected": struggle_detected,
+        "llm_input": llm_input,
+        "system_persona": get_system_persona(learning_path, struggle_override=struggle_detected,
+                                             teaching_style=teaching_style),
+    }
+
+
+def _session_title(turn: dict) -> Tuple[str, bool]:
+    """Title for the row being written and whether the session is new.
+
+    New sessions get a local placeholder right away; the real title is produced
+    by `title_worker` after the response has been returned. Later turns inherit
+    whatever title the session currently has.
+    """
+    if turn["recent_history"]:
+        return turn["recent_history"][0].title or "New Chat", False
+    return fallback_title(turn["prompt"]), True
+
+
+async def _generate_titles(prompts: List[str]) -> List[str]:
+    """Titles for a batch of opening prompts in a single LLM call."""
+    # Use Llama3 for cheap/fast titling if available, else Gemini
+    async def call(system_prompt: str, message: str) -> str:
+        if groq_client:
+            return await _call_groq_model("llama-3.1-8b-instant", system_prompt, [], message)
+        return await _call_gemini_model(GEMINI_PRIMARY_MODEL, system_prompt, [], message)
+
+    if len(prompts) == 1:
+        title_prompt = "Generate a very short, 3-5 word title for this chat based on the user's message. Do not use quotes."
+        return [(await call(title_prompt, prompts[0])).strip().replace('"', '')]
+
+    title_prompt = (
+        "For each numbered chat opening message, generate a very short, 3-5 word title. "
+        'Respond with ONLY a JSON object of the form {"titles": ["...", "..."]}, '
+        "with exactly one title per message, in the same order."
+    )
+    numbered = "\n".join(f"{i + 1}. {p}" for i, p in enumerate(prompts))
+    raw = await call(title_prompt, numbered)
+    titles = json.loads(raw[raw.index("{"):raw.rindex("}") + 1])["titles"]
+    return [str(t).strip().replace('"', '') for t in titles]
+
+
+title_worker.generate = _generate_titles
+
+
+_index_tasks = set()
+
+
+def _index_turn(user_id: int, history_id: int, embedding: List[float]):
+    db = SessionLocal()
+    try:
+        vector_index.add(user_id, history_id, embedding, EMBEDDING_MODEL, db)
     except Exception as e:
-        print(f"CRITICAL LLM ERROR ({model_choice}): {e}")
-        return "I'm having trouble thinking right now. Please try again later."
+        print(f"Vector index update failed: {e}")
+    finally:
+        db.close()
+
+
+def _persist_chat_turn(db: Session, user_id: int, turn: dict, title: str, ai_response: str, telemetry_data) -> UserHistory:
+    new_interaction = UserHistory(
+        user_id=user_id,
+        session_id=turn["session_id"],
+        title=title,
+        prompt=turn["prompt"],
+        response=ai_response,
+        telemetry_data=telemetry_data,
+        **embedding_columns(turn["embedding"], EMBEDDING_MODEL)
+    )
+
+    db.add(new_interaction)
+    db.flush()
+    # Same transaction as the insert: the session aggregate can never miss a turn
+    record_turn(db, new_interaction)
+    db.commit()
+    db.refresh(new_interaction)
+
+    # File I/O (and, on a user's first turn, a build from history): keep it off the event loop
+    task = asyncio.get_running_loop().create_task(
+        asyncio.to_thread(_index_turn, user_id, new_interaction.id, turn["embedding"])
+    )
+    _index_tasks.add(task)
+    task.add_done_callback(_index_tasks.discard)
+
+    profile_worker.enqueue(user_id, turn["session_id"])
+    quiz_cache.enqueue(user_id, turn["session_id"])
+
+    return new_interaction
+
+
+def _response_cache_eligible(turn: dict) -> bool:
+    # A struggle override must never get the answer that already failed, and
+    # follow-up turns depend on session history that the cache key does not see.
+    return not turn["struggle_detected"] and not turn["chat_history"] and bool(turn["embedding"])
+
+
+def _cached_response(turn: dict, model_choice: str) -> Optional[str]:
+    if not _response_cache_eligible(turn):
+        response_cache.record_bypass()
+        return None
+    return response_cache.lookup(turn["embedding"], turn["system_persona"], model_choice)
+
+
+def _sse_event(event: str, data: str) -> str:
+    return f"event: {event}\ndata: {data}\n\n"
 
 
 # ---------- FastAPI endpoints (unchanged behavior, cleaned)
@@ -177,93 +495,141 @@ async def chat_with_ai(
 ):
     try:
         user_id = current_user['user_id']
-        prompt = chat_request.prompt
-        session_id = chat_request.session_id or str(uuid.uuid4())
         selected_model = getattr(chat_request, 'model', 'gemini')
 
-        title = None if chat_request.session_id else "New Chat"
+        turn = await _prepare_chat_turn(chat_request, user_id, db)
 
-        learning_path = db.query(LearningPath).filter(LearningPath.user_id == user_id).first()
+        cacheable = _response_cache_eligible(turn)
+        ai_response = _cached_response(turn, selected_model)
+        if ai_response is None:
+            started = time.perf_counter()
+            ai_response = await call_llm_service(turn["system_persona"], turn["chat_history"], turn["llm_input"], selected_model)
+            if cacheable and ai_response != LLM_FAILURE_MESSAGE:
+                response_cache.store(turn["embedding"], turn["system_persona"], selected_model, ai_response,
+                                     llm_seconds=time.perf_counter() - started)
 
-        history_limit = 5
-        recent_history = db.query(UserHistory)\
-            .filter(UserHistory.user_id == user_id, UserHistory.session_id == session_id)\
-            .order_by(desc(UserHistory.created_at))\
-            .limit(history_limit)\
-            .all()
+        title, new_session = _session_title(turn)
 
-        chat_history_list = [{"prompt": h.prompt, "response": h.response} for h in reversed(recent_history)]
+        new_interaction = _persist_chat_turn(db, user_id, turn, title, ai_response, chat_request.telemetry_data)
+        if new_session:
+            title_worker.enqueue(user_id, turn["session_id"], turn["prompt"], title)
+        return new_interaction
 
-        current_embedding = get_embedding(prompt)
-        struggle_detected = False
+    except Exception as e:
+        print(f"Error in chat endpoint: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
-        if current_embedding and recent_history:
-            print(f"DEBUG: Checking {len(recent_history)} past messages for similarity...")
-            for past_msg in recent_history:
-                if past_msg.embedding_vector:
-                    similarity = calculate_cosine_similarity(current_embedding, past_msg.embedding_vector)
-                    print(f"DEBUG: Similarity with past msg: {similarity:.4f}")
-                    if similarity > 0.70:
-                        print("DEBUG: Struggle Detected!")
-                        struggle_detected = True
-                        break
-        else:
-            print("DEBUG: No current embedding or history found.")
-
-        llm_input = prompt
-        if struggle_detected:
-            llm_input = (
-                f"{prompt}\n\n"
-                "[SYSTEM NOTE: The user has asked this exact question again. The previous answer failed. "
-                "Do NOT repeat it. Ask guiding questions instead to test understanding.]"
-            )
-
-        system_persona = get_system_persona(learning_path, struggle_override=struggle_detected)
-
-        ai_response = call_llm_service(system_persona, chat_history_list, llm_input, selected_model)
-
-        # Auto-Title Generation using Groq (if new session)
-        if (not chat_request.session_id or not recent_history) and not title:
-             try:
-                # Use Llama3 for cheap/fast titling if available, else Gemini
-                title_model = "llama3" if groq_client else "gemini" 
-                title_prompt = "Generate a very short, 3-5 word title for this chat based on the user's message. Do not use quotes."
-                # Minimal call for title
-                if title_model == "llama3":
-                    generated_title = _call_groq_model("llama-3.1-8b-instant", title_prompt, [], prompt)
-                else:
-                    generated_title = _call_gemini_model(GEMINI_PRIMARY_MODEL, title_prompt, [], prompt)
-                
-                title = generated_title.strip().replace('"', '')
-                print(f"Generated Title: {title}")
-             except Exception as e:
-                print(f"Title generation failed: {e}")
-                title = "New Chat"
-
-        new_interaction = UserHistory(
-            user_id=user_id,
-            session_id=session_id,
-            title=title if title else "New Chat",
-            prompt=prompt,
-            response=ai_response,
-            embedding_vector=current_embedding if current_embedding else [],
-            telemetry_data=chat_request.telemetry_data
-        )
 
-        db.add(new_interaction)
-        db.commit()
-        db.refresh(new_interaction)
+@router.post("/message/stream")
+async def chat_with_ai_stream(
+    chat_request: UserHistoryCreate,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """Server-Sent Events variant of `/chat/message`.
+
+    Emits `token` events (`{"text": ...}`) while the model generates, then a single
+    `done` event carrying the persisted `UserHistoryResponse`. The history row and
+    profile update are only written once the stream has completed.
+    """
+    user_id = current_user['user_id']
+    selected_model = getattr(chat_request, 'model', 'gemini')
+
+    try:
+        turn = await _prepare_chat_turn(chat_request, user_id, db)
+    except Exception as e:
+        print(f"Error in chat stream endpoint: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
+    async def event_stream():
+        chunks = []
         try:
-            update_student_profile(user_id, db, session_id)
+            cacheable = _response_cache_eligible(turn)
+            cached = _cached_response(turn, selected_model)
+            if cached is not None:
+                chunks.append(cached)
+                yield _sse_event("token", json.dumps({"text": cached}))
+            else:
+                started = time.perf_counter()
+                async for token in stream_llm_service(turn["system_persona"], turn["chat_history"], turn["llm_input"], selected_model):
+                    chunks.append(token)
+                    yield _sse_event("token", json.dumps({"text": token}))
+                full_response = "".join(chunks)
+                if cacheable and full_response != LLM_FAILURE_MESSAGE:
+                    response_cache.store(turn["embedding"], turn["system_persona"], selected_model, full_response,
+                                         llm_seconds=time.perf_counter() - started)
+
+            title, new_session = _session_title(turn)
+
+            # The request-scoped session is torn down before the body is streamed,
+            # so persistence gets its own session.
+            stream_db = SessionLocal()
+            try:
+                new_interaction = _persist_chat_turn(stream_db, user_id, turn, title, "".join(chunks), chat_request.telemetry_data)
+                payload = UserHistoryResponse.model_validate(new_interaction).model_dump_json()
+            finally:
+                stream_db.close()
+
+            if new_session:
+                title_worker.enqueue(user_id, turn["session_id"], turn["prompt"], title)
+            yield _sse_event("done", payload)
         except Exception as e:
-            print(f"Adaptive Engine Update Failed: {e}")
+            print(f"Error in chat stream: {e}")
+            yield _sse_event("error", json.dumps({"detail": str(e)}))
 
-        return new_interaction
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
-    except Exception as e:
-        print(f"Error in chat endpoint: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/llm/status")
+async def get_llm_status(current_user: dict = Depends(get_current_user)):
+    """Circuit breaker state per LLM backend, hedging and title-batching counters for this worker."""
+    return {**get_resilience_status(), "titles": title_worker.get_stats()}
+
+
+@router.get("/cache/stats")
+async def get_response_cache_stats(current_user: dict = Depends(get_current_user)):
+    """Hit/miss counters for the semantic response cache and the embedding cache."""
+    return {**response_cache.get_stats(), "embeddings": embedding_cache.get_stats()}
+
+
+@router.get("/similar", response_model=List[SimilarPromptResponse])
+async def get_similar_prompts(
+    q: str,
+    k: int = Query(5, ge=1, le=50),
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """Past prompts of the current user (across all sessions) most similar to `q`."""
+    user_id = current_user['user_id']
+    embedding = await get_embedding(q)
+    if not embedding:
+        raise HTTPException(status_code=503, detail="Embedding service unavailable")
+
+    matches = await asyncio.to_thread(vector_index.search, user_id, embedding, EMBEDDING_MODEL, k, db)
+    if not matches:
+        return []
+
+    rows = db.query(UserHistory.id, UserHistory.session_id, UserHistory.title, UserHistory.prompt, UserHistory.created_at)\
+        .filter(UserHistory.user_id == user_id, UserHistory.id.in_([history_id for history_id, _ in matches]))\
+        .all()
+    rows_by_id = {r.id: r for r in rows}
+
+    # Ids of deleted history rows can linger in the index; they are dropped here.
+    return [
+        {
+            "history_id": history_id,
+            "session_id": rows_by_id[history_id].session_id,
+            "title": rows_by_id[history_id].title,
+            "prompt": rows_by_id[history_id].prompt,
+            "similarity": round(score, 4),
+            "created_at": rows_by_id[history_id].created_at,
+        }
+        for history_id, score in matches if history_id in rows_by_id
+    ]
 
 
 @router.get("/history", response_model=List[UserHistoryResponse])
@@ -297,6 +663,8 @@ async def delete_history_item(
         raise HTTPException(status_code=404, detail="History item not found")
 
     db.delete(history_item)
+    db.flush()
+    history_deleted(db, history_item.user_id, history_item.session_id, history_item.id)
     db.commit()
     return None
 
@@ -346,5 +714,7 @@ async def delete_session(
         UserHistory.session_id == session_id,
         UserHistory.user_id == current_user['user_id']
     ).delete()
+    forget_session(db, current_user['user_id'], session_id)
+    quiz_cache.forget(db, current_user['user_id'], session_id)
     db.commit()
     return None
@@ -1,15 +1,20 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from typing import Optional
 from sqlalchemy.orm import Session
-from sqlalchemy import desc
+import asyncio
 import json
+from datetime import datetime, timezone
 import os
 from groq import Groq # Import Groq
-from ..services.adaptive_engine import update_student_profile
+from ..services.profile_worker import profile_worker
+from ..services.question_bank import question_bank
+from ..services.quiz_cache import QUIZ_MODEL, build_quiz_prompt, context_key, quiz_cache, recent_turns, weak_topics
+from ..services.topic_mastery import record_score
 from ..deps import get_db
-from ..models import UserHistory, QuizScore
+from ..models import QuizScore
 from ..schemas import GeneratedQuiz, QuizScoreCreate, QuizScoreResponse, QuizGenerateRequest
 from ..deps import get_current_user
+from .chat import EMBEDDING_MODEL, get_embedding
 
 # Initialize Groq Client
 groq_client = Groq(api_key=os.getenv("GROQ_API_KEY"))
@@ -20,6 +25,36 @@ router = APIRouter(
 )
 
 
+async def _generate_quiz(prompt: str) -> dict:
+    """One Groq JSON-mode generation; raises on API or parse errors."""
+    # Generate Quiz using Groq (Llama 3); the client is synchronous, keep it off the event loop
+    chat_completion = await asyncio.to_thread(
+        groq_client.chat.completions.create,
+        messages=[
+            {
+                "role": "system",
+                "content": "You are a quiz generator. Output ONLY valid JSON."
+            },
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ],
+        model=QUIZ_MODEL,
+        temperature=0.7,
+        response_format={"type": "json_object"} # Force JSON mode
+    )
+
+    response_text = chat_completion.choices[0].message.content
+    return json.loads(response_text)
+
+
+quiz_cache.generate = _generate_quiz
+# Banked questions are matched against the chat prompts' stored embeddings, so use the same model
+question_bank.embed = get_embedding
+question_bank.embedding_model = EMBEDDING_MODEL
+
+
 @router.post("/generate", response_model=GeneratedQuiz)
 async def generate_quiz_from_context(
     request: Optional[QuizGenerateRequest] = None,
@@ -27,89 +62,37 @@ async def generate_quiz_from_context(
     db: Session = Depends(get_db)
 ):
     user_id = current_user['user_id']
-    
-    query = db.query(UserHistory).filter(UserHistory.user_id == user_id)
-    
-    if request and request.session_id:
-        query = query.filter(UserHistory.session_id == request.session_id)
-        
-    recent_history = query.order_by(desc(UserHistory.id))\
-        .limit(3)\
-        .all()
-    
+    session_id = request.session_id if request else None
+
+    recent_history = recent_turns(db, user_id, session_id)
     if not recent_history:
         raise HTTPException(status_code=400, detail="Not enough chat history to generate a quiz.")
-    
-
-    context_text = "\n".join([f"Student: {h.prompt}\nAI Tutor: {h.response}" for h in reversed(recent_history)])
 
     # Identify Weak Topics (< 70% score)
-    weak_scores = db.query(QuizScore).filter(
-        QuizScore.user_id == user_id,
-        (QuizScore.score / QuizScore.total_questions) < 0.7
-    ).all()
-    
-    weak_topics = list(set([ws.topic_tag for ws in weak_scores if ws.topic_tag]))
-    weak_topics_str = ", ".join(weak_topics) if weak_topics else "None"
+    topics = weak_topics(db, user_id)
 
-    prompt = f"""
-    Based strictly on the following conversation context, generate a Micro-Quiz to test the student's retention.
-    
-    PRIORITY FOCUS: The student has previously struggled with: {weak_topics_str}.
-    If relevant to the context below, prioritize questions on these topics to reinforce learning.
-    
-    CONTEXT:
-    {context_text}
-    
-    INSTRUCTIONS:
-    1. Create 5 Multiple Choice Questions (MCQs).
-    2. Include 1 distractor answer that addresses a common misconception.
-    3. Output must be valid JSON matching this structure:
-    {{
-        "topic": "Short Topic Name",
-        "questions": [
-            {{
-                "id": 1,
-                "question_text": "...",
-                "options": [
-                    {{"id": "A", "text": "..."}},
-                    {{"id": "B", "text": "..."}},
-                    {{"id": "C", "text": "..."}},
-                    {{"id": "D", "text": "..."}}
-                ],
-                "correct_option_id": "A",
-                "explanation": "Why A is correct..."
-            }}
-        ]
-    }}
-    """
-
-    try:
-        # Generate Quiz using Groq (Llama 3)
-        chat_completion = groq_client.chat.completions.create(
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a quiz generator. Output ONLY valid JSON."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            model="llama-3.1-8b-instant",
-            temperature=0.7,
-            response_format={"type": "json_object"} # Force JSON mode
-        )
-
-        response_text = chat_completion.choices[0].message.content
-        quiz_data = json.loads(response_text)
-        
-        return quiz_data
-
-    except Exception as e:
-        print(f"Quiz Gen Error: {e}")
-        raise HTTPException(status_code=500, detail="Failed to generate quiz")
+    # Common case: a quiz for exactly this context was generated after the last chat turn
+    quiz_data = quiz_cache.take(db, user_id, session_id, context_key(recent_history, topics))
+    if quiz_data is None:
+        # Then questions other students were already asked on this material (a DB read and a matrix product)
+        quiz_data = await asyncio.to_thread(question_bank.compose, db, recent_history, topics)
+    if quiz_data is None:
+        try:
+            quiz_data = await _generate_quiz(build_quiz_prompt(recent_history, topics))
+        except Exception as e:
+            print(f"Quiz Gen Error: {e}")
+            raise HTTPException(status_code=500, detail="Failed to generate quiz")
+        question_bank.add(quiz_data, QUIZ_MODEL)
+
+    # Have a different quiz ready if the student asks again
+    quiz_cache.enqueue(user_id, session_id)
+    return quiz_data
+
+
+@router.get("/cache/stats")
+async def get_quiz_cache_stats(current_user: dict = Depends(get_current_user)):
+    """Hit rate, staleness and background generation counters of the pre-generated quiz cache and the question bank."""
+    return {**quiz_cache.get_stats(), "question_bank": question_bank.get_stats()}
 
 
 @router.post("/submit", response_model=QuizScoreResponse)
@@ -128,9 +111,14 @@ async def submit_quiz_score(
     )
     
     db.add(new_score)
+    db.flush()
+    # Same transaction: the score and its topic rollup commit together
+    record_score(db, new_score, datetime.now(timezone.utc))
     db.commit()
     db.refresh(new_score)
-    update_student_profile(user_id=current_user['user_id'], db=db)
+    profile_worker.enqueue(current_user['user_id'])
+    # Weak topics may have changed, and with them the cached quiz's context
+    quiz_cache.enqueue(current_user['user_id'])
 
 
     return new_score
\ No newline at end of file
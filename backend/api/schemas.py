@@ -73,6 +73,14 @@ class UserHistoryResponse(UserHistoryBase):
     
     model_config = ConfigDict(from_attributes=True)
 
+class SimilarPromptResponse(BaseModel):
+    history_id: int
+    session_id: Optional[str] = None
+    title: Optional[str] = None
+    prompt: str
+    similarity: float
+    created_at: Optional[datetime] = None
+
 class DKTStateResponse(BaseModel):
     id: int
     skill_vector: Optional[List[float]] = None 
@@ -114,6 +122,18 @@ class QuizQuestion(BaseModel):
     correct_option_id: str
     explanation: str  # For feedback after they answer
 
+class MasteryRecomputeRequest(BaseModel):
+    user_ids: Optional[List[int]] = None
+    batch_size: int = Field(default=512, ge=1)
+
+class SSIRecomputeRequest(BaseModel):
+    user_ids: Optional[List[int]] = None
+    dry_run: bool = False
+    # Override WEIGHT_RETENTION / WEIGHT_INDEPENDENCE / WEIGHT_QUALITY for this run
+    weight_retention: Optional[float] = None
+    weight_independence: Optional[float] = None
+    weight_quality: Optional[float] = None
+
 class QuizGenerateRequest(BaseModel):
     session_id: Optional[str] = None
 
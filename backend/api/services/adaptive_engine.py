@@ -1,19 +1,54 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import desc
-from ..models import UserHistory, QuizScore, StudentSkillIndex, LearningPath, TelemetryLog
+from sqlalchemy import case, func, select
+from ..models import User, UserHistory, QuizScore, StudentSkillIndex, LearningPath, TelemetryLog, DKTState, SessionFeatureState, RLExperience, ProfileDecision
 from ..ml.engine import predict_dependency_probability
-from ..services.telemetry_service import aggregate_session_features
+from ..ml.rl_agent import dependency_level, rl_agent
+from ..services.telemetry_service import aggregate_session_features, features_from_totals
+from ..services.session_features import SUM_COLUMNS
 
-import torch
-from ..services.dkt_model import DKTModel
+import os
+import random
+import zlib
+import numpy as np
+from ..services.dkt_runtime import load_dkt_runtime, untrained_dkt_runtime
 
 NUM_SKILLS = 50
-model = DKTModel(num_skills=NUM_SKILLS)
+DKT_SEED = 0
+# Quiz attempts at or above this score ratio count as a correct DKT interaction
+DKT_CORRECT_THRESHOLD = 0.7
+
+# Serving weights exported by `python -m api.ml.train_dkt` (or `python -m api.ml.export_dkt`).
+# Serving runs on NumPy; torch is only needed to train and export.
+DKT_WEIGHTS_PATH = os.getenv(
+    "DKT_WEIGHTS_PATH",
+    os.path.join(os.path.dirname(__file__), "..", "ml", "dkt_weights.npz"),
+)
+
+if os.path.exists(DKT_WEIGHTS_PATH):
+    model = load_dkt_runtime(DKT_WEIGHTS_PATH)
+    print(f"DEBUG: Loaded DKT weights {model.version}")
+else:
+    # Fixed seed so every worker process builds identical weights; persisted hidden
+    # states are only meaningful for the weights that produced them.
+    model = untrained_dkt_runtime(NUM_SKILLS, seed=DKT_SEED)
+DKT_MODEL_VERSION = model.version
 
 WEIGHT_RETENTION = 0.4
 WEIGHT_INDEPENDENCE = 0.3
 WEIGHT_QUALITY = 0.3
 
+# Windows the SSI components are computed over, and the bucket / path cut-offs
+SSI_RECENT_QUIZZES = 5
+SSI_RECENT_CHATS = 10
+SSI_WEAK_THRESHOLD = 40
+SSI_STRONG_THRESHOLD = 70
+
+PATH_TYPES = ("Reinforcement", "Balanced", "Acceleration")
+# Share of profile updates that pick a uniformly random learning path instead of the
+# threshold one. Off by default; a small rate gives off-policy evaluation (api.ml.ope)
+# logged support for paths the thresholds would never choose.
+PATH_EXPLORATION_RATE = float(os.getenv("PATH_EXPLORATION_RATE", "0.0"))
+
 def get_student_mastery(interaction_history):
 
     if not interaction_history:
@@ -27,46 +62,152 @@ def get_student_mastery(interaction_history):
         input_id = skill + (NUM_SKILLS * correct)
         input_seq.append(input_id)
         
-    input_tensor = torch.tensor([input_seq])
-    
-    with torch.no_grad():
-        predictions, _ = model(input_tensor)
+    predictions, _ = model(np.array([input_seq]))
     
     final_state_predictions = predictions[0, -1, :]
     return final_state_predictions.tolist()
 
-def calculate_ssi(user_id: int, db: Session) -> float:
-    recent_quizzes = db.query(QuizScore)\
-        .filter(QuizScore.user_id == user_id)\
-        .order_by(desc(QuizScore.created_at))\
-        .limit(5)\
+def skill_id_for_topic(topic_tag: str) -> int:
+    """Stable topic -> DKT skill bucket (same in every process, unlike hash())."""
+    return zlib.crc32((topic_tag or "").strip().lower().encode("utf-8")) % NUM_SKILLS
+
+
+def quiz_interaction(quiz: QuizScore) -> dict:
+    ratio = quiz.score / quiz.total_questions if quiz.total_questions else 0.0
+    return {"skill_id": skill_id_for_topic(quiz.topic_tag), "correct": int(ratio >= DKT_CORRECT_THRESHOLD)}
+
+
+def _pack_hidden(hidden) -> bytes:
+    h, c = hidden
+    return np.concatenate([h.ravel(), c.ravel()]).astype("<f4").tobytes()
+
+
+def _unpack_hidden(blob: bytes):
+    h, c = np.frombuffer(blob, dtype="<f4").reshape(2, 1, 1, model.hidden_dim)
+    return h, c
+
+
+def update_dkt_state(user_id: int, db: Session) -> list:
+    """Advance the user's persisted DKT state by the quizzes taken since the last call.
+
+    Only the new interactions are run through the LSTM, starting from the stored
+    (h, c), so the cost is O(new events). If the stored state was produced by a
+    different model version it is rebuilt from the full history. The caller commits.
+    """
+    state = db.query(DKTState).filter_by(user_id=user_id).first()
+    if not state:
+        state = DKTState(user_id=user_id, last_quiz_id=0, interaction_count=0)
+        db.add(state)
+
+    if state.model_version != DKT_MODEL_VERSION or not state.hidden_state:
+        state.hidden_state = None
+        state.last_quiz_id = 0
+        state.interaction_count = 0
+        state.model_version = DKT_MODEL_VERSION
+
+    new_quizzes = db.query(QuizScore)\
+        .filter(QuizScore.user_id == user_id, QuizScore.id > (state.last_quiz_id or 0))\
+        .order_by(QuizScore.id)\
         .all()
-    
-    if not recent_quizzes:
+
+    if not new_quizzes:
+        if state.skill_vector is None:
+            state.skill_vector = [0.5] * NUM_SKILLS
+        return state.skill_vector
+
+    input_seq = [
+        i["skill_id"] + (NUM_SKILLS * i["correct"]) for i in map(quiz_interaction, new_quizzes)
+    ]
+    hidden = _unpack_hidden(state.hidden_state) if state.hidden_state else None
+
+    predictions, new_hidden = model(np.array([input_seq]), hidden)
+
+    state.skill_vector = predictions[0, -1, :].tolist()
+    state.hidden_state = _pack_hidden(new_hidden)
+    state.last_quiz_id = new_quizzes[-1].id
+    state.interaction_count = (state.interaction_count or 0) + len(new_quizzes)
+    return state.skill_vector
+
+
+def verify_dkt_state(user_id: int, db: Session, tolerance: float = 1e-4) -> dict:
+    """Compare the incrementally maintained mastery vector with a full recompute."""
+    state = db.query(DKTState).filter_by(user_id=user_id).first()
+    last_quiz_id = state.last_quiz_id if state and state.last_quiz_id else 0
+    quizzes = db.query(QuizScore)\
+        .filter(QuizScore.user_id == user_id, QuizScore.id <= last_quiz_id)\
+        .order_by(QuizScore.id)\
+        .all()
+    full = get_student_mastery([quiz_interaction(q) for q in quizzes])
+    incremental = state.skill_vector if state and state.skill_vector else [0.5] * NUM_SKILLS
+    max_diff = float(np.max(np.abs(np.asarray(full) - np.asarray(incremental))))
+    return {"consistent": max_diff <= tolerance, "max_abs_diff": max_diff, "interactions": len(quizzes)}
+
+
+def ssi_inputs_query(user_id: int):
+    """One statement returning every SSI input for a user as aggregates.
+
+    Quizzes and chats are LIMITed per-user CTEs reduced by scalar subqueries;
+    the latest telemetry session's features come from its SessionFeatureState
+    row, an O(1) read however long the session is. Only a single row of numbers
+    crosses the wire: no prompt/response text, telemetry JSON or embeddings.
+    """
+    quizzes = select(
+        case((QuizScore.total_questions > 0, QuizScore.score * 100.0 / QuizScore.total_questions)).label("pct")
+    ).where(QuizScore.user_id == user_id)\
+        .order_by(QuizScore.created_at.desc(), QuizScore.id.desc())\
+        .limit(SSI_RECENT_QUIZZES)\
+        .cte("recent_quizzes")
+
+    latest_session = select(TelemetryLog.session_id)\
+        .where(TelemetryLog.user_id == user_id)\
+        .order_by(TelemetryLog.created_at.desc(), TelemetryLog.id.desc())\
+        .limit(1)\
+        .scalar_subquery()
+    session_state = select(SessionFeatureState)\
+        .where(SessionFeatureState.user_id == user_id, SessionFeatureState.session_id == latest_session)\
+        .cte("session_state")
+
+    chats = select(func.length(UserHistory.prompt).label("prompt_length"))\
+        .where(UserHistory.user_id == user_id)\
+        .order_by(UserHistory.id.desc())\
+        .limit(SSI_RECENT_CHATS)\
+        .cte("recent_chats")
+
+    def scalar(expr, source, label):
+        return select(expr).select_from(source).scalar_subquery().label(label)
+
+    return select(
+        scalar(func.count(), quizzes, "quiz_count"),
+        scalar(func.avg(quizzes.c.pct), quizzes, "quiz_avg_pct"),
+        latest_session.label("latest_session"),
+        scalar(session_state.c.id, session_state, "session_state_id"),
+        scalar(session_state.c.window_rows, session_state, "telemetry_rows"),
+        *[scalar(session_state.c[column], session_state, column) for column in SUM_COLUMNS],
+        scalar(func.count(), chats, "chat_count"),
+        scalar(func.avg(chats.c.prompt_length), chats, "avg_prompt_length"),
+    )
+
+
+def calculate_ssi(user_id: int, db: Session) -> float:
+    inputs = db.execute(ssi_inputs_query(user_id)).one()
+
+    if not inputs.quiz_count:
         R = 50.0
     else:
-        scores = [(q.score / q.total_questions) * 100 for q in recent_quizzes if q.total_questions > 0]
-        R = sum(scores) / len(scores) if scores else 0.0
-        R = sum(scores) / len(scores) if scores else 0.0
-
-    latest_log = db.query(TelemetryLog).filter(TelemetryLog.user_id == user_id).order_by(desc(TelemetryLog.created_at)).first()
-    session_id = latest_log.session_id if latest_log else "unknown_session"
+        R = inputs.quiz_avg_pct if inputs.quiz_avg_pct is not None else 0.0
 
-    features = aggregate_session_features(user_id, session_id, db)
+    if inputs.latest_session is not None and inputs.session_state_id is None:
+        # Session predates the accumulator table and has not been rebuilt yet
+        features = aggregate_session_features(user_id, inputs.latest_session, db)
+    else:
+        features = features_from_totals(inputs.telemetry_rows or 0, *[getattr(inputs, column) or 0 for column in SUM_COLUMNS])
     dependency_prob = predict_dependency_probability(features)
     I = (1.0 - dependency_prob) * 100.0
 
-    last_chats = db.query(UserHistory)\
-        .filter(UserHistory.user_id == user_id)\
-        .order_by(desc(UserHistory.id))\
-        .limit(10)\
-        .all()
-    
-    if not last_chats:
+    if not inputs.chat_count:
         Q = 50.0
     else:
-        avg_len = sum([len(c.prompt) for c in last_chats]) / len(last_chats)
-        Q = max(0.0, min(100.0, (avg_len / 200) * 100))
+        Q = max(0.0, min(100.0, (inputs.avg_prompt_length / 200) * 100))
 
     ssi_value = (WEIGHT_RETENTION * R) + (WEIGHT_INDEPENDENCE * I) + (WEIGHT_QUALITY * Q)
     return {
@@ -74,6 +215,62 @@ def calculate_ssi(user_id: int, db: Session) -> float:
         "dependency_prob": dependency_prob
     }
 
+def threshold_path(ssi: float) -> str:
+    if ssi < SSI_WEAK_THRESHOLD:
+        return "Reinforcement"
+    if ssi > SSI_STRONG_THRESHOLD:
+        return "Acceleration"
+    return "Balanced"
+
+
+def choose_path(ssi: float) -> tuple:
+    """(path_type, probability this policy had of choosing it)."""
+    explore = PATH_EXPLORATION_RATE / len(PATH_TYPES)
+    path = threshold_path(ssi)
+    if PATH_EXPLORATION_RATE and random.random() < PATH_EXPLORATION_RATE:
+        chosen = random.choice(PATH_TYPES)
+    else:
+        chosen = path
+    return chosen, (1.0 - PATH_EXPLORATION_RATE + explore) if chosen == path else explore
+
+
+def _record_rl_step(db: Session, user_id: int, skill_record: StudentSkillIndex, previous_ssi, ssi: float, dependency_prob: float):
+    """Log the transition since the user's last profile update and pick the agent's next action.
+
+    The action is the teaching style the chat persona uses until the next update
+    (`get_system_persona` in the chat router). The decision (state, action,
+    propensity) is kept in `metrics_json` until the next update observes its
+    outcome; the reward is the change in SSI. Returns the logged transition as
+    indices, or None for a user's first update.
+    """
+    level = dependency_level(dependency_prob)
+    next_state = rl_agent.state_index(skill_record.bucket, level)
+    decision = skill_record.metrics_json or {}
+
+    transition = None
+    if decision.get("rl_action") is not None and previous_ssi is not None:
+        transition = (decision["rl_state"], decision["rl_action"], (ssi - previous_ssi) / 100.0, next_state)
+        db.add(RLExperience(
+            user_id=user_id,
+            state=transition[0],
+            action=transition[1],
+            propensity=decision.get("rl_propensity"),
+            reward=transition[2],
+            next_state=transition[3],
+        ))
+
+    action, propensity = rl_agent.choose_action_with_propensity(skill_record.bucket, level)
+    skill_record.metrics_json = {
+        "dependency_prob": round(float(dependency_prob), 4),
+        "dependency_level": level,
+        "rl_state": next_state,
+        "rl_action": rl_agent.actions.index(action),
+        "rl_action_name": action,
+        "rl_propensity": propensity,
+    }
+    return transition
+
+
 def update_student_profile(user_id: int, db: Session, current_session_id: str = None):
     
     # Calculate SSI using real data (Quiz Scores + Telemetry + Chat History)
@@ -81,34 +278,54 @@ def update_student_profile(user_id: int, db: Session, current_session_id: str =
     ssi = metrics['ssi']
     dependency_prob = metrics['dependency_prob']
     
+    # Both profile records in one lookup
+    skill_record, path_record = db.query(StudentSkillIndex, LearningPath)\
+        .select_from(User)\
+        .outerjoin(StudentSkillIndex, StudentSkillIndex.user_id == User.id)\
+        .outerjoin(LearningPath, LearningPath.user_id == User.id)\
+        .filter(User.id == user_id)\
+        .one_or_none() or (None, None)
+
     # Update Skill Index Record
-    skill_record = db.query(StudentSkillIndex).filter_by(user_id=user_id).first()
     if not skill_record:
         skill_record = StudentSkillIndex(user_id=user_id)
         db.add(skill_record)
     
+    previous_ssi = skill_record.index_value
     skill_record.index_value = ssi
     
     # Determine Strength Bucket
-    if ssi < 40:
+    if ssi < SSI_WEAK_THRESHOLD:
         skill_record.bucket = "Weak"
-    elif ssi > 70:
+    elif ssi > SSI_STRONG_THRESHOLD:
         skill_record.bucket = "Strong"
     else:
         skill_record.bucket = "Moderate"
 
     # Update Learning Path
-    path_record = db.query(LearningPath).filter_by(user_id=user_id).first()
     if not path_record:
         path_record = LearningPath(user_id=user_id)
         db.add(path_record)
 
-    if ssi < 40:
-        path_record.path_type = "Reinforcement" 
-    elif ssi > 70:
-        path_record.path_type = "Acceleration"
-    else:
-        path_record.path_type = "Balanced"
+    path_record.path_type, path_propensity = choose_path(ssi)
+
+    transition = _record_rl_step(db, user_id, skill_record, previous_ssi, ssi, dependency_prob)
+    decision = skill_record.metrics_json
+    db.add(ProfileDecision(
+        user_id=user_id,
+        ssi=ssi,
+        dependency_prob=float(dependency_prob),
+        path=PATH_TYPES.index(path_record.path_type),
+        path_propensity=path_propensity,
+        rl_state=decision["rl_state"],
+        rl_action=decision["rl_action"],
+        rl_propensity=decision["rl_propensity"],
+    ))
+
+    update_dkt_state(user_id, db)
 
     db.commit()
+    if transition:
+        # Online update; the offline trainer (api.ml.train_rl) refits from the full log
+        rl_agent.learn_indices(*transition)
     print(f"DEBUG: XGBoost Prob: {dependency_prob:.2f} | New SSI: {ssi:.2f} | Path: {path_record.path_type} | Bucket: {skill_record.bucket}")
\ No newline at end of file
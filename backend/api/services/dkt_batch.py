@@ -0,0 +1,158 @@
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from ..models import DKTState, QuizScore
+from .adaptive_engine import DKT_MODEL_VERSION, NUM_SKILLS, model, quiz_interaction
+
+DKT_BULK_BATCH_SIZE = int(os.getenv("DKT_BULK_BATCH_SIZE", "512"))
+# Users loaded from the database (and written back) per round trip.
+DKT_BULK_USER_CHUNK = int(os.getenv("DKT_BULK_USER_CHUNK", "5000"))
+
+
+def _user_chunks(db: Session, user_ids: Optional[List[int]], chunk_size: int,
+                 id_range: Optional[Tuple[int, int]] = None) -> Iterable[List[int]]:
+    """Sorted chunks of user ids: the given ones, or every user with quiz scores (within [start, end) if given)."""
+    if user_ids is not None:
+        ids = sorted(set(user_ids))
+        for start in range(0, len(ids), chunk_size):
+            yield ids[start:start + chunk_size]
+        return
+
+    last_user_id = id_range[0] - 1 if id_range else 0
+    while True:
+        query = db.query(QuizScore.user_id).filter(QuizScore.user_id > last_user_id)
+        if id_range:
+            query = query.filter(QuizScore.user_id < id_range[1])
+        rows = query\
+            .group_by(QuizScore.user_id)\
+            .order_by(QuizScore.user_id)\
+            .limit(chunk_size)\
+            .all()
+        if not rows:
+            return
+        ids = [r.user_id for r in rows]
+        yield ids
+        last_user_id = ids[-1]
+
+
+def _load_sequences(db: Session, user_ids: List[int]) -> dict:
+    """user_id -> (input ids, last quiz id) for every user in the chunk, in one query."""
+    rows = db.query(QuizScore.user_id, QuizScore.id, QuizScore.topic_tag, QuizScore.score, QuizScore.total_questions)\
+        .filter(QuizScore.user_id.in_(user_ids))\
+        .order_by(QuizScore.user_id, QuizScore.id)\
+        .all()
+    sequences = {}
+    for user_id, group in groupby(rows, key=lambda r: r.user_id):
+        group = list(group)
+        seq = [i["skill_id"] + NUM_SKILLS * i["correct"] for i in map(quiz_interaction, group)]
+        sequences[user_id] = (seq, group[-1].id)
+    return sequences
+
+
+def _run_batch(batch: list) -> dict:
+    lengths = np.array([len(seq) for _, (seq, _) in batch])
+    padded = np.zeros((len(batch), int(lengths.max())), dtype=np.int64)
+    for row, (_, (seq, _)) in enumerate(batch):
+        padded[row, :len(seq)] = seq
+
+    mastery, (h_n, c_n) = model.forward_last(padded, lengths)
+    hidden = np.concatenate([h_n[0], c_n[0]], axis=1).astype("<f4")
+    results = {}
+    for row, (user_id, (seq, last_quiz_id)) in enumerate(batch):
+        results[user_id] = {
+            "skill_vector": mastery[row].tolist(),
+            "hidden_state": hidden[row].tobytes(),
+            "last_quiz_id": last_quiz_id,
+            "interaction_count": len(seq),
+            "model_version": DKT_MODEL_VERSION,
+        }
+    return results
+
+
+def _run_batches(sequences: dict, batch_size: int, executor: ThreadPoolExecutor) -> dict:
+    """Run all sequences through the model, batching users of similar length together.
+
+    Batches run concurrently; NumPy releases the GIL inside the matrix products.
+    """
+    by_length = sorted(sequences.items(), key=lambda item: len(item[1][0]))
+    batches = [by_length[start:start + batch_size] for start in range(0, len(by_length), batch_size)]
+    results = {}
+    for batch_results in executor.map(_run_batch, batches):
+        results.update(batch_results)
+    return results
+
+
+def _write_states(db: Session, results: dict):
+    existing = dict(
+        db.query(DKTState.user_id, DKTState.id).filter(DKTState.user_id.in_(list(results))).all()
+    )
+    updates = [{"id": existing[uid], **values} for uid, values in results.items() if uid in existing]
+    inserts = [{"user_id": uid, **values} for uid, values in results.items() if uid not in existing]
+    if updates:
+        db.bulk_update_mappings(DKTState, updates)
+    if inserts:
+        db.bulk_insert_mappings(DKTState, inserts)
+    db.commit()
+
+
+def recompute_mastery_bulk(db: Session, user_ids: Optional[List[int]] = None,
+                           batch_size: int = DKT_BULK_BATCH_SIZE, chunk_size: int = DKT_BULK_USER_CHUNK,
+                           num_threads: Optional[int] = None) -> dict:
+    """Full DKT mastery recompute for many users (all users with quizzes by default).
+
+    Users are processed in chunks: one query loads the chunk's interaction
+    sequences, batches of similar-length sequences run through the NumPy LSTM on
+    all cores, and the resulting DKTState rows (mastery vector and hidden state,
+    so incremental updates can continue from them) are written in bulk.
+    """
+    executor = ThreadPoolExecutor(max_workers=num_threads or os.cpu_count() or 1, thread_name_prefix="dkt-bulk")
+    started = time.perf_counter()
+    users = 0
+    interactions = 0
+    try:
+        for chunk in _user_chunks(db, user_ids, chunk_size):
+            sequences = _load_sequences(db, chunk)
+            if not sequences:
+                continue
+            results = _run_batches(sequences, batch_size, executor)
+            _write_states(db, results)
+            users += len(results)
+            interactions += sum(r["interaction_count"] for r in results.values())
+            elapsed = time.perf_counter() - started
+            print(f"DKT bulk: {users} users, {interactions} interactions, {users / elapsed:.1f} users/s")
+    finally:
+        executor.shutdown()
+
+    elapsed = time.perf_counter() - started
+    return {
+        "users": users,
+        "interactions": interactions,
+        "seconds": round(elapsed, 3),
+        "users_per_second": round(users / elapsed, 1) if elapsed > 0 else 0.0,
+        "model_version": DKT_MODEL_VERSION,
+    }
+
+
+if __name__ == "__main__":
+    from ..database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Recompute DKT mastery for many users in bulk.")
+    parser.add_argument("--user-ids", type=int, nargs="*", help="Only these users (default: everyone with quiz history)")
+    parser.add_argument("--batch-size", type=int, default=DKT_BULK_BATCH_SIZE)
+    parser.add_argument("--chunk-size", type=int, default=DKT_BULK_USER_CHUNK)
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        report = recompute_mastery_bulk(db, args.user_ids, args.batch_size, args.chunk_size, args.threads)
+        print(report)
+    finally:
+        db.close()
@@ -1,5 +1,8 @@
+import os
+import numpy as np
 import torch
 import torch.nn as nn
+from torch.nn.utils.rnn import pack_padded_sequence
 
 class DKTModel(nn.Module):
     def __init__(self, num_skills, hidden_dim=100, input_dim=100):
@@ -23,4 +26,59 @@ class DKTModel(nn.Module):
         logits = self.out(lstm_out)
         preds = self.sigmoid(logits)
         
-        return preds, new_hidden
\ No newline at end of file
+        return preds, new_hidden
+
+    def forward_last(self, padded_seqs, lengths):
+        """Final-step predictions and (h, c) for a batch of variable-length sequences.
+
+        `padded_seqs` is (batch, max_len) and `lengths` the true length of each row.
+        Sequences are packed so padding is never run through the LSTM; for a
+        single-layer LSTM the output at the last valid step is h_n, so the
+        padded output does not need to be unpacked.
+        """
+        embed = self.embedding(padded_seqs)
+        packed = pack_padded_sequence(embed, lengths, batch_first=True, enforce_sorted=False)
+        _, (h_n, c_n) = self.lstm(packed)
+        preds = self.sigmoid(self.out(h_n[-1]))
+        return preds, (h_n, c_n)
+
+
+def save_dkt_weights(model: DKTModel, path: str, version: str, metrics: dict = None):
+    """Write a serving checkpoint: weights plus the shape and version needed to load them."""
+    payload = {
+        "version": version,
+        "num_skills": model.num_skills,
+        "hidden_dim": model.hidden_dim,
+        "input_dim": model.embedding.embedding_dim,
+        "state_dict": model.state_dict(),
+        "metrics": metrics or {},
+    }
+    tmp = path + ".tmp"
+    torch.save(payload, tmp)
+    os.replace(tmp, path)
+
+
+def load_dkt_weights(path: str):
+    """Returns (model, version) from a file written by `save_dkt_weights`."""
+    payload = torch.load(path, map_location="cpu")
+    model = DKTModel(payload["num_skills"], hidden_dim=payload["hidden_dim"], input_dim=payload["input_dim"])
+    model.load_state_dict(payload["state_dict"])
+    model.eval()
+    return model, payload["version"]
+
+
+def export_numpy_weights(model: DKTModel, path: str, version: str):
+    """Write the torch-free serving artifact read by `dkt_runtime.load_dkt_runtime`."""
+    params = {name: tensor.detach().cpu().numpy() for name, tensor in model.state_dict().items()}
+    arrays = {
+        "embedding": params["embedding.weight"],
+        "w_ih": params["lstm.weight_ih_l0"],
+        "w_hh": params["lstm.weight_hh_l0"],
+        "b_ih": params["lstm.bias_ih_l0"],
+        "b_hh": params["lstm.bias_hh_l0"],
+        "out_w": params["out.weight"],
+        "out_b": params["out.bias"],
+    }
+    tmp = path + ".tmp.npz"
+    np.savez(tmp, version=np.array(version), **arrays)
+    os.replace(tmp, path)
@@ -0,0 +1,107 @@
+import numpy as np
+
+# Parameter names inside the exported .npz (see dkt_model.export_numpy_weights).
+DKT_ARRAYS = ("embedding", "w_ih", "w_hh", "b_ih", "b_hh", "out_w", "out_b")
+
+
+def _sigmoid(x: np.ndarray) -> np.ndarray:
+    return 0.5 * (np.tanh(0.5 * x) + 1.0)
+
+
+class NumpyDKT:
+    """Torch-free DKT forward pass: embedding -> single-layer LSTM -> linear -> sigmoid.
+
+    Mirrors `DKTModel.forward` (same PyTorch gate order i, f, g, o and the same
+    hidden-state shapes (1, batch, hidden)), so states and mastery vectors are
+    interchangeable with the torch model within float32 tolerance.
+    """
+
+    def __init__(self, arrays: dict, version: str):
+        self.embedding = arrays["embedding"].astype(np.float32)
+        self.w_ih_t = np.ascontiguousarray(arrays["w_ih"].T, dtype=np.float32)
+        self.w_hh_t = np.ascontiguousarray(arrays["w_hh"].T, dtype=np.float32)
+        self.bias = (arrays["b_ih"] + arrays["b_hh"]).astype(np.float32)
+        self.out_w_t = np.ascontiguousarray(arrays["out_w"].T, dtype=np.float32)
+        self.out_b = arrays["out_b"].astype(np.float32)
+        self.num_skills = self.out_b.shape[0]
+        self.hidden_dim = self.w_hh_t.shape[0]
+        self.version = version
+        # Input projection per token id, computed once: embedding @ W_ih^T + biases.
+        self._token_gates = self.embedding @ self.w_ih_t + self.bias
+
+    def _step(self, gates_x: np.ndarray, h: np.ndarray, c: np.ndarray):
+        gates = gates_x + h @ self.w_hh_t
+        H = self.hidden_dim
+        i = _sigmoid(gates[:, :H])
+        f = _sigmoid(gates[:, H:2 * H])
+        g = np.tanh(gates[:, 2 * H:3 * H])
+        o = _sigmoid(gates[:, 3 * H:])
+        c = f * c + i * g
+        h = o * np.tanh(c)
+        return h, c
+
+    def _initial(self, batch: int, hidden_state):
+        if hidden_state is None:
+            zeros = np.zeros((batch, self.hidden_dim), dtype=np.float32)
+            return zeros, zeros.copy()
+        h, c = hidden_state
+        return np.asarray(h, dtype=np.float32)[0], np.asarray(c, dtype=np.float32)[0]
+
+    def forward(self, input_seq, hidden_state=None):
+        """(batch, steps) token ids -> (batch, steps, num_skills) predictions and new (h, c)."""
+        input_seq = np.asarray(input_seq)
+        batch, steps = input_seq.shape
+        gates_x = self._token_gates[input_seq]
+        h, c = self._initial(batch, hidden_state)
+        outputs = np.empty((batch, steps, self.hidden_dim), dtype=np.float32)
+        for t in range(steps):
+            h, c = self._step(gates_x[:, t], h, c)
+            outputs[:, t] = h
+        preds = _sigmoid(outputs @ self.out_w_t + self.out_b)
+        return preds, (h[None], c[None])
+
+    def forward_last(self, padded_seqs, lengths):
+        """Final-step predictions and (h, c) for variable-length, right-padded sequences.
+
+        Rows whose sequence has ended keep their state, so padding never affects
+        the result (the NumPy equivalent of a packed sequence).
+        """
+        padded_seqs = np.asarray(padded_seqs)
+        lengths = np.asarray(lengths)
+        batch, steps = padded_seqs.shape
+        gates_x = self._token_gates[padded_seqs]
+        h, c = self._initial(batch, None)
+        for t in range(steps):
+            active = (t < lengths)[:, None]
+            h_new, c_new = self._step(gates_x[:, t], h, c)
+            h = np.where(active, h_new, h)
+            c = np.where(active, c_new, c)
+        preds = _sigmoid(h @ self.out_w_t + self.out_b)
+        return preds, (h[None], c[None])
+
+    __call__ = forward
+
+
+def load_dkt_runtime(path: str) -> NumpyDKT:
+    with np.load(path) as data:
+        arrays = {name: data[name] for name in DKT_ARRAYS}
+        version = str(data["version"])
+    return NumpyDKT(arrays, version)
+
+
+def untrained_dkt_runtime(num_skills: int, seed: int = 0, hidden_dim: int = 100, input_dim: int = 100) -> NumpyDKT:
+    """Seeded random weights with PyTorch's default init ranges, for when no trained artifact exists."""
+    rng = np.random.default_rng(seed)
+    k_lstm = 1.0 / np.sqrt(hidden_dim)
+    k_out = 1.0 / np.sqrt(hidden_dim)
+    arrays = {
+        "embedding": rng.standard_normal((2 * num_skills, input_dim)),
+        "w_ih": rng.uniform(-k_lstm, k_lstm, (4 * hidden_dim, input_dim)),
+        "w_hh": rng.uniform(-k_lstm, k_lstm, (4 * hidden_dim, hidden_dim)),
+        "b_ih": rng.uniform(-k_lstm, k_lstm, 4 * hidden_dim),
+        "b_hh": rng.uniform(-k_lstm, k_lstm, 4 * hidden_dim),
+        "out_w": rng.uniform(-k_out, k_out, (num_skills, hidden_dim)),
+        "out_b": rng.uniform(-k_out, k_out, num_skills),
+    }
+    # Distinct from the old torch-seeded version so states built from those weights are rebuilt.
+    return NumpyDKT(arrays, f"untrained-np-seed{seed}")
@@ -0,0 +1,149 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+
+# On-disk tier. SQLite in WAL mode lets every worker process on the host share it.
+# Anchored to the package, not to whatever directory the process was started from.
+EMBEDDING_CACHE_PATH = os.getenv(
+    "EMBEDDING_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "embedding_cache.db"),
+)
+EMBEDDING_CACHE_MEMORY_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MEMORY_ENTRIES", "4096"))
+
+
+def normalize_text(text: str) -> str:
+    """Canonical form used for cache keys: NFC unicode with collapsed whitespace."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def cache_key(model_name: str, text: str) -> str:
+    return hashlib.sha256(f"{model_name}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Two-tier, content-addressed embedding cache.
+
+    Tier 1 is an in-process LRU of float32 arrays, tier 2 a SQLite table of packed
+    float32 blobs keyed by sha256(model name, normalised text). A disk hit is
+    promoted into the LRU. Disk errors are logged and treated as misses so the
+    cache can never take the embedding path down.
+
+    The tiers have separate locks: memory lookups never wait on disk I/O, so
+    async callers can use `get_memory` / `remember` inline and run `get_disk` /
+    `store_disk` in a thread. `get` and `put` do both, for synchronous callers.
+    """
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH, memory_entries: int = EMBEDDING_CACHE_MEMORY_ENTRIES):
+        self.path = path
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()       # memory tier and stats
+        self._disk_lock = threading.Lock()  # SQLite connection
+        self._conn = None
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "disk_errors": 0}
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " key TEXT PRIMARY KEY,"
+                " model TEXT NOT NULL,"
+                " dim INTEGER NOT NULL,"
+                " vector BLOB NOT NULL)"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _remember(self, key: str, vector: np.ndarray):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get_memory(self, model_name: str, text: str) -> Optional[List[float]]:
+        """Tier 1 only; never touches disk."""
+        key = cache_key(model_name, text)
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is None:
+                return None
+            self._memory.move_to_end(key)
+            self.stats["memory_hits"] += 1
+            return vector.tolist()
+
+    def get_disk(self, model_name: str, text: str) -> Optional[List[float]]:
+        """Tier 2 lookup (blocking); a hit is promoted into memory."""
+        key = cache_key(model_name, text)
+        try:
+            with self._disk_lock:
+                row = self._connection().execute(
+                    "SELECT dim, vector FROM embeddings WHERE key = ?", (key,)
+                ).fetchone()
+        except sqlite3.Error as e:
+            print(f"WARNING: Embedding cache read failed: {e}")
+            row = None
+            with self._lock:
+                self.stats["disk_errors"] += 1
+
+        with self._lock:
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            dim, blob = row
+            vector = np.frombuffer(blob, dtype=np.float32, count=dim)
+            self._remember(key, vector)
+            self.stats["disk_hits"] += 1
+            return vector.tolist()
+
+    def get(self, model_name: str, text: str) -> Optional[List[float]]:
+        cached = self.get_memory(model_name, text)
+        return cached if cached is not None else self.get_disk(model_name, text)
+
+    def remember(self, model_name: str, text: str, embedding: List[float]):
+        """Tier 1 only; never touches disk."""
+        if not embedding:
+            return
+        with self._lock:
+            self._remember(cache_key(model_name, text), np.asarray(embedding, dtype=np.float32))
+
+    def store_disk(self, model_name: str, text: str, embedding: List[float]):
+        """Tier 2 write (blocking)."""
+        if not embedding:
+            return
+        vector = np.asarray(embedding, dtype=np.float32)
+        try:
+            with self._disk_lock:
+                conn = self._connection()
+                conn.execute(
+                    "INSERT OR REPLACE INTO embeddings (key, model, dim, vector) VALUES (?, ?, ?, ?)",
+                    (cache_key(model_name, text), model_name, int(vector.shape[0]), vector.tobytes()),
+                )
+                conn.commit()
+            stat = "stores"
+        except sqlite3.Error as e:
+            print(f"WARNING: Embedding cache write failed: {e}")
+            stat = "disk_errors"
+        with self._lock:
+            self.stats[stat] += 1
+
+    def put(self, model_name: str, text: str, embedding: List[float]):
+        self.remember(model_name, text, embedding)
+        self.store_disk(model_name, text, embedding)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {**self.stats, "memory_entries": len(self._memory)}
+
+
+# Singleton instance
+embedding_cache = EmbeddingCache()
@@ -1,5 +1,8 @@
 from sentence_transformers import SentenceTransformer
 import os
+from .embedding_cache import embedding_cache
+
+LOCAL_EMBEDDING_MODEL = 'all-MiniLM-L6-v2'
 
 # Global variable to hold the model in memory
 _embedding_model = None
@@ -9,7 +12,7 @@ def get_embedding_model():
     if _embedding_model is None:
         print("DEBUG: Loading Local Embedding Model (all-MiniLM-L6-v2)...")
         # This will download the model the first time (~80MB)
-        _embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+        _embedding_model = SentenceTransformer(LOCAL_EMBEDDING_MODEL)
         print("DEBUG: Local Embedding Model Loaded.")
     return _embedding_model
 
@@ -22,9 +25,14 @@ def get_embedding(text: str):
         if not text or not text.strip():
             return []
             
+        cached = embedding_cache.get(LOCAL_EMBEDDING_MODEL, text)
+        if cached is not None:
+            return cached
+
         model = get_embedding_model()
         # encode returns a numpy array, convert to list for JSON serialization
         embedding = model.encode(text).tolist()
+        embedding_cache.put(LOCAL_EMBEDDING_MODEL, text, embedding)
         return embedding
     except Exception as e:
         print(f"Local Embedding Error: {e}")
@@ -0,0 +1,76 @@
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from ..models import UserHistory
+
+# On-disk layout of UserHistory.embedding_blob: little-endian float32, no header.
+# Model and dimension live in their own columns.
+EMBEDDING_DTYPE = np.dtype("<f4")
+
+
+def pack_embedding(embedding) -> Optional[bytes]:
+    if embedding is None or len(embedding) == 0:
+        return None
+    return np.asarray(embedding, dtype=EMBEDDING_DTYPE).tobytes()
+
+
+def unpack_embedding(blob, dim: Optional[int] = None) -> Optional[np.ndarray]:
+    """Zero-copy view over a packed embedding (read-only, backed by `blob`)."""
+    if not blob:
+        return None
+    count = dim if dim is not None else -1
+    return np.frombuffer(blob, dtype=EMBEDDING_DTYPE, count=count)
+
+
+def history_embedding(row: UserHistory, model_name: Optional[str] = None) -> Optional[np.ndarray]:
+    """Embedding of a UserHistory row, or None if absent or from a different model.
+
+    Rows written before the binary column existed (and not yet backfilled by
+    `python -m api.migrations`) are read from the legacy JSON column.
+    """
+    if row.embedding_blob is not None:
+        if model_name and row.embedding_model and row.embedding_model != model_name:
+            return None
+        return unpack_embedding(row.embedding_blob, row.embedding_dim)
+    if row.embedding_vector:
+        return np.asarray(row.embedding_vector, dtype=EMBEDDING_DTYPE)
+    return None
+
+
+def embedding_columns(embedding: List[float], model_name: str) -> dict:
+    """Column values for storing `embedding` on a new UserHistory row."""
+    blob = pack_embedding(embedding)
+    return {
+        "embedding_blob": blob,
+        "embedding_model": model_name if blob else None,
+        "embedding_dim": len(embedding) if blob else None,
+    }
+
+
+def stack_history_embeddings(rows, model_name: str, dim: int) -> Tuple[np.ndarray, List[int]]:
+    """Stack the embeddings of `rows` into one (n, dim) float32 matrix.
+
+    Rows without an embedding, from another model or of another dimension are
+    skipped; the ids of the rows that made it in are returned alongside. Packed
+    rows are joined into a single buffer so building the matrix is one copy.
+    """
+    packed_ids, packed_blobs, legacy_ids, legacy_vectors = [], [], [], []
+    for row in rows:
+        if row.embedding_blob is not None:
+            if row.embedding_dim == dim and (not row.embedding_model or row.embedding_model == model_name):
+                packed_ids.append(row.id)
+                packed_blobs.append(row.embedding_blob)
+        elif row.embedding_vector and len(row.embedding_vector) == dim:
+            legacy_ids.append(row.id)
+            legacy_vectors.append(row.embedding_vector)
+
+    parts = []
+    if packed_blobs:
+        parts.append(np.frombuffer(b"".join(packed_blobs), dtype=EMBEDDING_DTYPE).reshape(-1, dim))
+    if legacy_vectors:
+        parts.append(np.asarray(legacy_vectors, dtype=EMBEDDING_DTYPE))
+    if not parts:
+        return np.empty((0, dim), dtype=EMBEDDING_DTYPE), []
+    matrix = parts[0] if len(parts) == 1 else np.vstack(parts)
+    return matrix, packed_ids + legacy_ids
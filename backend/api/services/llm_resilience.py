@@ -0,0 +1,214 @@
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+# Hedging: if the backend in flight has not answered after its hedge delay, the
+# next backend in the chain is started as well and the first success wins.
+# The delay is the LLM_HEDGE_PERCENTILE of that backend's recent latencies, so
+# only its slowest ~5% of requests are hedged. A median-level delay would double
+# load on the fallback for half of all requests.
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+LLM_HEDGE_LATENCY_WINDOW = int(os.getenv("LLM_HEDGE_LATENCY_WINDOW", "200"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+# Used until a backend has LLM_HEDGE_MIN_SAMPLES latencies: a tail-level constant,
+# well beyond a typical full chat answer, so cold-start hedges only catch stragglers.
+LLM_HEDGE_COLD_DELAY_SECONDS = float(os.getenv("LLM_HEDGE_COLD_DELAY_SECONDS", "12.0"))
+# Setting this pins the delay for every backend and disables the adaptive delay.
+LLM_HEDGE_DELAY_SECONDS = float(os.getenv("LLM_HEDGE_DELAY_SECONDS")) if os.getenv("LLM_HEDGE_DELAY_SECONDS") else None
+
+# Circuit breaker: a backend that fails this many times in a row is skipped
+# for the cool-down period, after which a single probe request is let through.
+LLM_BREAKER_FAILURE_THRESHOLD = int(os.getenv("LLM_BREAKER_FAILURE_THRESHOLD", "3"))
+LLM_BREAKER_COOLDOWN_SECONDS = float(os.getenv("LLM_BREAKER_COOLDOWN_SECONDS", "30.0"))
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = LLM_BREAKER_FAILURE_THRESHOLD,
+                 cooldown_seconds: float = LLM_BREAKER_COOLDOWN_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.total_successes = 0
+        self.total_failures = 0
+        self.total_skipped = 0
+
+    def allow(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.cooldown_seconds:
+            # Cool-down elapsed: let exactly one probe through.
+            self.state = self.HALF_OPEN
+            return True
+        self.total_skipped += 1
+        return False
+
+    def release_probe(self):
+        """Return an unfinished half-open probe (e.g. a cancelled request) without judging the backend."""
+        if self.state == self.HALF_OPEN:
+            self.state = self.OPEN
+
+    def record_success(self):
+        self.total_successes += 1
+        self.consecutive_failures = 0
+        self.state = self.CLOSED
+        self.opened_at = None
+
+    def record_failure(self):
+        self.total_failures += 1
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                print(f"WARNING: Circuit breaker opened for {self.name}")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def snapshot(self) -> dict:
+        cooldown_remaining = 0.0
+        if self.state == self.OPEN:
+            cooldown_remaining = max(0.0, self.cooldown_seconds - (time.monotonic() - self.opened_at))
+        return {
+            "backend": self.name,
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "cooldown_remaining_s": round(cooldown_remaining, 2),
+            "total_successes": self.total_successes,
+            "total_failures": self.total_failures,
+            "total_skipped": self.total_skipped,
+        }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_latencies: Dict[str, deque] = {}
+
+hedge_stats = {
+    "requests": 0,
+    "hedges_launched": 0,
+    "hedge_wins": 0,
+    "fallbacks_after_error": 0,
+    "all_backends_failed": 0,
+}
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    if name not in _breakers:
+        _breakers[name] = CircuitBreaker(name)
+    return _breakers[name]
+
+
+def record_latency(name: str, seconds: float):
+    if name not in _latencies:
+        _latencies[name] = deque(maxlen=LLM_HEDGE_LATENCY_WINDOW)
+    _latencies[name].append(seconds)
+
+
+def hedge_delay_for(name: str) -> float:
+    """Seconds to wait on backend `name` before hedging: a high percentile of its recent latencies."""
+    if LLM_HEDGE_DELAY_SECONDS is not None:
+        return LLM_HEDGE_DELAY_SECONDS
+    samples = _latencies.get(name)
+    if not samples or len(samples) < LLM_HEDGE_MIN_SAMPLES:
+        return LLM_HEDGE_COLD_DELAY_SECONDS
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * LLM_HEDGE_PERCENTILE / 100))]
+
+
+def get_resilience_status() -> dict:
+    return {
+        "hedge_delay_s": {name: round(hedge_delay_for(name), 3) for name in _breakers},
+        "hedging": dict(hedge_stats),
+        "breakers": [b.snapshot() for b in _breakers.values()],
+    }
+
+
+async def _guarded(name: str, factory: Callable[[], Awaitable[str]]) -> str:
+    breaker = get_breaker(name)
+    started = time.monotonic()
+    try:
+        result = await factory()
+    except asyncio.CancelledError:
+        # Losing a hedge race is not a backend failure. The elapsed time is a lower
+        # bound on its latency; dropping it would bias the percentile low.
+        record_latency(name, time.monotonic() - started)
+        breaker.release_probe()
+        raise
+    except Exception as exc:
+        breaker.record_failure()
+        print(f"WARNING: LLM backend {name} failed ({exc})")
+        raise
+    breaker.record_success()
+    record_latency(name, time.monotonic() - started)
+    return result
+
+
+async def hedged_call(attempts: List[Tuple[str, Callable[[], Awaitable[str]]]],
+                      hedge_delay: Optional[float] = None) -> str:
+    """Run `attempts` (ordered (backend_name, coroutine factory) pairs) with hedging.
+
+    The first allowed backend starts immediately. The next one is started when the
+    previous errors out or has been silent for `hedge_delay` seconds (by default
+    `hedge_delay_for` the backend started last); the first
+    successful result is returned and the remaining tasks are cancelled. Backends
+    whose circuit breaker is open are skipped. Raises RuntimeError if none succeed.
+    """
+    hedge_stats["requests"] += 1
+    queue = list(attempts)
+    pending: Dict[asyncio.Task, str] = {}
+    hedged: List[str] = []
+
+    def launch() -> Optional[str]:
+        # Breakers are consulted lazily so a half-open probe is only granted to a
+        # backend that is actually started.
+        while queue:
+            name, factory = queue.pop(0)
+            if get_breaker(name).allow():
+                pending[asyncio.create_task(_guarded(name, factory))] = name
+                return name
+        return None
+
+    latest = launch()
+    if not latest:
+        hedge_stats["all_backends_failed"] += 1
+        raise RuntimeError("All LLM backends are cooling down.")
+
+    try:
+        while pending:
+            done, _ = await asyncio.wait(
+                pending.keys(),
+                timeout=(hedge_delay if hedge_delay is not None else hedge_delay_for(latest)) if queue else None,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if not done:
+                name = launch()
+                if name:
+                    hedge_stats["hedges_launched"] += 1
+                    hedged.append(name)
+                    latest = name
+                continue
+
+            for task in done:
+                name = pending.pop(task)
+                if task.exception() is None:
+                    if name in hedged:
+                        hedge_stats["hedge_wins"] += 1
+                    return task.result()
+
+            # Every finished task errored: move on without waiting for the hedge delay.
+            name = launch()
+            if name:
+                hedge_stats["fallbacks_after_error"] += 1
+                latest = name
+    finally:
+        for task in pending:
+            task.cancel()
+
+    hedge_stats["all_backends_failed"] += 1
+    raise RuntimeError("All LLM backends failed for this request.")
@@ -0,0 +1,124 @@
+import asyncio
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from ..database import SessionLocal
+from .adaptive_engine import update_student_profile
+from .query_metrics import count_queries
+
+# A user's recompute fires once no new event has arrived for the debounce period,
+# but never later than the max delay after the first event of the burst.
+PROFILE_DEBOUNCE_SECONDS = float(os.getenv("PROFILE_DEBOUNCE_SECONDS", "1.0"))
+PROFILE_MAX_DELAY_SECONDS = float(os.getenv("PROFILE_MAX_DELAY_SECONDS", "5.0"))
+PROFILE_WORKER_THREADS = int(os.getenv("PROFILE_WORKER_THREADS", "4"))
+
+
+class ProfileUpdateWorker:
+    """Debounced, per-user background runner for `update_student_profile`.
+
+    Endpoints call `enqueue` and return immediately. Events for the same user are
+    coalesced into one recompute; an event arriving while that user's recompute
+    is running schedules exactly one follow-up. Different users are recomputed
+    concurrently on a small thread pool, each with its own DB session. All
+    bookkeeping happens on the event loop thread.
+    """
+
+    def __init__(self, debounce_seconds: float = PROFILE_DEBOUNCE_SECONDS,
+                 max_delay_seconds: float = PROFILE_MAX_DELAY_SECONDS,
+                 max_workers: int = PROFILE_WORKER_THREADS):
+        self.debounce_seconds = debounce_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="profile-update")
+        self._scheduled: Dict[int, dict] = {}   # user_id -> {"handle", "first_at", "session_id"}
+        self._running: Dict[int, Optional[str]] = {}
+        self._rerun: Dict[int, Optional[str]] = {}
+        self._latencies = deque(maxlen=500)
+        self._query_counts = deque(maxlen=500)
+        self.stats = {"enqueued": 0, "coalesced": 0, "recomputes": 0, "failures": 0}
+
+    def enqueue(self, user_id: int, session_id: Optional[str] = None):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        self.stats["enqueued"] += 1
+
+        if user_id in self._running:
+            if user_id in self._rerun:
+                self.stats["coalesced"] += 1
+            self._rerun[user_id] = session_id or self._rerun.get(user_id)
+            return
+
+        entry = self._scheduled.get(user_id)
+        if entry:
+            self.stats["coalesced"] += 1
+            entry["handle"].cancel()
+            entry["session_id"] = session_id or entry["session_id"]
+        else:
+            entry = {"first_at": now, "session_id": session_id}
+            self._scheduled[user_id] = entry
+
+        fire_at = min(now + self.debounce_seconds, entry["first_at"] + self.max_delay_seconds)
+        entry["handle"] = loop.call_at(fire_at, self._start, user_id)
+
+    def _start(self, user_id: int):
+        entry = self._scheduled.pop(user_id)
+        self._running[user_id] = entry["session_id"]
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, self._recompute, user_id, entry["session_id"])
+        future.add_done_callback(lambda f: self._finished(user_id, f))
+
+    @staticmethod
+    def _recompute(user_id: int, session_id: Optional[str]) -> tuple:
+        started = time.perf_counter()
+        db = SessionLocal()
+        try:
+            with count_queries() as queries:
+                update_student_profile(user_id, db, session_id)
+        finally:
+            db.close()
+        return time.perf_counter() - started, queries.queries
+
+    def _finished(self, user_id: int, future: asyncio.Future):
+        self._running.pop(user_id, None)
+        if future.exception() is not None:
+            self.stats["failures"] += 1
+            print(f"Adaptive Engine Update Failed: {future.exception()}")
+        else:
+            self.stats["recomputes"] += 1
+            latency, queries = future.result()
+            self._latencies.append(latency)
+            self._query_counts.append(queries)
+
+        if user_id in self._rerun:
+            self.enqueue(user_id, self._rerun.pop(user_id))
+            self.stats["enqueued"] -= 1  # follow-up of an already counted event
+
+    def get_stats(self) -> dict:
+        latencies = sorted(self._latencies)
+        latency = {}
+        if latencies:
+            latency = {
+                "last_ms": round(self._latencies[-1] * 1000, 2),
+                "avg_ms": round(sum(latencies) / len(latencies) * 1000, 2),
+                "p95_ms": round(latencies[int(0.95 * (len(latencies) - 1))] * 1000, 2),
+            }
+        queries = {}
+        if self._query_counts:
+            queries = {
+                "last": self._query_counts[-1],
+                "avg": round(sum(self._query_counts) / len(self._query_counts), 2),
+            }
+        return {
+            **self.stats,
+            "scheduled": len(self._scheduled),
+            "running": len(self._running),
+            "queue_depth": len(self._scheduled) + len(self._running),
+            "recompute_latency": latency,
+            "queries_per_recompute": queries,
+        }
+
+
+# Singleton instance
+profile_worker = ProfileUpdateWorker()
@@ -0,0 +1,67 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import List
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Counters active on the current thread; statements from other threads
+# (e.g. concurrent requests) are never attributed to them.
+_local = threading.local()
+
+
+class QueryCounter:
+    """Statements executed (and time spent in them) inside a `count_queries` block."""
+
+    def __init__(self, record_statements: bool = False):
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.elapsed_seconds = 0.0
+        self.statements: List[str] = []
+        self._record = record_statements
+
+    def as_dict(self) -> dict:
+        return {
+            "queries": self.queries,
+            "query_ms": round(self.query_seconds * 1000, 3),
+            "elapsed_ms": round(self.elapsed_seconds * 1000, 3),
+        }
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if getattr(_local, "counters", None):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    counters = getattr(_local, "counters", None)
+    if not counters or not conn.info.get("query_started"):
+        return
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    for counter in counters:
+        counter.queries += 1
+        counter.query_seconds += elapsed
+        if counter._record:
+            counter.statements.append(statement)
+
+
+@contextmanager
+def count_queries(record_statements: bool = False):
+    """Count the SQL statements this thread runs in the block.
+
+        with count_queries() as q:
+            update_student_profile(user_id, db)
+        q.queries, q.query_seconds, q.elapsed_seconds
+    """
+    counter = QueryCounter(record_statements)
+    counters = _local.__dict__.setdefault("counters", [])
+    counters.append(counter)
+    started = time.perf_counter()
+    try:
+        yield counter
+    finally:
+        counter.elapsed_seconds = time.perf_counter() - started
+        counters.remove(counter)
@@ -0,0 +1,242 @@
+import asyncio
+import os
+import random
+import threading
+from collections import Counter
+from typing import Awaitable, Callable, List, Optional
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from ..database import SessionLocal
+from ..models import QuizBankQuestion, UserHistory
+from ..schemas import GeneratedQuiz, QuizQuestion
+from .embedding_storage import embedding_columns, history_embedding, unpack_embedding
+from .similarity import normalize_rows
+
+QUIZ_QUESTION_COUNT = 5
+
+QUESTION_BANK_ENABLED = os.getenv("QUESTION_BANK_ENABLED", "1") != "0"
+# Cosine similarity to one of the recent chat prompts for a banked question to count as on-topic
+QUESTION_BANK_MATCH_SIMILARITY = float(os.getenv("QUESTION_BANK_MATCH_SIMILARITY", "0.7"))
+# New questions at least this similar to a banked one are dropped as duplicates
+QUESTION_BANK_DUPLICATE_SIMILARITY = float(os.getenv("QUESTION_BANK_DUPLICATE_SIMILARITY", "0.95"))
+# Ranking bonus for questions on a topic the student is weak in (does not count towards the match threshold)
+QUESTION_BANK_WEAK_TOPIC_BONUS = 0.05
+# A quiz is drawn at random from this many best-matching questions, so repeated quizzes on one context differ
+QUESTION_BANK_POOL = 2 * QUIZ_QUESTION_COUNT
+
+
+def valid_question(question: QuizQuestion) -> bool:
+    """Answerable as written: text, at least two distinct non-empty options, and the answer among them."""
+    option_ids = [o.id for o in question.options]
+    return bool(
+        question.question_text.strip()
+        and question.explanation.strip()
+        and len(option_ids) >= 2
+        and len(set(option_ids)) == len(option_ids)
+        and all(o.text.strip() for o in question.options)
+        and question.correct_option_id in option_ids
+    )
+
+
+def question_embedding_text(topic: str, question: QuizQuestion) -> str:
+    return f"{topic}: {question.question_text}"
+
+
+class QuestionBank:
+    """Shared bank of LLM-generated quiz questions, served by similarity to the student's chat.
+
+    Questions from every generated quiz are validated, embedded and stored in
+    `quiz_bank_questions` unless a near-identical one is already banked. A quiz
+    is composed from the bank when at least QUIZ_QUESTION_COUNT questions are
+    close to one of the recent chat prompts, whose embeddings UserHistory already
+    holds; otherwise the caller falls back to the LLM.
+
+    Each worker keeps the bank's unit vectors in one in-memory matrix and
+    appends rows banked by other workers (ids past the last one seen) before
+    every lookup, so a lookup is a single matrix product. The lock only guards
+    that sync; deduplication between quizzes banked at the same moment (in one
+    worker or several) is best effort.
+
+    `embed` and `embedding_model` are set by the quiz router to the embedding
+    function and model used for chat prompts.
+    """
+
+    def __init__(self, match_similarity: float = QUESTION_BANK_MATCH_SIMILARITY,
+                 duplicate_similarity: float = QUESTION_BANK_DUPLICATE_SIMILARITY,
+                 enabled: bool = QUESTION_BANK_ENABLED):
+        self.match_similarity = match_similarity
+        self.duplicate_similarity = duplicate_similarity
+        self.enabled = enabled
+        self.embed: Optional[Callable[[str], Awaitable[List[float]]]] = None
+        self.embedding_model: Optional[str] = None
+        # Index arrays are replaced, never mutated, so readers can use them outside the lock
+        self._ids = np.empty(0, dtype=np.int64)
+        self._topics = np.empty(0, dtype=object)
+        self._matrix: Optional[np.ndarray] = None
+        self._last_id = 0
+        self._lock = threading.Lock()
+        self._tasks = set()
+        self.stats = {
+            "composed": 0,
+            "low_coverage": 0,
+            "no_context": 0,
+            "offered": 0,
+            "stored": 0,
+            "duplicates": 0,
+            "invalid": 0,
+            "failures": 0,
+        }
+
+    def _sync(self, db: Session):
+        """Append questions banked since the last sync (by any worker). Caller holds the lock."""
+        rows = db.query(QuizBankQuestion.id, QuizBankQuestion.topic,
+                        QuizBankQuestion.embedding_blob, QuizBankQuestion.embedding_dim)\
+            .filter(QuizBankQuestion.id > self._last_id, QuizBankQuestion.embedding_model == self.embedding_model)\
+            .order_by(QuizBankQuestion.id)\
+            .all()
+        if not rows:
+            return
+        self._last_id = rows[-1].id
+        dim = self._matrix.shape[1] if self._matrix is not None else rows[0].embedding_dim
+        rows = [r for r in rows if r.embedding_blob and r.embedding_dim == dim]
+        if not rows:
+            return
+
+        vectors = normalize_rows(np.stack([unpack_embedding(r.embedding_blob, dim) for r in rows]))
+        self._matrix = vectors if self._matrix is None else np.vstack([self._matrix, vectors])
+        self._ids = np.concatenate([self._ids, np.array([r.id for r in rows], dtype=np.int64)])
+        self._topics = np.concatenate([self._topics, np.array([r.topic for r in rows], dtype=object)])
+
+    # --- Serving ---
+
+    def compose(self, db: Session, turns: List[UserHistory], topics: List[str]) -> Optional[dict]:
+        """A GeneratedQuiz dict drawn from the bank for these chat turns, or None if coverage is too low."""
+        if not self.enabled or not self.embedding_model:
+            return None
+        context = [v for v in (history_embedding(t, self.embedding_model) for t in turns) if v is not None]
+        if not context:
+            self.stats["no_context"] += 1
+            return None
+
+        with self._lock:
+            self._sync(db)
+            matrix, ids, bank_topics = self._matrix, self._ids, self._topics
+        if matrix is None or matrix.shape[1] != len(context[0]):
+            self.stats["low_coverage"] += 1
+            return None
+
+        # Best similarity of each banked question to any of the recent prompts
+        similarity = (matrix @ normalize_rows(np.stack(context)).T).max(axis=1)
+        candidates = np.flatnonzero(similarity >= self.match_similarity)
+        if len(candidates) < QUIZ_QUESTION_COUNT:
+            self.stats["low_coverage"] += 1
+            return None
+
+        rank = similarity[candidates]
+        if topics:
+            rank = rank + QUESTION_BANK_WEAK_TOPIC_BONUS * np.isin(bank_topics[candidates], topics)
+        order = np.argsort(-rank)
+        pool = order[:QUESTION_BANK_POOL]
+        chosen = sorted(random.sample(list(pool), QUIZ_QUESTION_COUNT), key=lambda i: -rank[i])
+        chosen_ids = [int(ids[candidates[i]]) for i in chosen]
+
+        rows = {q.id: q for q in db.query(QuizBankQuestion).filter(QuizBankQuestion.id.in_(chosen_ids))}
+        if len(rows) < len(chosen_ids):
+            self.stats["low_coverage"] += 1
+            return None
+
+        self.stats["composed"] += 1
+        questions = [rows[qid] for qid in chosen_ids]
+        return {
+            "topic": Counter(q.topic for q in questions).most_common(1)[0][0],
+            "questions": [
+                {
+                    "id": n,
+                    "question_text": q.question_text,
+                    "options": q.options,
+                    "correct_option_id": q.correct_option_id,
+                    "explanation": q.explanation,
+                }
+                for n, q in enumerate(questions, start=1)
+            ],
+        }
+
+    # --- Banking ---
+
+    def add(self, quiz: dict, source_model: str):
+        """Bank the questions of an LLM-generated quiz in the background."""
+        if not self.enabled or self.embed is None or not self.embedding_model:
+            return
+        task = asyncio.get_running_loop().create_task(self._add(quiz, source_model))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _add(self, quiz: dict, source_model: str):
+        try:
+            parsed = GeneratedQuiz.model_validate(quiz)
+            questions = [q for q in parsed.questions if valid_question(q)]
+            self.stats["offered"] += len(parsed.questions)
+            self.stats["invalid"] += len(parsed.questions) - len(questions)
+            if not questions:
+                return
+            embeddings = await asyncio.gather(*(self.embed(question_embedding_text(parsed.topic, q)) for q in questions))
+            await asyncio.to_thread(self._insert, parsed.topic, questions, embeddings, source_model)
+        except Exception as e:
+            print(f"Question bank error: {e}")
+            self.stats["failures"] += 1
+
+    def _insert(self, topic: str, questions: List[QuizQuestion], embeddings: List[List[float]], source_model: str):
+        db = SessionLocal()
+        try:
+            with self._lock:
+                self._sync(db)
+            # The matrix is replaced, never mutated: dedupe against this snapshot without holding the lock
+            banked = self._matrix
+            accepted = []
+            for question, embedding in zip(questions, embeddings):
+                if not embedding:
+                    self.stats["failures"] += 1
+                    continue
+                vec = normalize_rows(np.asarray(embedding, dtype=np.float32))
+                if banked is not None and banked.shape[1] != len(vec):
+                    self.stats["failures"] += 1
+                    continue
+                if banked is not None and float(np.max(banked @ vec)) >= self.duplicate_similarity:
+                    self.stats["duplicates"] += 1
+                    continue
+                if any(float(a @ vec) >= self.duplicate_similarity for a in accepted):
+                    self.stats["duplicates"] += 1
+                    continue
+                accepted.append(vec)
+                db.add(QuizBankQuestion(
+                    topic=topic,
+                    question_text=question.question_text,
+                    options=[o.model_dump() for o in question.options],
+                    correct_option_id=question.correct_option_id,
+                    explanation=question.explanation,
+                    source_model=source_model,
+                    **embedding_columns(embedding, self.embedding_model),
+                ))
+            if not accepted:
+                return
+            db.commit()
+            self.stats["stored"] += len(accepted)
+            with self._lock:
+                self._sync(db)
+        finally:
+            db.close()
+
+    def get_stats(self) -> dict:
+        lookups = self.stats["composed"] + self.stats["low_coverage"] + self.stats["no_context"]
+        return {
+            **self.stats,
+            "coverage_rate": round(self.stats["composed"] / lookups, 4) if lookups else None,
+            "questions": len(self._ids),
+            "match_similarity": self.match_similarity,
+        }
+
+
+# Singleton instance
+question_bank = QuestionBank()
@@ -0,0 +1,293 @@
+import asyncio
+import hashlib
+import json
+import os
+from collections import deque
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import desc
+from sqlalchemy.orm import Session
+
+from ..database import SessionLocal
+from ..models import PregeneratedQuiz, UserHistory
+from ..schemas import GeneratedQuiz
+from .question_bank import QUIZ_QUESTION_COUNT, question_bank
+from .topic_mastery import user_mastery
+
+QUIZ_MODEL = "llama-3.1-8b-instant"
+QUIZ_CONTEXT_TURNS = 3
+QUIZ_WEAK_SCORE_RATIO = 0.7
+
+# A user's quiz is pre-generated once their chat has been quiet for the debounce
+# period, so a burst of turns costs one background generation.
+QUIZ_PREGEN_ENABLED = os.getenv("QUIZ_PREGEN_ENABLED", "1") != "0"
+QUIZ_PREGEN_DEBOUNCE_SECONDS = float(os.getenv("QUIZ_PREGEN_DEBOUNCE_SECONDS", "5.0"))
+QUIZ_PREGEN_CONCURRENCY = int(os.getenv("QUIZ_PREGEN_CONCURRENCY", "2"))
+
+# Scope of quizzes built from the user's latest turns across all sessions
+ALL_SESSIONS = ""
+
+
+# ---------- Quiz context ----------
+
+def weak_topics(db: Session, user_id: int) -> List[str]:
+    """Topics the user has scored under QUIZ_WEAK_SCORE_RATIO on, sorted."""
+    return sorted(m.topic_tag for m in user_mastery(db, user_id)
+                  if m.min_ratio is not None and m.min_ratio < QUIZ_WEAK_SCORE_RATIO)
+
+
+def recent_turns(db: Session, user_id: int, session_id: Optional[str] = None) -> List[UserHistory]:
+    """The last QUIZ_CONTEXT_TURNS turns (of one session, if given), oldest first."""
+    query = db.query(UserHistory).filter(UserHistory.user_id == user_id)
+    if session_id:
+        query = query.filter(UserHistory.session_id == session_id)
+    rows = query.order_by(desc(UserHistory.id)).limit(QUIZ_CONTEXT_TURNS).all()
+    return list(reversed(rows))
+
+
+def context_key(turns: List[UserHistory], topics: List[str], model: str = QUIZ_MODEL) -> str:
+    # History rows are never edited, so their ids identify the context text.
+    payload = json.dumps({"turns": [t.id for t in turns], "weak_topics": sorted(topics), "model": model})
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def build_quiz_prompt(turns: List[UserHistory], topics: List[str]) -> str:
+    context_text = "\n".join([f"Student: {h.prompt}\nAI Tutor: {h.response}" for h in turns])
+    weak_topics_str = ", ".join(topics) if topics else "None"
+
+    return f"""
+    Based strictly on the following conversation context, generate a Micro-Quiz to test the student's retention.
+
+    PRIORITY FOCUS: The student has previously struggled with: {weak_topics_str}.
+    If relevant to the context below, prioritize questions on these topics to reinforce learning.
+
+    CONTEXT:
+    {context_text}
+
+    INSTRUCTIONS:
+    1. Create {QUIZ_QUESTION_COUNT} Multiple Choice Questions (MCQs).
+    2. Include 1 distractor answer that addresses a common misconception.
+    3. Output must be valid JSON matching this structure:
+    {{
+        "topic": "Short Topic Name",
+        "questions": [
+            {{
+                "id": 1,
+                "question_text": "...",
+                "options": [
+                    {{"id": "A", "text": "..."}},
+                    {{"id": "B", "text": "..."}},
+                    {{"id": "C", "text": "..."}},
+                    {{"id": "D", "text": "..."}}
+                ],
+                "correct_option_id": "A",
+                "explanation": "Why A is correct..."
+            }}
+        ]
+    }}
+    """
+
+
+def _scope(session_id: Optional[str]) -> str:
+    return session_id or ALL_SESSIONS
+
+
+class QuizCache:
+    """Quizzes generated in the background after chat turns, served by `/quiz/generate`.
+
+    Entries live in the `pregenerated_quizzes` table (shared by every worker),
+    one per (user, scope), tagged with the hash of the context they were built
+    from. A request whose current context hashes the same takes the entry; any
+    new turn, deleted turn or change in weak topics changes the hash, so an
+    outdated quiz is never served. Served entries are consumed and a refill is
+    scheduled, so repeated quizzes on the same context still differ.
+
+    A quiz is composed from the shared question bank when it covers the context,
+    so the LLM is only called for contexts the bank cannot serve.
+
+    `generate` is set by the quiz router: it takes a prompt and returns the quiz
+    dict (or raises).
+    """
+
+    def __init__(self, debounce_seconds: float = QUIZ_PREGEN_DEBOUNCE_SECONDS,
+                 concurrency: int = QUIZ_PREGEN_CONCURRENCY, enabled: bool = QUIZ_PREGEN_ENABLED):
+        self.debounce_seconds = debounce_seconds
+        self.concurrency = concurrency
+        self.enabled = enabled
+        self.generate: Optional[Callable[[str], Awaitable[dict]]] = None
+        self._scheduled: Dict[int, dict] = {}  # user_id -> {"handle", "sessions"}
+        self._tasks = set()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._served_ages = deque(maxlen=500)
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "stale": 0,
+            "enqueued": 0,
+            "coalesced": 0,
+            "generated": 0,
+            "from_bank": 0,
+            "already_fresh": 0,
+            "superseded": 0,
+            "failures": 0,
+        }
+
+    # --- Serving ---
+
+    def take(self, db: Session, user_id: int, session_id: Optional[str], key: str) -> Optional[dict]:
+        """The pre-generated quiz for exactly this context, removed from the cache; None on a miss."""
+        entry = db.query(PregeneratedQuiz)\
+            .filter_by(user_id=user_id, scope=_scope(session_id))\
+            .with_for_update()\
+            .first()
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+        if entry.context_hash != key:
+            # Built for a context that has since moved on
+            self.stats["stale"] += 1
+            return None
+
+        quiz = entry.quiz
+        created = entry.created_at
+        db.delete(entry)
+        db.commit()
+        self.stats["hits"] += 1
+        if created is not None:
+            if created.tzinfo is None:
+                created = created.replace(tzinfo=timezone.utc)
+            self._served_ages.append((datetime.now(timezone.utc) - created).total_seconds())
+        return quiz
+
+    def forget(self, db: Session, user_id: int, session_id: str):
+        """Drop cached quizzes that may contain a deleted session's content. The caller commits."""
+        db.query(PregeneratedQuiz)\
+            .filter(PregeneratedQuiz.user_id == user_id, PregeneratedQuiz.scope.in_([session_id, ALL_SESSIONS]))\
+            .delete(synchronize_session=False)
+
+    # --- Background generation ---
+
+    def enqueue(self, user_id: int, session_id: Optional[str] = None):
+        """Schedule (re)generation for the user's session scope and all-sessions scope."""
+        if not self.enabled or self.generate is None:
+            return
+        loop = asyncio.get_running_loop()
+        self.stats["enqueued"] += 1
+        entry = self._scheduled.get(user_id)
+        if entry:
+            self.stats["coalesced"] += 1
+            entry["handle"].cancel()
+        else:
+            entry = {"sessions": {ALL_SESSIONS}}
+            self._scheduled[user_id] = entry
+        if session_id:
+            entry["sessions"].add(session_id)
+        entry["handle"] = loop.call_later(self.debounce_seconds, self._start, user_id)
+
+    def _start(self, user_id: int):
+        entry = self._scheduled.pop(user_id)
+        task = asyncio.get_running_loop().create_task(self._refresh(user_id, entry["sessions"]))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    @staticmethod
+    def _plan(user_id: int, scopes) -> Dict[str, Tuple[str, List[str], Optional[dict]]]:
+        """{context hash: (prompt, scopes, quiz from the bank or None)} for scopes whose cached quiz is not for the current context."""
+        db = SessionLocal()
+        try:
+            topics = weak_topics(db, user_id)
+            cached = dict(db.query(PregeneratedQuiz.scope, PregeneratedQuiz.context_hash)
+                          .filter(PregeneratedQuiz.user_id == user_id, PregeneratedQuiz.scope.in_(list(scopes)))
+                          .all())
+            plans = {}
+            for scope in scopes:
+                turns = recent_turns(db, user_id, scope or None)
+                if not turns:
+                    continue
+                key = context_key(turns, topics)
+                if cached.get(scope) == key:
+                    continue
+                # The all-sessions context is often the session's context; generate once for both
+                if key not in plans:
+                    plans[key] = (build_quiz_prompt(turns, topics), [], question_bank.compose(db, turns, topics))
+                plans[key][1].append(scope)
+            return plans
+        finally:
+            db.close()
+
+    @staticmethod
+    def _store(user_id: int, key: str, scopes: List[str], quiz: dict) -> int:
+        """Write the quiz for scopes whose context is still `key`. Returns how many were written."""
+        db = SessionLocal()
+        try:
+            topics = weak_topics(db, user_id)
+            current = [scope for scope in scopes if context_key(recent_turns(db, user_id, scope or None), topics) == key]
+            existing = {e.scope: e for e in db.query(PregeneratedQuiz)
+                        .filter(PregeneratedQuiz.user_id == user_id, PregeneratedQuiz.scope.in_(current))
+                        .with_for_update()}
+            for scope in current:
+                entry = existing.get(scope)
+                if entry is None:
+                    entry = PregeneratedQuiz(user_id=user_id, scope=scope)
+                    db.add(entry)
+                entry.context_hash = key
+                entry.model = QUIZ_MODEL
+                entry.quiz = quiz
+                entry.created_at = datetime.now(timezone.utc)
+            db.commit()
+            return len(current)
+        finally:
+            db.close()
+
+    async def _refresh(self, user_id: int, scopes):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            try:
+                plans = await asyncio.to_thread(self._plan, user_id, scopes)
+            except Exception as e:
+                print(f"Quiz pre-generation failed: {e}")
+                self.stats["failures"] += 1
+                return
+            if not plans:
+                self.stats["already_fresh"] += 1
+
+            for key, (prompt, plan_scopes, banked) in plans.items():
+                try:
+                    if banked is not None:
+                        quiz = banked
+                        self.stats["from_bank"] += 1
+                    else:
+                        quiz = GeneratedQuiz.model_validate(await self.generate(prompt)).model_dump()
+                        question_bank.add(quiz, QUIZ_MODEL)
+                    written = await asyncio.to_thread(self._store, user_id, key, plan_scopes, quiz)
+                except Exception as e:
+                    print(f"Quiz pre-generation failed: {e}")
+                    self.stats["failures"] += 1
+                    continue
+                self.stats["generated"] += 1
+                if not written:
+                    self.stats["superseded"] += 1
+
+    def get_stats(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["misses"] + self.stats["stale"]
+        ages = sorted(self._served_ages)
+        served_age = {}
+        if ages:
+            served_age = {
+                "avg_s": round(sum(ages) / len(ages), 1),
+                "p95_s": round(ages[int(0.95 * (len(ages) - 1))], 1),
+                "max_s": round(ages[-1], 1),
+            }
+        return {
+            **self.stats,
+            "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else None,
+            "scheduled": len(self._scheduled),
+            "running": len(self._tasks),
+            "served_age": served_age,
+        }
+
+
+# Singleton instance
+quiz_cache = QuizCache()
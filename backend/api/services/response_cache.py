@@ -0,0 +1,147 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+
+# Cosine similarity above which a cached answer is served for a new prompt.
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.95"))
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", str(6 * 3600)))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "2000"))
+
+
+class SemanticResponseCache:
+    """In-process LLM response cache looked up by prompt-embedding similarity.
+
+    Entries are partitioned by (persona, model) so an answer written for one tutor
+    persona is never served under another. Within a partition the best match is
+    found with a single matrix-vector product over the unit-normalised embeddings.
+    Eviction is LRU over all partitions, and entries older than the TTL are dropped.
+    """
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+                 ttl_seconds: float = RESPONSE_CACHE_TTL_SECONDS,
+                 threshold: float = RESPONSE_CACHE_SIMILARITY):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.threshold = threshold
+        self._entries = OrderedDict()  # entry_id -> dict, oldest use first
+        self._partitions = {}          # partition key -> [entry_id, ...]
+        self._matrices = {}            # partition key -> stacked unit vectors (lazily rebuilt)
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "bypassed": 0,
+            "stores": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "llm_seconds_saved": 0.0,
+        }
+
+    @staticmethod
+    def _partition_key(persona: str, model_choice: str) -> str:
+        return hashlib.sha1(f"{model_choice}\0{persona}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _unit(embedding: List[float]) -> Optional[np.ndarray]:
+        vec = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        if vec.ndim != 1 or norm == 0:
+            return None
+        return vec / norm
+
+    def _drop(self, entry_id: int):
+        entry = self._entries.pop(entry_id)
+        ids = self._partitions[entry["partition"]]
+        ids.remove(entry_id)
+        if not ids:
+            del self._partitions[entry["partition"]]
+        self._matrices.pop(entry["partition"], None)
+
+    def _matrix(self, partition: str) -> np.ndarray:
+        if partition not in self._matrices:
+            self._matrices[partition] = np.stack([self._entries[i]["vector"] for i in self._partitions[partition]])
+        return self._matrices[partition]
+
+    def record_bypass(self):
+        with self._lock:
+            self.stats["bypassed"] += 1
+
+    def lookup(self, embedding: List[float], persona: str, model_choice: str) -> Optional[str]:
+        vec = self._unit(embedding)
+        partition = self._partition_key(persona, model_choice)
+        with self._lock:
+            if vec is None or partition not in self._partitions:
+                self.stats["misses"] += 1
+                return None
+
+            now = time.monotonic()
+            expired = [i for i in self._partitions[partition] if now - self._entries[i]["created_at"] > self.ttl_seconds]
+            for entry_id in expired:
+                self._drop(entry_id)
+                self.stats["expirations"] += 1
+            if partition not in self._partitions:
+                self.stats["misses"] += 1
+                return None
+
+            matrix = self._matrix(partition)
+            if matrix.shape[1] != vec.shape[0]:
+                self.stats["misses"] += 1
+                return None
+            scores = matrix @ vec
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.stats["misses"] += 1
+                return None
+
+            entry_id = self._partitions[partition][best]
+            entry = self._entries[entry_id]
+            self._entries.move_to_end(entry_id)
+            self.stats["hits"] += 1
+            self.stats["llm_seconds_saved"] += entry["llm_seconds"]
+            print(f"DEBUG: Response cache hit (similarity {scores[best]:.4f})")
+            return entry["response"]
+
+    def store(self, embedding: List[float], persona: str, model_choice: str, response: str, llm_seconds: float = 0.0):
+        vec = self._unit(embedding)
+        if vec is None or not response:
+            return
+        partition = self._partition_key(persona, model_choice)
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = {
+                "partition": partition,
+                "vector": vec,
+                "response": response,
+                "created_at": time.monotonic(),
+                "llm_seconds": llm_seconds,
+            }
+            self._partitions.setdefault(partition, []).append(entry_id)
+            self._matrices.pop(partition, None)
+            self.stats["stores"] += 1
+
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+                self.stats["evictions"] += 1
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "llm_seconds_saved": round(self.stats["llm_seconds_saved"], 3),
+                "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else 0.0,
+                "entries": len(self._entries),
+                "threshold": self.threshold,
+                "ttl_seconds": self.ttl_seconds,
+            }
+
+
+# Singleton instance
+response_cache = SemanticResponseCache()
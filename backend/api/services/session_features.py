@@ -0,0 +1,178 @@
+import argparse
+from itertools import groupby
+from typing import Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from ..models import SessionFeatureState, UserHistory
+from .state_rows import claim_row
+from .telemetry_service import (
+    SESSION_FEATURE_ROWS, TELEMETRY_KEYS, aggregate_session_features, features_from_totals, telemetry_sql_columns,
+)
+
+SUM_COLUMNS = ("copy_sum", "paste_sum", "tab_switch_sum", "time_to_query_sum")
+
+
+def _contribution(history_id: int, telemetry_data) -> list:
+    """Window entry for one turn: same rules as the SQL aggregate (missing keys count as 0)."""
+    if not telemetry_data:
+        return [history_id, 0, 0.0, 0.0, 0.0, 0.0]
+    return [history_id, 1] + [float(telemetry_data.get(key, 0) or 0) for key in TELEMETRY_KEYS]
+
+
+def _set_window(state: SessionFeatureState, window: list):
+    # Sums are re-derived from the (bounded) window rather than adjusted in
+    # place, so they never drift; the cost is constant in session length.
+    state.window = window
+    state.window_rows = sum(entry[1] for entry in window)
+    for i, column in enumerate(SUM_COLUMNS):
+        setattr(state, column, sum(entry[2 + i] for entry in window))
+    state.last_history_id = max((entry[0] for entry in window), default=0)
+
+
+def rebuild_session(db: Session, user_id: int, session_id: str) -> Optional[SessionFeatureState]:
+    """Recompute one session's state from its history (two indexed queries). The caller commits."""
+    state = db.query(SessionFeatureState)\
+        .filter_by(user_id=user_id, session_id=session_id)\
+        .with_for_update()\
+        .first()
+    rows = db.query(UserHistory.id, UserHistory.telemetry_data)\
+        .filter(UserHistory.user_id == user_id, UserHistory.session_id == session_id)\
+        .order_by(UserHistory.created_at.desc(), UserHistory.id.desc())\
+        .limit(SESSION_FEATURE_ROWS)\
+        .all()
+    if not rows:
+        if state:
+            db.delete(state)
+        return None
+
+    if not state:
+        state, _ = claim_row(db, SessionFeatureState, user_id=user_id, session_id=session_id)
+    state.turn_count = db.query(func.count(UserHistory.id))\
+        .filter(UserHistory.user_id == user_id, UserHistory.session_id == session_id)\
+        .scalar()
+    _set_window(state, [_contribution(r.id, r.telemetry_data) for r in reversed(rows)])
+    return state
+
+
+def record_turn(db: Session, history: UserHistory):
+    """Fold a just-inserted (flushed, uncommitted) chat turn into its session's state.
+
+    Runs inside the insert's transaction, so the history row and the aggregate
+    commit together. The state row is locked for the update (FOR UPDATE where
+    the database supports it). A session without state yet is built from its
+    history, which already includes this turn; if a concurrent turn created
+    the state first, this turn is folded into it instead.
+    """
+    if not history.session_id:
+        return
+    state, created = claim_row(db, SessionFeatureState, user_id=history.user_id, session_id=history.session_id)
+    if created:
+        rebuild_session(db, history.user_id, history.session_id)
+        return
+
+    window = list(state.window or []) + [_contribution(history.id, history.telemetry_data)]
+    state.turn_count = (state.turn_count or 0) + 1
+    _set_window(state, window[-SESSION_FEATURE_ROWS:])
+
+
+def history_deleted(db: Session, user_id: int, session_id: Optional[str], history_id: int):
+    """Keep the state consistent after a history row is deleted (and flushed)."""
+    if not session_id:
+        return
+    state = db.query(SessionFeatureState)\
+        .filter_by(user_id=user_id, session_id=session_id)\
+        .with_for_update()\
+        .first()
+    if not state:
+        return
+    if any(entry[0] == history_id for entry in state.window or []):
+        rebuild_session(db, user_id, session_id)
+    else:
+        state.turn_count = max(0, (state.turn_count or 0) - 1)
+
+
+def forget_session(db: Session, user_id: int, session_id: str):
+    db.query(SessionFeatureState)\
+        .filter_by(user_id=user_id, session_id=session_id)\
+        .delete(synchronize_session=False)
+
+
+def state_features(state: SessionFeatureState) -> list:
+    return features_from_totals(state.window_rows or 0, *[getattr(state, column) or 0 for column in SUM_COLUMNS])
+
+
+def read_session_features(db: Session, user_id: int, session_id: str) -> list:
+    """The four dependency features for a session: one primary-key-sized lookup.
+
+    Sessions without state (history written before the table existed and not
+    yet rebuilt) fall back to aggregating their history.
+    """
+    state = db.query(SessionFeatureState)\
+        .filter_by(user_id=user_id, session_id=session_id)\
+        .first()
+    if state is None:
+        return aggregate_session_features(user_id, session_id, db)
+    return state_features(state)
+
+
+def rebuild_all(db: Session, batch_size: int = 5000) -> dict:
+    """Recompute every session's state from history with one windowed scan.
+
+    Replaces the table contents in a single transaction.
+    """
+    ranked = select(
+        UserHistory.user_id,
+        UserHistory.session_id,
+        UserHistory.id,
+        *telemetry_sql_columns(),
+        func.row_number().over(
+            partition_by=(UserHistory.user_id, UserHistory.session_id),
+            order_by=(UserHistory.created_at.desc(), UserHistory.id.desc()),
+        ).label("rn"),
+        func.count().over(partition_by=(UserHistory.user_id, UserHistory.session_id)).label("turns"),
+    ).where(UserHistory.session_id.isnot(None)).subquery()
+    rows = db.execute(
+        select(ranked)
+        .where(ranked.c.rn <= SESSION_FEATURE_ROWS)
+        .order_by(ranked.c.user_id, ranked.c.session_id, ranked.c.rn.desc())
+        .execution_options(yield_per=batch_size)
+    )
+
+    db.query(SessionFeatureState).delete(synchronize_session=False)
+    pending, sessions = [], 0
+    for (user_id, session_id), group in groupby(rows, key=lambda r: (r.user_id, r.session_id)):
+        group = list(group)
+        state = SessionFeatureState(user_id=user_id, session_id=session_id, turn_count=group[0].turns)
+        _set_window(state, [[r.id, int(r.has_data)] + [float(r._mapping[key]) for key in TELEMETRY_KEYS] for r in group])
+        pending.append({
+            column: getattr(state, column)
+            for column in ("user_id", "session_id", "turn_count", "window", "window_rows", "last_history_id") + SUM_COLUMNS
+        })
+        sessions += 1
+        if len(pending) >= batch_size:
+            db.bulk_insert_mappings(SessionFeatureState, pending)
+            pending = []
+    if pending:
+        db.bulk_insert_mappings(SessionFeatureState, pending)
+    db.commit()
+    return {"sessions": sessions}
+
+
+if __name__ == "__main__":
+    from ..database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Session telemetry accumulators.")
+    parser.add_argument("--rebuild", action="store_true", help="Recompute every session from history")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        if args.rebuild:
+            print(rebuild_all(db, args.batch_size))
+        else:
+            parser.print_help()
+    finally:
+        db.close()
@@ -0,0 +1,29 @@
+from typing import Optional, Tuple
+
+import numpy as np
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """Unit-normalise each row; all-zero rows stay zero so they score 0 against anything."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms == 0, 1.0, norms)
+
+
+def cosine_scores(query, matrix: np.ndarray) -> np.ndarray:
+    """Cosine similarity of `query` against every row of `matrix` in one matrix-vector product."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    q = normalize_rows(np.asarray(query, dtype=np.float32))
+    # Dividing the scores by the row norms avoids materialising a normalised copy of the matrix.
+    norms = np.sqrt(np.einsum("ij,ij->i", matrix, matrix))
+    return (matrix @ q) / np.where(norms == 0, 1.0, norms)
+
+
+def best_match(query, matrix: np.ndarray) -> Optional[Tuple[int, float]]:
+    """(row index, cosine score) of the row in `matrix` most similar to `query`."""
+    if matrix is None or len(matrix) == 0 or query is None or len(query) == 0:
+        return None
+    scores = cosine_scores(query, matrix)
+    idx = int(np.argmax(scores))
+    return idx, float(scores[idx])
+
@@ -0,0 +1,328 @@
+import argparse
+import heapq
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import List, Optional
+
+import numpy as np
+from sqlalchemy import and_, case, func, select
+from sqlalchemy.orm import Session
+
+from ..ml.engine import predict_dependency_batch
+from ..models import LearningPath, QuizScore, SessionFeatureState, StudentSkillIndex, TelemetryLog, User, UserHistory
+from .adaptive_engine import (
+    SSI_RECENT_CHATS, SSI_RECENT_QUIZZES, SSI_STRONG_THRESHOLD, SSI_WEAK_THRESHOLD,
+    WEIGHT_INDEPENDENCE, WEIGHT_QUALITY, WEIGHT_RETENTION,
+)
+from .session_features import SUM_COLUMNS
+from .telemetry_service import DEFAULT_SESSION_FEATURES, SESSION_FEATURE_ROWS, TELEMETRY_KEYS, telemetry_sql_columns
+
+# Users aggregated (and written back) per round trip.
+SSI_BULK_USER_CHUNK = int(os.getenv("SSI_BULK_USER_CHUNK", "5000"))
+# Largest individual SSI changes kept in the report.
+SSI_REPORT_SAMPLE = 20
+
+# Progress of the running (or last) job, served by GET /admin/ssi/recompute/status.
+ssi_job_status = {"running": False}
+_job_lock = threading.Lock()
+
+
+class SSIJobRunning(Exception):
+    pass
+
+
+def _user_chunks(db: Session, user_ids: Optional[List[int]], chunk_size: int, unknown: List[int]):
+    """Chunks of existing user ids. Explicit ids with no `users` row are skipped and appended to `unknown`."""
+    if user_ids is not None:
+        ids = sorted(set(user_ids))
+        for start in range(0, len(ids), chunk_size):
+            requested = ids[start:start + chunk_size]
+            known = {r.id for r in db.query(User.id).filter(User.id.in_(requested)).all()}
+            unknown.extend(user_id for user_id in requested if user_id not in known)
+            chunk = [user_id for user_id in requested if user_id in known]
+            if chunk:
+                yield chunk
+        return
+
+    last_user_id = 0
+    while True:
+        ids = [r.id for r in db.query(User.id)
+               .filter(User.id > last_user_id)
+               .order_by(User.id)
+               .limit(chunk_size)
+               .all()]
+        if not ids:
+            return
+        yield ids
+        last_user_id = ids[-1]
+
+
+def _recent(column_user_id, order_by):
+    return func.row_number().over(partition_by=column_user_id, order_by=order_by).label("rn")
+
+
+def _quiz_aggregates(db: Session, user_ids: List[int]):
+    """user_id, quizzes counted, average score ratio (%) over the last SSI_RECENT_QUIZZES."""
+    ranked = select(
+        QuizScore.user_id,
+        case((QuizScore.total_questions > 0, QuizScore.score * 100.0 / QuizScore.total_questions)).label("pct"),
+        _recent(QuizScore.user_id, (QuizScore.created_at.desc(), QuizScore.id.desc())),
+    ).where(QuizScore.user_id.in_(user_ids)).subquery()
+    return db.query(ranked.c.user_id, func.count(), func.avg(ranked.c.pct))\
+        .filter(ranked.c.rn <= SSI_RECENT_QUIZZES)\
+        .group_by(ranked.c.user_id)\
+        .all()
+
+
+def _latest_sessions(user_ids: List[int]):
+    ranked_logs = select(
+        TelemetryLog.user_id,
+        TelemetryLog.session_id,
+        _recent(TelemetryLog.user_id, (TelemetryLog.created_at.desc(), TelemetryLog.id.desc())),
+    ).where(TelemetryLog.user_id.in_(user_ids)).subquery()
+    return select(ranked_logs.c.user_id, ranked_logs.c.session_id).where(ranked_logs.c.rn == 1).subquery()
+
+
+def _session_feature_sums_from_history(db: Session, user_ids: List[int]):
+    """Telemetry sums over the last rows of each user's latest telemetry session, from history."""
+    latest = _latest_sessions(user_ids)
+    ranked_rows = select(
+        UserHistory.user_id,
+        *telemetry_sql_columns(),
+        _recent(UserHistory.user_id, (UserHistory.created_at.desc(), UserHistory.id.desc())),
+    ).join(latest, and_(latest.c.user_id == UserHistory.user_id, latest.c.session_id == UserHistory.session_id))\
+        .subquery()
+    c = ranked_rows.c
+    return db.query(
+        c.user_id,
+        func.sum(c.has_data),
+        *[func.sum(c[key]) for key in TELEMETRY_KEYS],
+    ).filter(c.rn <= SESSION_FEATURE_ROWS).group_by(c.user_id).all()
+
+
+def _session_feature_sums(db: Session, user_ids: List[int]):
+    """Window sums of each user's latest telemetry session, read from SessionFeatureState.
+
+    Sessions without a state row (not rebuilt yet) are aggregated from history.
+    """
+    latest = _latest_sessions(user_ids)
+    rows = db.query(
+        latest.c.user_id,
+        SessionFeatureState.id,
+        SessionFeatureState.window_rows,
+        *[getattr(SessionFeatureState, column) for column in SUM_COLUMNS],
+    ).outerjoin(SessionFeatureState, and_(
+        SessionFeatureState.user_id == latest.c.user_id,
+        SessionFeatureState.session_id == latest.c.session_id,
+    )).all()
+
+    sums = [(row[0], *row[2:]) for row in rows if row[1] is not None]
+    missing = [row[0] for row in rows if row[1] is None]
+    if missing:
+        sums += _session_feature_sums_from_history(db, missing)
+    return sums
+
+
+def _prompt_lengths(db: Session, user_ids: List[int]):
+    """user_id, average prompt length over the last SSI_RECENT_CHATS chats (no text is loaded)."""
+    ranked = select(
+        UserHistory.user_id,
+        func.length(UserHistory.prompt).label("prompt_length"),
+        _recent(UserHistory.user_id, UserHistory.id.desc()),
+    ).where(UserHistory.user_id.in_(user_ids)).subquery()
+    return db.query(ranked.c.user_id, func.avg(ranked.c.prompt_length))\
+        .filter(ranked.c.rn <= SSI_RECENT_CHATS)\
+        .group_by(ranked.c.user_id)\
+        .all()
+
+
+def _scatter(ids: np.ndarray, rows, n_values: int) -> tuple:
+    """Aggregate rows (user_id, *values) -> (present mask, (users, n_values) matrix) aligned to ids."""
+    present = np.zeros(len(ids), dtype=bool)
+    values = np.zeros((len(ids), n_values), dtype=np.float64)
+    if rows:
+        table = np.array([[v if v is not None else np.nan for v in row] for row in rows], dtype=np.float64)
+        pos = np.searchsorted(ids, table[:, 0].astype(np.int64))
+        present[pos] = True
+        values[pos] = table[:, 1:]
+    return present, values
+
+
+def compute_ssi_bulk(db: Session, user_ids: List[int], weights: tuple = None) -> dict:
+    """SSI, dependency probability, bucket and path for a chunk of users (same rules as calculate_ssi)."""
+    w_retention, w_independence, w_quality = weights or (WEIGHT_RETENTION, WEIGHT_INDEPENDENCE, WEIGHT_QUALITY)
+    ids = np.array(sorted(user_ids), dtype=np.int64)
+
+    has_quiz, quiz = _scatter(ids, _quiz_aggregates(db, user_ids), 2)
+    R = np.where(has_quiz, np.nan_to_num(quiz[:, 1], nan=0.0), 50.0)
+
+    _, sums = _scatter(ids, _session_feature_sums(db, user_ids), 5)
+    count, copy, paste, switches, time_ms = sums.T
+    has_features = count > 0
+    safe_count = np.where(has_features, count, 1.0)
+    activity = copy + paste + switches
+    features = np.tile(np.asarray(DEFAULT_SESSION_FEATURES, dtype=np.float64), (len(ids), 1))
+    features[has_features] = np.column_stack([
+        np.divide(copy + paste, activity, out=np.zeros_like(activity), where=activity > 0),
+        np.minimum(1.0, time_ms / safe_count / 5000),
+        (paste > 2).astype(np.float64),
+        switches,
+    ])[has_features]
+    dependency_prob = predict_dependency_batch(features).astype(np.float64)
+    I = (1.0 - dependency_prob) * 100.0
+
+    has_chats, prompt = _scatter(ids, _prompt_lengths(db, user_ids), 1)
+    Q = np.where(has_chats, np.clip(prompt[:, 0] / 200 * 100, 0.0, 100.0), 50.0)
+
+    ssi = np.round(w_retention * R + w_independence * I + w_quality * Q, 2)
+    weak, strong = ssi < SSI_WEAK_THRESHOLD, ssi > SSI_STRONG_THRESHOLD
+    return {
+        "user_ids": ids,
+        "ssi": ssi,
+        "dependency_prob": dependency_prob,
+        "bucket": np.select([weak, strong], ["Weak", "Strong"], "Moderate"),
+        "path_type": np.select([weak, strong], ["Reinforcement", "Acceleration"], "Balanced"),
+    }
+
+
+def _diff_and_write(db: Session, result: dict, report: dict, dry_run: bool):
+    ids = result["user_ids"].tolist()
+    skills = {r.user_id: r for r in db.query(StudentSkillIndex.user_id, StudentSkillIndex.id,
+                                             StudentSkillIndex.index_value, StudentSkillIndex.bucket)
+              .filter(StudentSkillIndex.user_id.in_(ids)).all()}
+    paths = {r.user_id: r for r in db.query(LearningPath.user_id, LearningPath.id, LearningPath.path_type)
+             .filter(LearningPath.user_id.in_(ids)).all()}
+
+    now = datetime.now(timezone.utc)
+    skill_updates, skill_inserts, path_updates, path_inserts = [], [], [], []
+    for user_id, ssi, bucket, path_type in zip(ids, result["ssi"].tolist(),
+                                               result["bucket"].tolist(), result["path_type"].tolist()):
+        old = skills.get(user_id)
+        old_ssi = old.index_value if old and old.index_value is not None else None
+        old_bucket = old.bucket if old else None
+        old_path = paths[user_id].path_type if user_id in paths else None
+
+        if old_ssi is None:
+            report["new_records"] += 1
+        else:
+            delta = ssi - old_ssi
+            report["_abs_delta_sum"] += abs(delta)
+            report["max_abs_delta"] = max(report["max_abs_delta"], round(abs(delta), 2))
+            if abs(delta) >= 0.005:
+                report["ssi_changed"] += 1
+                entry = (abs(delta), user_id, old_ssi, ssi)
+                if len(report["_largest"]) < SSI_REPORT_SAMPLE:
+                    heapq.heappush(report["_largest"], entry)
+                else:
+                    heapq.heappushpop(report["_largest"], entry)
+        if old_bucket != bucket:
+            key = f"{old_bucket or 'none'}->{bucket}"
+            report["bucket_transitions"][key] = report["bucket_transitions"].get(key, 0) + 1
+        if old_path != path_type:
+            key = f"{old_path or 'none'}->{path_type}"
+            report["path_transitions"][key] = report["path_transitions"].get(key, 0) + 1
+
+        skill_values = {"index_value": ssi, "bucket": bucket, "last_updated": now}
+        if old:
+            skill_updates.append({"id": old.id, **skill_values})
+        else:
+            skill_inserts.append({"user_id": user_id, **skill_values})
+        if user_id in paths:
+            path_updates.append({"id": paths[user_id].id, "path_type": path_type})
+        else:
+            path_inserts.append({"user_id": user_id, "path_type": path_type})
+
+    if dry_run:
+        return
+    if skill_updates:
+        db.bulk_update_mappings(StudentSkillIndex, skill_updates)
+    if skill_inserts:
+        db.bulk_insert_mappings(StudentSkillIndex, skill_inserts)
+    if path_updates:
+        db.bulk_update_mappings(LearningPath, path_updates)
+    if path_inserts:
+        db.bulk_insert_mappings(LearningPath, path_inserts)
+    db.commit()
+
+
+def recompute_ssi_bulk(db: Session, user_ids: Optional[List[int]] = None, dry_run: bool = False,
+                       weights: tuple = None, chunk_size: int = SSI_BULK_USER_CHUNK) -> dict:
+    """Recompute SSI, bucket and learning path for many users (every user by default).
+
+    Per chunk of users, a few set-based queries fetch the quiz aggregates, the
+    latest session's SessionFeatureState sums and the prompt-length averages; features and SSI are computed with NumPy, the
+    dependency model scores the whole chunk in one batch, and StudentSkillIndex
+    / LearningPath are bulk-upserted. Requested ids without a user are skipped
+    and listed in the report as `unknown_user_ids`. With `dry_run` nothing is written and the
+    report describes what would change. `weights` overrides
+    (retention, independence, quality) for this run.
+    """
+    if not _job_lock.acquire(blocking=False):
+        raise SSIJobRunning("An SSI recompute is already running")
+    started = time.perf_counter()
+    report = {
+        "users": 0, "unknown_user_ids": [], "new_records": 0, "ssi_changed": 0, "max_abs_delta": 0.0,
+        "bucket_transitions": {}, "path_transitions": {}, "_abs_delta_sum": 0.0, "_largest": [],
+    }
+    ssi_job_status.clear()
+    ssi_job_status.update({
+        "running": True, "dry_run": dry_run, "processed": 0,
+        "started_at": datetime.now(timezone.utc).isoformat(),
+    })
+    try:
+        total = len(set(user_ids)) if user_ids is not None else db.query(func.count(User.id)).scalar()
+        ssi_job_status["total"] = total
+        for chunk in _user_chunks(db, user_ids, chunk_size, report["unknown_user_ids"]):
+            result = compute_ssi_bulk(db, chunk, weights)
+            _diff_and_write(db, result, report, dry_run)
+            report["users"] += len(chunk)
+            elapsed = time.perf_counter() - started
+            ssi_job_status.update({"processed": report["users"] + len(report["unknown_user_ids"]),
+                                   "users_per_second": round(report["users"] / elapsed, 1)})
+            print(f"SSI bulk: {report['users']}/{total} users, {report['users'] / elapsed:.1f} users/s")
+    except Exception as e:
+        ssi_job_status["error"] = str(e)
+        raise
+    finally:
+        ssi_job_status["running"] = False
+        _job_lock.release()
+
+    if report["unknown_user_ids"]:
+        print(f"WARNING: SSI bulk skipped {len(report['unknown_user_ids'])} unknown user ids")
+
+    elapsed = time.perf_counter() - started
+    compared = report["users"] - report["new_records"]
+    largest = sorted(report.pop("_largest"), reverse=True)
+    abs_delta_sum = report.pop("_abs_delta_sum")
+    report.update({
+        "dry_run": dry_run,
+        "mean_abs_delta": round(abs_delta_sum / compared, 4) if compared else 0.0,
+        "largest_changes": [
+            {"user_id": uid, "old_ssi": old, "new_ssi": new, "delta": round(new - old, 2)}
+            for _, uid, old, new in largest
+        ],
+        "seconds": round(elapsed, 3),
+        "users_per_second": round(report["users"] / elapsed, 1) if elapsed > 0 else 0.0,
+    })
+    ssi_job_status["report"] = report
+    return report
+
+
+if __name__ == "__main__":
+    from ..database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Recompute SSI, buckets and learning paths for many users.")
+    parser.add_argument("--user-ids", type=int, nargs="*", help="Only these users (default: everyone)")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would change without writing")
+    parser.add_argument("--weights", type=float, nargs=3, metavar=("RETENTION", "INDEPENDENCE", "QUALITY"))
+    parser.add_argument("--chunk-size", type=int, default=SSI_BULK_USER_CHUNK)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        print(recompute_ssi_bulk(db, args.user_ids, args.dry_run, tuple(args.weights) if args.weights else None,
+                                 args.chunk_size))
+    finally:
+        db.close()
@@ -0,0 +1,41 @@
+from typing import Tuple
+
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+
+def _insert_if_missing(db: Session, model, key: dict) -> bool:
+    """Insert a row with just `key` unless its unique key already exists. True if this call inserted it."""
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        # Waits for a concurrent insert of the same key to commit, then does nothing
+        result = db.execute(dialect_insert(model).values(**key).on_conflict_do_nothing())
+        return result.rowcount == 1
+
+    try:
+        with db.begin_nested():
+            db.execute(insert(model).values(**key))
+        return True
+    except IntegrityError:
+        return False
+
+
+def claim_row(db: Session, model, **key) -> Tuple[object, bool]:
+    """The row of `model` with unique `key`, locked for update; inserted (with column defaults) if missing.
+
+    Concurrent transactions that both find the row missing cannot both insert
+    it: one inserts, the other gets the committed row. Returns (row, created);
+    a created row is the caller's to fill in, an existing one may already hold
+    another transaction's work. Nothing is committed.
+    """
+    query = db.query(model).filter_by(**key).with_for_update()
+    row = query.first()
+    if row is not None:
+        return row, False
+    created = _insert_if_missing(db, model, key)
+    return query.populate_existing().one(), created
@@ -1,36 +1,30 @@
 
+from sqlalchemy import String, and_, case, cast, func
 from sqlalchemy.orm import Session
 from ..models import TelemetryLog, UserHistory
 from datetime import datetime
 
-def aggregate_session_features(user_id: int, session_id: str, db: Session):
+# Rows of the session's history the dependency features are aggregated over
+SESSION_FEATURE_ROWS = 10
+DEFAULT_SESSION_FEATURES = [0, 0.5, 0, 0] # Default Safe Vector
+TELEMETRY_KEYS = ("copy_count", "paste_count", "tab_switch_count", "time_to_query_ms")
 
-    # Get recent history for this session to aggregate metrics
-    history_items = db.query(UserHistory).filter(
-        UserHistory.user_id == user_id,
-        UserHistory.session_id == session_id
-    ).order_by(UserHistory.created_at.desc()).limit(10).all()
-    
-    if not history_items:
-         return [0, 0.5, 0, 0] # Default Safe Vector
-
-    total_copy = 0
-    total_paste = 0
-    total_switches = 0
-    total_time_ms = 0
-    count = 0
-
-    for item in history_items:
-        if item.telemetry_data:
-            data = item.telemetry_data
-            total_copy += data.get('copy_count', 0)
-            total_paste += data.get('paste_count', 0)
-            total_switches += data.get('tab_switch_count', 0)
-            total_time_ms += data.get('time_to_query_ms', 0)
-            count += 1
-    
-    if count == 0:
-        return [0, 0.5, 0, 0]
+
+def telemetry_sql_columns() -> list:
+    """SQL expressions for a UserHistory row: has-telemetry flag (0/1) and each TELEMETRY_KEYS value.
+
+    Lets the totals below be aggregated in the database instead of loading the JSON.
+    """
+    data = UserHistory.telemetry_data
+    has_data = and_(data.isnot(None), cast(data, String).notin_(["null", "{}"]))
+    return [case((has_data, 1), else_=0).label("has_data")] + [
+        func.coalesce(data[key].as_float(), 0.0).label(key) for key in TELEMETRY_KEYS
+    ]
+
+
+def features_from_totals(count, total_copy, total_paste, total_switches, total_time_ms) -> list:
+    if not count:
+        return list(DEFAULT_SESSION_FEATURES)
 
     # Feature Engineering matches XGBoost Training Expected Input
     # 1. Copy Paste Rate (Normalized)
@@ -47,4 +41,19 @@ def aggregate_session_features(user_id: int, session_id: str, db: Session):
     # 4. Tab Switches (Raw Count)
     tab_switch_count = total_switches
 
-    return [copy_paste_rate, time_ratio, code_reliance, tab_switch_count]
\ No newline at end of file
+    return [copy_paste_rate, time_ratio, code_reliance, tab_switch_count]
+
+
+def aggregate_session_features(user_id: int, session_id: str, db: Session):
+
+    # Aggregate the session's recent telemetry in SQL; no row or JSON is loaded
+    recent = db.query(*telemetry_sql_columns()).filter(
+        UserHistory.user_id == user_id,
+        UserHistory.session_id == session_id
+    ).order_by(UserHistory.created_at.desc(), UserHistory.id.desc()).limit(SESSION_FEATURE_ROWS).subquery()
+
+    totals = db.query(
+        func.sum(recent.c.has_data),
+        *[func.sum(recent.c[key]) for key in TELEMETRY_KEYS]
+    ).one()
+    return features_from_totals(*[value or 0 for value in totals])
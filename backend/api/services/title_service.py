@@ -0,0 +1,107 @@
+import asyncio
+import os
+from typing import Awaitable, Callable, List, Optional
+
+from ..database import SessionLocal
+from ..models import UserHistory
+
+# How long the worker keeps collecting new sessions before issuing one batched
+# LLM call, and the largest number of titles requested in a single call.
+TITLE_BATCH_WINDOW_SECONDS = float(os.getenv("TITLE_BATCH_WINDOW_SECONDS", "0.5"))
+TITLE_BATCH_SIZE = int(os.getenv("TITLE_BATCH_SIZE", "20"))
+
+FALLBACK_TITLE_WORDS = 6
+
+
+def fallback_title(prompt: str) -> str:
+    """Local placeholder title (first words of the prompt) shown until the LLM title arrives."""
+    words = (prompt or "").split()
+    if not words:
+        return "New Chat"
+    title = " ".join(words[:FALLBACK_TITLE_WORDS])
+    return title + "..." if len(words) > FALLBACK_TITLE_WORDS else title
+
+
+class TitleWorker:
+    """Generates chat titles in the background, batching sessions that start together.
+
+    `generate` is set by the chat router: it takes a list of opening prompts and
+    returns one title per prompt (or raises). Results overwrite the placeholder
+    title on every row of the session that still carries it.
+    """
+
+    def __init__(self, batch_window: float = TITLE_BATCH_WINDOW_SECONDS, batch_size: int = TITLE_BATCH_SIZE):
+        self.batch_window = batch_window
+        self.batch_size = batch_size
+        self.generate: Optional[Callable[[List[str]], Awaitable[List[str]]]] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"enqueued": 0, "batches": 0, "titled": 0, "failed": 0}
+
+    def enqueue(self, user_id: int, session_id: str, prompt: str, placeholder: str):
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        self._queue.put_nowait((user_id, session_id, prompt, placeholder))
+        self.stats["enqueued"] += 1
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "pending": self._queue.qsize() if self._queue else 0}
+
+    async def _next_batch(self) -> list:
+        batch = [await self._queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.batch_window
+        while len(batch) < self.batch_size:
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            self.stats["batches"] += 1
+            try:
+                titles = await self.generate([prompt for _, _, prompt, _ in batch])
+                if len(titles) != len(batch):
+                    raise ValueError(f"expected {len(batch)} titles, got {len(titles)}")
+            except Exception as e:
+                print(f"Title generation failed: {e}")
+                self.stats["failed"] += len(batch)
+                continue
+
+            updates = [
+                (user_id, session_id, placeholder, title)
+                for (user_id, session_id, _, placeholder), title in zip(batch, titles) if title
+            ]
+            try:
+                await asyncio.to_thread(self._apply, updates)
+                self.stats["titled"] += len(updates)
+            except Exception as e:
+                print(f"Title update failed: {e}")
+                self.stats["failed"] += len(updates)
+
+    @staticmethod
+    def _apply(updates: list):
+        db = SessionLocal()
+        try:
+            for user_id, session_id, placeholder, title in updates:
+                db.query(UserHistory)\
+                    .filter(
+                        UserHistory.user_id == user_id,
+                        UserHistory.session_id == session_id,
+                        UserHistory.title == placeholder,
+                    )\
+                    .update({UserHistory.title: title}, synchronize_session=False)
+                print(f"Generated Title: {title}")
+            db.commit()
+        finally:
+            db.close()
+
+
+# Singleton instance
+title_worker = TitleWorker()
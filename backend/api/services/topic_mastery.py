@@ -0,0 +1,161 @@
+import argparse
+import os
+from datetime import datetime, timezone
+from itertools import groupby
+from typing import List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from ..models import QuizScore, TopicMastery
+from .state_rows import claim_row
+
+TOPIC_MASTERY_HALF_LIFE_DAYS = float(os.getenv("TOPIC_MASTERY_HALF_LIFE_DAYS", "14"))
+
+STATE_COLUMNS = ("attempts", "score_sum", "question_sum", "ratio_sum", "min_ratio", "decayed_ratio", "decayed_weight",
+                 "last_seen")
+
+
+def _utc(moment: Optional[datetime]) -> Optional[datetime]:
+    # SQLite hands back naive datetimes for timezone-aware columns
+    if moment is not None and moment.tzinfo is None:
+        return moment.replace(tzinfo=timezone.utc)
+    return moment
+
+
+def _new_state(user_id: int, topic_tag: str) -> TopicMastery:
+    return TopicMastery(user_id=user_id, topic_tag=topic_tag, attempts=0, score_sum=0.0, question_sum=0,
+                        ratio_sum=0.0, decayed_ratio=0.0, decayed_weight=0.0)
+
+
+def _fold(state: TopicMastery, score: float, total_questions: int, seen_at: Optional[datetime]):
+    ratio = score / total_questions
+    seen_at = _utc(seen_at)
+    last_seen = _utc(state.last_seen)
+
+    # Earlier quizzes lose half their weight every half-life before this one is averaged in
+    weight = state.decayed_weight or 0.0
+    if weight and last_seen and seen_at and seen_at > last_seen:
+        weight *= 0.5 ** ((seen_at - last_seen).total_seconds() / 86400 / TOPIC_MASTERY_HALF_LIFE_DAYS)
+    state.decayed_ratio = ((state.decayed_ratio or 0.0) * weight + ratio) / (weight + 1.0)
+    state.decayed_weight = weight + 1.0
+
+    state.attempts = (state.attempts or 0) + 1
+    state.score_sum = (state.score_sum or 0.0) + score
+    state.question_sum = (state.question_sum or 0) + total_questions
+    state.ratio_sum = (state.ratio_sum or 0.0) + ratio
+    state.min_ratio = ratio if state.min_ratio is None else min(state.min_ratio, ratio)
+    if seen_at and (last_seen is None or seen_at > last_seen):
+        state.last_seen = seen_at
+
+
+def _scores(db: Session, user_id: int, topic_tag: Optional[str] = None):
+    query = db.query(QuizScore.topic_tag, QuizScore.score, QuizScore.total_questions, QuizScore.created_at)\
+        .filter(QuizScore.user_id == user_id, QuizScore.total_questions > 0)
+    if topic_tag is not None:
+        query = query.filter(QuizScore.topic_tag == topic_tag)
+    return query.order_by(QuizScore.topic_tag, QuizScore.created_at, QuizScore.id).all()
+
+
+def _built_state(user_id: int, topic_tag: str, rows) -> TopicMastery:
+    state = _new_state(user_id, topic_tag)
+    for row in rows:
+        _fold(state, row.score, row.total_questions, row.created_at)
+    return state
+
+
+def record_score(db: Session, quiz: QuizScore, seen_at: Optional[datetime] = None):
+    """Fold a just-inserted (flushed, uncommitted) quiz score into its topic's state.
+
+    Runs inside the insert's transaction, so the score and the rollup commit
+    together; the state row is locked for the update. A topic without state
+    yet is built from its scores, which already include this one (and a user
+    without any state gets all their topics built). If a concurrent submit
+    created the row first, this score is folded into it instead. Quizzes
+    without questions carry no score and are left out, as in the averages
+    computed from the raw rows.
+    """
+    if not quiz.topic_tag or not quiz.total_questions or quiz.total_questions <= 0:
+        return
+    seen_at = seen_at or quiz.created_at or datetime.now(timezone.utc)
+    state = db.query(TopicMastery)\
+        .filter_by(user_id=quiz.user_id, topic_tag=quiz.topic_tag)\
+        .with_for_update()\
+        .first()
+    if state is not None:
+        _fold(state, quiz.score, quiz.total_questions, seen_at)
+        return
+
+    if db.query(TopicMastery.id).filter(TopicMastery.user_id == quiz.user_id).first() is None:
+        # First rollup write for this user: bring over every topic they were scored on before
+        built = user_mastery(db, quiz.user_id)
+    else:
+        built = [_built_state(quiz.user_id, quiz.topic_tag, _scores(db, quiz.user_id, quiz.topic_tag))]
+    for computed in built:
+        state, created = claim_row(db, TopicMastery, user_id=quiz.user_id, topic_tag=computed.topic_tag)
+        if created:
+            for column in STATE_COLUMNS:
+                setattr(state, column, getattr(computed, column))
+        elif computed.topic_tag == quiz.topic_tag:
+            # Built by a concurrent submit from the scores committed before this one
+            _fold(state, quiz.score, quiz.total_questions, seen_at)
+
+
+def user_mastery(db: Session, user_id: int) -> List[TopicMastery]:
+    """The user's per-topic states: one indexed read.
+
+    Users whose scores predate the table (and have not been rebuilt) get
+    states computed from their scores, without writing them.
+    """
+    states = db.query(TopicMastery).filter(TopicMastery.user_id == user_id).all()
+    if states:
+        return states
+    for topic_tag, rows in groupby(_scores(db, user_id), key=lambda r: r.topic_tag):
+        states.append(_built_state(user_id, topic_tag, rows))
+    return states
+
+
+def rebuild_all(db: Session, batch_size: int = 5000) -> dict:
+    """Recompute every (user, topic) state from the quiz scores in one ordered scan.
+
+    Replaces the table contents in a single transaction.
+    """
+    rows = db.execute(
+        select(QuizScore.user_id, QuizScore.topic_tag, QuizScore.score, QuizScore.total_questions, QuizScore.created_at)
+        .where(QuizScore.total_questions > 0, QuizScore.topic_tag.isnot(None))
+        .order_by(QuizScore.user_id, QuizScore.topic_tag, QuizScore.created_at, QuizScore.id)
+        .execution_options(yield_per=batch_size)
+    )
+
+    db.query(TopicMastery).delete(synchronize_session=False)
+    pending, topics = [], 0
+    for (user_id, topic_tag), group in groupby(rows, key=lambda r: (r.user_id, r.topic_tag)):
+        state = _built_state(user_id, topic_tag, group)
+        pending.append({"user_id": user_id, "topic_tag": topic_tag,
+                        **{column: getattr(state, column) for column in STATE_COLUMNS}})
+        topics += 1
+        if len(pending) >= batch_size:
+            db.bulk_insert_mappings(TopicMastery, pending)
+            pending = []
+    if pending:
+        db.bulk_insert_mappings(TopicMastery, pending)
+    db.commit()
+    return {"topics": topics}
+
+
+if __name__ == "__main__":
+    from ..database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Per-user topic mastery rollup.")
+    parser.add_argument("--rebuild", action="store_true", help="Recompute every topic from quiz scores")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        if args.rebuild:
+            print(rebuild_all(db, args.batch_size))
+        else:
+            parser.print_help()
+    finally:
+        db.close()
@@ -0,0 +1,395 @@
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from ..models import UserHistory
+from .embedding_storage import stack_history_embeddings
+from .similarity import normalize_rows
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines: fall back to in-process locking only
+    fcntl = None
+
+# Anchored to the package, not to whatever directory the process was started from.
+VECTOR_INDEX_DIR = os.getenv(
+    "VECTOR_INDEX_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "vector_index"),
+)
+# Below this many vectors a user's index is scanned exhaustively; above it an
+# inverted-file (IVF) layout is trained and only the closest lists are probed.
+IVF_MIN_VECTORS = int(os.getenv("IVF_MIN_VECTORS", "4096"))
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "8"))
+IVF_KMEANS_ITERATIONS = 10
+VECTOR_INDEX_CACHED_USERS = int(os.getenv("VECTOR_INDEX_CACHED_USERS", "256"))
+
+
+def _record_dtype(dim: int) -> np.dtype:
+    # One fixed-size record per history row. Vectors are unit-normalised and
+    # scalar-quantised to int8 with a per-vector scale (~4x smaller than float32).
+    return np.dtype([("id", "<i8"), ("list", "<i4"), ("scale", "<f4"), ("vec", "i1", (dim,))])
+
+
+def _quantize(unit_vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    peak = np.abs(unit_vectors).max(axis=1)
+    scale = np.where(peak == 0, 1.0, peak / 127.0).astype(np.float32)
+    q = np.rint(unit_vectors / scale[:, None]).astype(np.int8)
+    return q, scale
+
+
+def _spherical_kmeans(vectors: np.ndarray, nlist: int, iterations: int = IVF_KMEANS_ITERATIONS) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    centroids = vectors[rng.choice(len(vectors), size=nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, vectors)
+        empty = ~np.any(sums, axis=1)
+        sums[empty] = centroids[empty]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+class UserVectorIndex:
+    """Approximate nearest-neighbour index over one user's prompt embeddings.
+
+    On disk a user's directory holds `meta.npz` (dimension, model, generation and
+    IVF centroids) and `vectors.<generation>.bin`, an append-only file of fixed-size
+    records. Inserts append one record under a file lock; every read first picks up
+    records appended by other workers, so all processes on the host converge on
+    the same index. Retraining (when the vector count has doubled) rewrites the
+    data file under a new generation and swaps `meta.npz` atomically.
+    """
+
+    def __init__(self, directory: str, dim: int, model_name: str):
+        self.directory = directory
+        self.dim = dim
+        self.model_name = model_name
+        self.record_dtype = _record_dtype(dim)
+        self.generation = 0
+        self.centroids = None
+        self.trained_count = 0
+        self._meta_mtime = None
+        self._offset = 0
+        self._size = 0
+        self._ids = np.empty(0, dtype=np.int64)
+        self._lists = np.empty(0, dtype=np.int32)
+        self._scales = np.empty(0, dtype=np.float32)
+        self._vecs = np.empty((0, dim), dtype=np.int8)
+        self._lock = threading.RLock()
+        self._file_lock_depth = 0
+        self._retraining = False
+        os.makedirs(directory, exist_ok=True)
+
+    # ----- files -----
+
+    @property
+    def _meta_path(self) -> str:
+        return os.path.join(self.directory, "meta.npz")
+
+    def _data_path(self, generation: int) -> str:
+        return os.path.join(self.directory, f"vectors.{generation}.bin")
+
+    def _file_lock(self):
+        handle = open(os.path.join(self.directory, "lock"), "a")
+        if fcntl:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+        return handle
+
+    def _file_unlock(self, handle):
+        if fcntl:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+        handle.close()
+
+    @contextmanager
+    def exclusive(self):
+        """Hold the in-process and cross-process locks. Re-entrant within a thread."""
+        with self._lock:
+            handle = self._file_lock() if self._file_lock_depth == 0 else None
+            self._file_lock_depth += 1
+            try:
+                yield
+            finally:
+                self._file_lock_depth -= 1
+                if handle is not None:
+                    self._file_unlock(handle)
+
+    def _write_meta(self):
+        tmp = self._meta_path + ".tmp.npz"
+        np.savez(
+            tmp,
+            dim=self.dim,
+            model=self.model_name,
+            generation=self.generation,
+            trained_count=self.trained_count,
+            centroids=self.centroids if self.centroids is not None else np.empty((0, self.dim), dtype=np.float32),
+        )
+        os.replace(tmp, self._meta_path)
+
+    def is_compatible(self) -> bool:
+        if not os.path.exists(self._meta_path):
+            return True
+        with np.load(self._meta_path) as meta:
+            return int(meta["dim"]) == self.dim and str(meta["model"]) == self.model_name
+
+    # ----- in-memory buffers -----
+
+    def _reset_buffers(self):
+        self._offset = 0
+        self._size = 0
+        self._ids = np.empty(0, dtype=np.int64)
+        self._lists = np.empty(0, dtype=np.int32)
+        self._scales = np.empty(0, dtype=np.float32)
+        self._vecs = np.empty((0, self.dim), dtype=np.int8)
+
+    def _append_records(self, records: np.ndarray):
+        needed = self._size + len(records)
+        if needed > len(self._ids):
+            capacity = max(needed, 2 * len(self._ids), 64)
+            self._ids = np.resize(self._ids, capacity)
+            self._lists = np.resize(self._lists, capacity)
+            self._scales = np.resize(self._scales, capacity)
+            vecs = np.empty((capacity, self.dim), dtype=np.int8)
+            vecs[:self._size] = self._vecs[:self._size]
+            self._vecs = vecs
+        end = self._size + len(records)
+        self._ids[self._size:end] = records["id"]
+        self._lists[self._size:end] = records["list"]
+        self._scales[self._size:end] = records["scale"]
+        self._vecs[self._size:end] = records["vec"]
+        self._size = end
+
+    def _sync(self):
+        """Pick up a new generation or records appended by any process since the last read."""
+        meta_mtime = os.path.getmtime(self._meta_path) if os.path.exists(self._meta_path) else None
+        if meta_mtime != self._meta_mtime:
+            self._meta_mtime = meta_mtime
+            if meta_mtime is not None:
+                with np.load(self._meta_path) as meta:
+                    self.generation = int(meta["generation"])
+                    self.trained_count = int(meta["trained_count"])
+                    centroids = meta["centroids"]
+                    self.centroids = centroids if len(centroids) else None
+            self._reset_buffers()
+
+        path = self._data_path(self.generation)
+        if not os.path.exists(path):
+            return
+        file_size = os.path.getsize(path)
+        usable = file_size - (file_size - self._offset) % self.record_dtype.itemsize
+        if usable <= self._offset:
+            return
+        with open(path, "rb") as f:
+            f.seek(self._offset)
+            records = np.fromfile(f, dtype=self.record_dtype, count=(usable - self._offset) // self.record_dtype.itemsize)
+        self._append_records(records)
+        self._offset = usable
+
+    # ----- public API -----
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _assign_lists(self, unit_vectors: np.ndarray) -> np.ndarray:
+        if self.centroids is None:
+            return np.full(len(unit_vectors), -1, dtype=np.int32)
+        return np.argmax(unit_vectors @ self.centroids.T, axis=1).astype(np.int32)
+
+    def add_many(self, history_ids, embeddings: np.ndarray):
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dim)
+        if len(embeddings) == 0:
+            return
+        unit = normalize_rows(embeddings)
+        q, scale = _quantize(unit)
+        with self._lock:
+            with self.exclusive():
+                self._sync()
+                if not os.path.exists(self._meta_path):
+                    self._write_meta()
+                records = np.empty(len(unit), dtype=self.record_dtype)
+                records["id"] = np.asarray(history_ids, dtype=np.int64)
+                records["list"] = self._assign_lists(unit)
+                records["scale"] = scale
+                records["vec"] = q
+                with open(self._data_path(self.generation), "ab") as f:
+                    f.write(records.tobytes())
+                self._sync()
+
+            if self._size >= IVF_MIN_VECTORS and self._size >= 2 * max(self.trained_count, IVF_MIN_VECTORS // 2) \
+                    and not self._retraining:
+                self._retraining = True
+                threading.Thread(target=self.retrain, daemon=True).start()
+
+    def add(self, history_id: int, embedding: List[float]):
+        self.add_many([history_id], [embedding])
+
+    def retrain(self):
+        """Re-cluster all vectors into ~sqrt(n) lists and rewrite them under a new generation.
+
+        k-means runs on a snapshot outside the locks so inserts and searches are
+        not held up; only the final rewrite happens under the lock.
+        """
+        try:
+            with self._lock:
+                self._sync()
+                n = self._size
+                snapshot = self._vecs[:n].astype(np.float32) * self._scales[:n, None]
+            if n < IVF_MIN_VECTORS:
+                return
+
+            nlist = int(min(1024, max(16, np.sqrt(n))))
+            rng = np.random.default_rng(0)
+            sample = snapshot[rng.choice(n, size=min(n, 64 * nlist), replace=False)]
+            centroids = _spherical_kmeans(sample, nlist).astype(np.float32)
+
+            with self.exclusive():
+                self._sync()
+                n = self._size
+                self.centroids = centroids
+                records = np.empty(n, dtype=self.record_dtype)
+                records["id"] = self._ids[:n]
+                records["list"] = self._assign_lists(self._vecs[:n].astype(np.float32) * self._scales[:n, None])
+                records["scale"] = self._scales[:n]
+                records["vec"] = self._vecs[:n]
+
+                old_generation = self.generation
+                self.generation += 1
+                self.trained_count = n
+                with open(self._data_path(self.generation), "wb") as f:
+                    f.write(records.tobytes())
+                self._write_meta()
+                self._meta_mtime = None
+                self._sync()
+                try:
+                    os.remove(self._data_path(old_generation))
+                except OSError:
+                    pass
+                print(f"DEBUG: Vector index {self.directory} retrained: {n} vectors, {nlist} lists")
+        finally:
+            self._retraining = False
+
+    def search(self, query: List[float], k: int = 5, nprobe: int = IVF_NPROBE) -> List[Tuple[int, float]]:
+        """Top-`k` (history id, approximate cosine similarity) pairs, best first."""
+        q = normalize_rows(np.asarray(query, dtype=np.float32))
+        with self._lock:
+            self._sync()
+            n = self._size
+            if n == 0 or q.shape[0] != self.dim:
+                return []
+            if self.centroids is not None and nprobe < len(self.centroids):
+                probe = np.argpartition(-(self.centroids @ q), nprobe - 1)[:nprobe]
+                # Lookup table instead of np.isin; the extra last slot maps list id -1 to False.
+                probed = np.zeros(len(self.centroids) + 1, dtype=bool)
+                probed[probe] = True
+                candidates = np.flatnonzero(probed[self._lists[:n]])
+            else:
+                candidates = np.arange(n)
+            if len(candidates) == 0:
+                return []
+            scores = (self._vecs[candidates].astype(np.float32) @ q) * self._scales[candidates]
+            ids = self._ids[candidates]
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        if len(np.unique(ids[top])) < len(top):
+            # A row indexed twice (e.g. by an insert racing a build): keep each id's best score.
+            order = np.argsort(-scores)
+            first = np.unique(ids[order], return_index=True)[1]
+            top = order[np.sort(first)[:k]]
+        # Quantisation error can push a near-duplicate slightly past 1.0.
+        return [(int(ids[i]), float(min(1.0, max(-1.0, scores[i])))) for i in top]
+
+
+class VectorIndexService:
+    """Per-user UserVectorIndex instances, built from UserHistory on first use."""
+
+    def __init__(self, root: str = VECTOR_INDEX_DIR, cached_users: int = VECTOR_INDEX_CACHED_USERS):
+        self.root = root
+        self.cached_users = cached_users
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _open(self, user_id: int, dim: int, model_name: str, db: Optional[Session]) -> Optional[UserVectorIndex]:
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is not None and index.dim == dim and index.model_name == model_name:
+                self._indexes.move_to_end(user_id)
+                return index
+
+        directory = os.path.join(self.root, str(user_id))
+        index = UserVectorIndex(directory, dim, model_name)
+        if not index.is_compatible():
+            # Embedding model changed: start over rather than mixing vector spaces.
+            for name in os.listdir(directory):
+                os.remove(os.path.join(directory, name))
+            index = UserVectorIndex(directory, dim, model_name)
+
+        index._sync()
+        if len(index) == 0:
+            if db is None:
+                return None
+            # Workers opening the same empty index must not each build it: hold the
+            # file lock across the build and re-check once it is held.
+            with index.exclusive():
+                index._sync()
+                if len(index) == 0:
+                    self._build_from_history(index, user_id, model_name, db)
+
+        with self._lock:
+            self._indexes[user_id] = index
+            while len(self._indexes) > self.cached_users:
+                self._indexes.popitem(last=False)
+        return index
+
+    @staticmethod
+    def _build_from_history(index: UserVectorIndex, user_id: int, model_name: str, db: Session, batch_size: int = 5000):
+        last_id = 0
+        while True:
+            rows = db.query(
+                UserHistory.id,
+                UserHistory.embedding_blob,
+                UserHistory.embedding_model,
+                UserHistory.embedding_dim,
+                UserHistory.embedding_vector,
+            )\
+                .filter(UserHistory.user_id == user_id, UserHistory.id > last_id)\
+                .order_by(UserHistory.id)\
+                .limit(batch_size)\
+                .all()
+            if not rows:
+                break
+            matrix, ids = stack_history_embeddings(rows, model_name, index.dim)
+            index.add_many(ids, matrix)
+            last_id = rows[-1].id
+
+    def add(self, user_id: int, history_id: int, embedding: List[float], model_name: str, db: Optional[Session] = None):
+        """Index a freshly committed UserHistory row."""
+        if not embedding:
+            return
+        index = self._open(user_id, len(embedding), model_name, db=None)
+        if index is None:
+            if db is not None:
+                # First use for this user: the build from history already includes this row.
+                self._open(user_id, len(embedding), model_name, db)
+                return
+            index = UserVectorIndex(os.path.join(self.root, str(user_id)), len(embedding), model_name)
+            with self._lock:
+                self._indexes[user_id] = index
+        index.add(history_id, embedding)
+
+    def search(self, user_id: int, embedding: List[float], model_name: str, k: int = 5,
+               db: Optional[Session] = None) -> List[Tuple[int, float]]:
+        if not embedding:
+            return []
+        index = self._open(user_id, len(embedding), model_name, db)
+        return index.search(embedding, k) if index is not None else []
+
+
+# Singleton instance
+vector_index = VectorIndexService()
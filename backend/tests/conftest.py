@@ -0,0 +1,15 @@
+import os
+import sys
+import tempfile
+
+# Keep the import-time singletons (database engine, Q-table store) away from the working tree
+_tmp = tempfile.mkdtemp(prefix="adaptive-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_tmp, 'test.db')}")
+os.environ.setdefault("Q_TABLE_STORE_PATH", os.path.join(_tmp, "q_table.db"))
+os.environ.setdefault("Q_TABLE_SNAPSHOT_PATH", os.path.join(_tmp, "q_table.json"))
+os.environ.setdefault("EMBEDDING_CACHE_PATH", os.path.join(_tmp, "embedding_cache.db"))
+os.environ.setdefault("VECTOR_INDEX_DIR", os.path.join(_tmp, "vector_index"))
+os.environ.setdefault("GROQ_API_KEY", "test")
+os.environ.setdefault("GEMINI_API_KEY", "test")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
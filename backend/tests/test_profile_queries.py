@@ -0,0 +1,59 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from api.database import Base
+from api.models import QuizScore, TelemetryLog, User, UserHistory
+from api.services.adaptive_engine import update_student_profile
+from api.services.query_metrics import count_queries
+from api.services.session_features import rebuild_all
+
+# Statements one steady-state profile update issues, however long the user's
+# history: SSI inputs, both profile records, the decision and replay-log
+# inserts, the skill index update, DKT state, its new quizzes and its update,
+# then the two profile records reloaded for the log line after the commit.
+PROFILE_UPDATE_QUERIES = 10
+
+
+@pytest.fixture
+def db(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'profile.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def _seed_user(db, username: str, history_rows: int) -> int:
+    user = User(username=username, email=f"{username}@example.com", hashed_password="x")
+    db.add(user)
+    db.flush()
+    for i in range(history_rows):
+        session_id = f"{username}-s{i // 10}"
+        db.add(UserHistory(
+            user_id=user.id, session_id=session_id, prompt=f"question {i}", response="answer",
+            telemetry_data={"copy_count": i % 3, "paste_count": i % 2, "tab_switch_count": 1, "time_to_query_ms": 2000},
+        ))
+        db.add(TelemetryLog(user_id=user.id, session_id=session_id, event_type="Paste", latency_ms=100))
+        db.add(QuizScore(user_id=user.id, topic_tag=f"topic {i % 7}", score=i % 6, total_questions=5))
+    db.commit()
+    rebuild_all(db)
+    return user.id
+
+
+def _profile_update_queries(db, user_id: int) -> int:
+    update_student_profile(user_id, db)  # first update creates the profile records
+    db.add(QuizScore(user_id=user_id, topic_tag="topic 0", score=3, total_questions=5))
+    db.commit()
+    with count_queries() as counter:
+        update_student_profile(user_id, db)
+    return counter.queries
+
+
+def test_profile_update_query_count_is_constant(db):
+    small = _profile_update_queries(db, _seed_user(db, "small", history_rows=5))
+    large = _profile_update_queries(db, _seed_user(db, "large", history_rows=300))
+
+    assert small == PROFILE_UPDATE_QUERIES
+    assert large == PROFILE_UPDATE_QUERIES
@@ -0,0 +1,44 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from api.database import Base
+from api.models import SessionFeatureState, User
+from api.services.state_rows import _insert_if_missing, claim_row
+
+
+@pytest.fixture
+def sessions(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'state.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    make_session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    with make_session() as db:
+        db.add(User(id=1, username="u", email="u@example.com", hashed_password="x"))
+        db.commit()
+    yield make_session
+    engine.dispose()
+
+
+def test_claim_row_creates_missing_row(sessions):
+    with sessions() as db:
+        state, created = claim_row(db, SessionFeatureState, user_id=1, session_id="s")
+        assert created
+        assert state.turn_count == 0
+        db.commit()
+        assert db.query(SessionFeatureState).count() == 1
+
+
+def test_claim_row_returns_row_created_concurrently(sessions):
+    # The other transaction won the race: its row is committed, the insert here must not fail
+    with sessions() as other:
+        state, created = claim_row(other, SessionFeatureState, user_id=1, session_id="s")
+        state.turn_count = 3
+        other.commit()
+
+    with sessions() as db:
+        assert not _insert_if_missing(db, SessionFeatureState, {"user_id": 1, "session_id": "s"})
+        state, created = claim_row(db, SessionFeatureState, user_id=1, session_id="s")
+        assert not created
+        assert state.turn_count == 3
+        db.commit()
+        assert db.query(SessionFeatureState).count() == 1